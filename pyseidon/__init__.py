@@ -14,25 +14,45 @@ sys.path.append(os.path.join(local,'tidegaugeClass'))
 sys.path.append(os.path.join(local,'validationClass'))
 sys.path.append(os.path.join(local,'utilities'))
 
-#Local import
-from utilities import *
-from adcpClass import *
-from drifterClass import *
-from tidegaugeClass import *
-from stationClass import *
-from fvcomClass import *
-from validationClass import *
+import types
+import importlib
 
 # Custom error
 from pyseidon.utilities.pyseidon_error import PyseidonError
+from pyseidon.utilities.lazy_import import set_headless
+
+#Local import, classes imported on first use with their dependencies,
+#i.e. 'from pyseidon import Station' never loads FVCOM, Validation,...
+_EXPORTS = {'FVCOM': 'fvcomClass', 'ADCP': 'adcpClass', 'Drifter': 'drifterClass',
+            'TideGauge': 'tidegaugeClass', 'Station': 'stationClass',
+            'StationDataset': 'stationClass', 'Validation': 'validationClass'}
+
+class _LazyPackage(types.ModuleType):
+    """pyseidon package importing its classes on first access"""
+    def __getattr__(self, name):
+        if name in _EXPORTS:
+            value = getattr(importlib.import_module('pyseidon.' + _EXPORTS[name]),
+                            name)
+        elif name == 'utilities':
+            value = importlib.import_module('pyseidon.utilities')
+        else:
+            raise AttributeError("'module' object has no attribute '" + name + "'")
+        setattr(self, name, value)
+        return value
 
 #Permission info for OpenDap server
 #print "OpenDap server connexion info:"
 
 __version__ = '2.0'
 __all__ = ["FVCOM", "ADCP", "Drifter", "TideGauge",\
-           "Validation", "Station", "utilities", "PyseidonError"]
+           "Validation", "Station", "StationDataset", "utilities", "PyseidonError",\
+           "set_headless"]
 __authors__ = ['Wesley Bowman, Thomas Roc, Jonathan Smith']
 __licence__ = 'GNU Affero GPL v3.0'
 __copyright__ = 'Copyright (c) 2014 EcoEnergyII'
 
+#Swap this module for its lazy version, the original one being kept alive
+_lazy = _LazyPackage(__name__)
+_lazy.__dict__.update(sys.modules[__name__].__dict__)
+_lazy._module = sys.modules[__name__]
+sys.modules[__name__] = _lazy
@@ -3,12 +3,16 @@
 from __future__ import division
 import numpy as np
 import scipy.io as sio
-import h5py
+
+#Utility import
+from pyseidon.utilities.lazy_import import LazyModule, LazyObject
 
 #Local import
 from variablesAdcp import _load_adcp
 from functionsAdcp import *
-from plotsAdcp import *
+
+#Heavy dependencies imported on first use
+h5py = LazyModule('h5py')
 
 
 class ADCP:
@@ -55,13 +59,14 @@ class ADCP:
             self.Data = h5py.File(filename, 'r')
         #TR_comments: Initialize class structure
         self.Variables = _load_adcp(self, self.History, debug=self._debug)
-        self.Plots = PlotsAdcp(self.Variables, debug=self._debug)
+        self.Plots = LazyObject('plotsAdcp', 'PlotsAdcp',
+                                self.Variables, debug=self._debug)
         self.Utils = FunctionsAdcp(self.Variables,
                                    self.Plots,
                                    self.History,
                                    debug=self._debug) 
 
         ##Re-assignement of utility functions as methods
-        self.dump_profile_data = self.Plots._dump_profile_data_as_csv
+        self.dump_profile_data = self.Plots._method('_dump_profile_data_as_csv')
 
         return
\ No newline at end of file
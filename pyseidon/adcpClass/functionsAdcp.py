@@ -8,12 +8,16 @@ import numexpr as ne
 import datetime
 from pyseidon.utilities.miscellaneous import *
 from pyseidon.utilities.BP_tools import *
-from utide import solve, reconstruct
+from pyseidon.utilities.lazy_import import lazy_function
 import time
 
 # Custom error
 from pyseidon_error import PyseidonError
 
+#Imported on first use
+solve = lazy_function('utide', 'solve')
+reconstruct = lazy_function('utide', 'reconstruct')
+
 class FunctionsAdcp:
     """ **'Utils' subset of FVCOM class gathers useful functions** """
     def __init__(self, variable, plot, History, debug=False):
@@ -4,9 +4,12 @@
 from __future__ import division
 import numpy as np
 from numpy.ma import MaskError
-import h5py
+from pyseidon.utilities.lazy_import import LazyModule
 from pyseidon.utilities.miscellaneous import mattime_to_datetime
 
+#Imported on first use
+h5py = LazyModule('h5py')
+
 class _load_adcp:
     """
     **'Variables' subset in ADCP class**
@@ -4,12 +4,16 @@
 from __future__ import division
 
 import scipy.io as sio
-import h5py
+
+#Utility import
+from pyseidon.utilities.lazy_import import LazyModule, LazyObject
 
 #Local import
 from variablesDrifter import _load_drifter
 # from functionsDrifter import FunctionsDrifter
-from plotsDrifter import *
+
+#Heavy dependencies imported on first use
+h5py = LazyModule('h5py')
 
 
 class Drifter:
@@ -74,13 +78,14 @@ class Drifter:
 
         #Initialize class structure
         self.Variables = _load_drifter(self, self.History, debug=self._debug)
-        self.Plots = PlotsDrifter(self.Variables, debug=self._debug)
+        self.Plots = LazyObject('plotsDrifter', 'PlotsDrifter',
+                                self.Variables, debug=self._debug)
         #self.Utils = FunctionsAdcp(self.Variables,
         #                           self.Plots,
         #                           self.History,
         #                           debug=self._debug) 
 
         ##Re-assignement of utility functions as methods
-        self.dump_data_as_csv = self.Plots._dump_data_as_csv    
+        self.dump_data_as_csv = self.Plots._method('_dump_data_as_csv')    
 
         return
\ No newline at end of file
@@ -7,21 +7,47 @@ from scipy.interpolate import interp1d
 import numexpr as ne
 import datetime
 from pyseidon.utilities.interpolation_utils import *
+from pyseidon.utilities.particle_tracking import _TrackingMesh, track_particles
 from pyseidon.utilities.miscellaneous import *
 from pyseidon.utilities.BP_tools import *
-from utide import solve, reconstruct
+from pyseidon.utilities.lazy_import import lazy_function
 import time
 import matplotlib.tri as Tri
-from pydap.exceptions import ServerError
+from pyseidon.utilities.opendap_access import server_error
 from pyseidon.utilities.pyseidon_error import PyseidonError
+from pyseidon.utilities.derived_store import StoreBinding
+from pyseidon.utilities.profiling import Profiler, profiled
+from pyseidon.utilities.memory_budget import memory_budget
+from pyseidon.utilities.streaming_stats import time_statistics
+from pyseidon.utilities.turbine_farm import *
+from pyseidon.utilities.tidal_filters import filter_weights, low_pass
+from pyseidon.utilities.harmonic_prediction import HarmonicPredictor
+from pyseidon.utilities.regridding import RasterRegridder, raster_key
+
+#Imported on first use
+solve = lazy_function('utide', 'solve')
+reconstruct = lazy_function('utide', 'reconstruct')
 
 class FunctionsFvcom:
     """
     **'Util2D' subset of FVCOM class gathers useful functions and methods for 2D and 3D runs**
     """
-    def __init__(self, variable, grid, plot, History, debug):
+    def __init__(self, variable, grid, plot, History, debug, store=None,
+                 profiler=None, memory=None):
         self._debug = debug
         self._plot = plot
+        #Derived-field store, see DerivedStore
+        if store is None:
+            store = StoreBinding()
+        self._store = store
+        #Profiled calls, see Profiler
+        if profiler is None:
+            profiler = Profiler()
+        self._profiler = profiler
+        #Memory budget, see MemoryBudget
+        if memory is None:
+            memory = memory_budget()
+        self._memory = memory
         #Create pointer to FVCOM class
         setattr(self, '_var', variable)
         setattr(self, '_grid', grid)
@@ -65,6 +91,7 @@ class FunctionsFvcom:
         if debug:
             print '...Passed'   
 
+    @profiled('derived')
     def hori_velo_norm(self, debug=False):
         """
         This method computes  a new variable: 'horizontal velocity norm' (m/s)
@@ -72,21 +99,33 @@ class FunctionsFvcom:
 
         Notes:
           - Can take time over the full domain
+          - computed by blocks fitting in the memory budget, see MemoryBudget
         """
         debug = debug or self._debug
         if debug:
             print 'Computing horizontal velocity norm...'
 
-        try:
-            u = self._var.ua[:]
-            v = self._var.va[:]
-            vel = ne.evaluate('sqrt(u**2 + v**2)').squeeze()
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'hori_velo_norm', self._History):
+            return
 
-        except (MemoryError, ServerError) as e:
-            if e == ServerError:
+        try:
+            #u, v, their squares and the norm held at once
+            shape = self._var.ua.shape
+            #Input precision kept, ex: float32 netCDF variables
+            dtype = np.result_type(self._var.ua.dtype, self._var.va.dtype)
+            vel = self._memory.allocate(shape, dtype=dtype, name='hori_velo_norm')
+            for block in self._memory.blocks(shape, dtype=dtype, copies=5):
+                u = np.asarray(self._var.ua[block])
+                v = np.asarray(self._var.va[block])
+                vel[block] = ne.evaluate('sqrt(u**2 + v**2)')
+            vel = vel.squeeze()
+
+        except (MemoryError, server_error()) as e:
+            if isinstance(e, server_error()):
                 print '---Data too large for server---'
                 print 'Tip: Save data on your machine or use partial data'
-            elif e == MemoryError:          
+            elif isinstance(e, MemoryError):          
                 print '---Data too large for machine memory---'
                 print 'Tip: use ax or tx during class initialisation'
                 print '---  to use partial data'
@@ -94,6 +133,7 @@ class FunctionsFvcom:
 
         #Custom return    
         setattr(self._var, 'hori_velo_norm', vel)
+        self._store.save('hori_velo_norm', vel, depends=['ua', 'va'])
           
         # Add metadata entry
         self._History.append('horizontal velocity norm computed')
@@ -102,6 +142,7 @@ class FunctionsFvcom:
         if debug:
             print '...Passed'
 
+    @profiled('derived')
     def flow_dir(self, debug=False):
         """"
         This method create new variable 'depth averaged flow directions' (deg.)
@@ -114,16 +155,20 @@ class FunctionsFvcom:
         if debug or self._debug:
             print 'Computing flow directions...'
 
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'depth_av_flow_dir', self._History):
+            return
+
         try:
             u = self._var.ua[:]
             v = self._var.va[:]
             dirFlow = np.rad2deg(np.arctan2(v,u))
 
-        except (MemoryError, ServerError) as e:
-            if e == ServerError:
+        except (MemoryError, server_error()) as e:
+            if isinstance(e, server_error()):
                 print '---Data too large for server---'
                 print 'Tip: save data on your machine or use partial data'
-            elif e == MemoryError:          
+            elif isinstance(e, MemoryError):          
                 print '---Data too large for machine memory---'
                 print 'Tip: use ax or tx during class initialisation'
                 print '---  to use partial data'
@@ -131,6 +176,7 @@ class FunctionsFvcom:
 
         #Custom return    
         setattr(self._var, 'depth_av_flow_dir', dirFlow)
+        self._store.save('depth_av_flow_dir', dirFlow, depends=['ua', 'va'])
 
         # Add metadata entry
         self._History.append('depth averaged flow directions computed')
@@ -139,6 +185,7 @@ class FunctionsFvcom:
         if debug or self._debug:
             print '...Passed'
 
+    @profiled('interpolator')
     def flow_dir_at_point(self, pt_lon, pt_lat, t_start=[], t_end=[], time_ind=[],
                           graph=True, exceedance=False, debug=False):
         """
@@ -167,34 +214,17 @@ class FunctionsFvcom:
             print 'Computing flow directions at point...'
 
         # Find time interval to work in
-        argtime = []
-        if not time_ind==[]:
-            argtime = time_ind
-        elif not t_start==[]:
-            if type(t_start)==str:
-                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-            else:
-                argtime = np.arange(t_start, t_end)
-
-        #Choose the right pair of velocity components
-        if type(self._var.ua).__name__=='Variable': #Fix for netcdf4 lib
-            u = self._var.ua[:]
-            v = self._var.va[:]
-        else:
-            u = self._var.ua
-            v = self._var.va            
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
 
-        #Extraction at point
+        #Extraction at point, only the time window is read
         # Finding closest point
         index = self.index_finder(pt_lon, pt_lat, debug=False)
         if debug:
             print 'Extraction of u and v at point...'
-        U = self.interpolation_at_point(u, pt_lon, pt_lat, index=index,
-                                        debug=debug)  
-        V = self.interpolation_at_point(v, pt_lon, pt_lat, index=index,
-                                        debug=debug)       
+        U = self._point_extraction(self._var.ua, pt_lon, pt_lat, index=index,
+                                   time_ind=argtime, debug=debug)
+        V = self._point_extraction(self._var.va, pt_lon, pt_lat, index=index,
+                                   time_ind=argtime, debug=debug)
 
         #Compute directions
         if debug:
@@ -204,11 +234,6 @@ class FunctionsFvcom:
         #Compute velocity norm
         norm = ne.evaluate('sqrt(U**2 + V**2)').squeeze()
 
-        #use only the time indices of interest
-        if not argtime==[]:
-            dirFlow = dirFlow[argtime[:]]
-            norm = norm[argtime[:]] 
-
         if debug:
             print '...Passed'
         #Rose diagram
@@ -219,6 +244,7 @@ class FunctionsFvcom:
 
         return dirFlow, norm
 
+    @profiled('analysis')
     def bidirectionality(self, pt_lon, pt_lat, debug=False):
         """"
         This function computes the depth averaged bidirectionality (deg.)
@@ -236,7 +262,6 @@ class FunctionsFvcom:
         """
         debug = debug or self._debug
         if debug:
-            start = time.time()
             print 'Computing bidirectonality...'
         ##compute necessary fields
         if not hasattr(self._var, 'hori_velo_norm'):
@@ -258,12 +283,10 @@ class FunctionsFvcom:
         bidir[bidir < 0] += 180.0
         bidir[bidir > 90] = 180.0 - bidir[bidir > 90]
 
-        if debug:
-            end = time.time()
-            print "...processing time: ", (end - start)                      
                 
         return bidir 
 
+    @profiled('analysis')
     def ebb_flood_split_at_point(self, pt_lon, pt_lat,
                                  t_start=[], t_end=[], time_ind=[], debug=False):
         """
@@ -294,43 +317,20 @@ class FunctionsFvcom:
         """
         debug = debug or self._debug
         if debug:
-            start = time.time()
             print 'Computing principal flow directions...'
 
         # Find time interval to work in
-        argtime = []
-        if not time_ind==[]:
-            argtime = time_ind
-        elif not t_start==[]:
-            if type(t_start)==str:
-                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-            else:
-                argtime = np.arange(t_start, t_end)
-
-        #Choose the right pair of velocity components
-        if type(self._var.ua).__name__=='Variable': #Fix for netcdf4 lib
-            u = self._var.ua[:]
-            v = self._var.va[:]
-        else:
-            u = self._var.ua
-            v = self._var.va
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
 
-        #Extraction at point
+        #Extraction at point, only the time window is read
         # Finding closest point
         index = self.index_finder(pt_lon, pt_lat, debug=False)
         if debug:
             print 'Extraction of u and v at point...'
-        U = self.interpolation_at_point(u, pt_lon, pt_lat, index=index,
-                                        debug=debug)  
-        V = self.interpolation_at_point(v, pt_lon, pt_lat, index=index,
-                                        debug=debug) 
-
-        #use only the time indices of interest
-        if not argtime==[]:
-            U = U[argtime[:]]
-            V = V[argtime[:]] 
+        U = self._point_extraction(self._var.ua, pt_lon, pt_lat, index=index,
+                                   time_ind=argtime, debug=debug)
+        V = self._point_extraction(self._var.va, pt_lon, pt_lat, index=index,
+                                   time_ind=argtime, debug=debug)
 
         #WB version of BP's principal axis
         #Assuming principal axis = flood heading
@@ -356,12 +356,10 @@ class FunctionsFvcom:
         ebbIndex = np.arange(dir_PA.shape[0])
         ebbIndex = np.delete(ebbIndex,floodIndex[:]) 
 
-        if debug:
-            end = time.time()
-            print "...processing time: ", (end - start)
 
         return floodIndex[0], ebbIndex, pr_axis, pr_ax_var
 
+    @profiled('analysis')
     def speed_histogram(self, pt_lon, pt_lat, t_start=[], t_end=[], time_ind=[],
                         debug=False, dump=False, **kwargs):
         """
@@ -386,7 +384,6 @@ class FunctionsFvcom:
         """
         debug = debug or self._debug
         if debug:
-            start = time.time()
             print 'Computing speed histogram...'
 
         pI, nI, pa, pav = self.ebb_flood_split_at_point(pt_lon, pt_lat,
@@ -410,9 +407,6 @@ class FunctionsFvcom:
                              yLabel='Occurrences (%)',
                              dump=dump, **kwargs)
    
-        if debug:
-            end = time.time()
-            print "...processing time: ", (end - start)
 
     def index_finder(self, pt_lon, pt_lat, debug=False):
         """
@@ -437,10 +431,401 @@ class FunctionsFvcom:
             finder = self._grid.triangleLL.get_trifinder()
         else:
             finder = self._grid.triangleLL.get_trifinder()
-        index = int(finder(pt_lon,pt_lat))
+        if np.ndim(pt_lon) > 0:
+            #Bulk search for many points
+            index = np.asarray(finder(np.asarray(pt_lon, dtype=float),
+                                      np.asarray(pt_lat, dtype=float))).astype(int)
+        else:
+            index = int(finder(pt_lon,pt_lat))
 
         return index
 
+    @profiled('interpolator')
+    def point_stencils(self, pt_lon, pt_lat, index=[], node=False, debug=False):
+        """
+        Computes interpolation stencils, i.e. surrounding indices and weights,
+        at any given locations.
+
+        Inputs:
+          - pt_lon = longitudes in decimal degrees East, 1D array
+          - pt_lat = latitudes in decimal degrees North, 1D array
+
+        Outputs:
+          - cols = surrounding node or element indices, 2D array of integers
+                   (npts, 3) for nodes and (npts, 4) for elements
+          - weights = interpolation weights, 2D array (npts, 3 or 4)
+
+        Options:
+          - index = surrounding element indices, 1D array of integers.
+                    Use only if already known
+          - node = True for node variables, False for element variables
+
+        *Notes*
+          - points outside of the domain have nan weights
+          - same interpolation scheme as interpolation_at_point
+        """
+        debug = (debug or self._debug)
+        pt_lon = np.asarray(pt_lon, dtype=float).ravel()
+        pt_lat = np.asarray(pt_lat, dtype=float).ravel()
+        if len(index) == 0:
+            index = self.index_finder(pt_lon, pt_lat, debug=False)
+        index = np.asarray(index, dtype=int).ravel()
+        outside = (index == -1)
+        ind = index.copy()
+        ind[outside] = 0
+
+        #Mitchell's method to convert deg. coordinates to relative coordinates in meters
+        lon = self._grid.lon[:]
+        lat = self._grid.lat[:]
+        trinodes = self._grid.trinodes[:]
+        tri = np.asarray(trinodes)[ind, :].astype(int)
+        lonweight = lon[tri].sum(axis=1) / 3.0
+        latweight = lat[tri].sum(axis=1) / 3.0
+        pt_y = TPI * (pt_lat - latweight)
+        dx_sph = pt_lon - lonweight
+        dx_sph[dx_sph > 180.0] -= 360.0
+        dx_sph[dx_sph < -180.0] += 360.0
+        pt_x = TPI * np.cos(np.deg2rad(pt_lat + latweight)*0.5) * dx_sph
+
+        if node:
+            cols, weights = node_stencils(pt_x, pt_y, ind, trinodes,
+                                          self._grid.aw0, self._grid.awx,
+                                          self._grid.awy, debug=debug)
+        else:
+            cols, weights = element_stencils(pt_x, pt_y, ind, self._grid.triele[:],
+                                             self._grid.a1u, self._grid.a2u,
+                                             debug=debug)
+        # nan weights if outside of domain
+        weights[outside, :] = np.nan
+
+        return cols, weights
+
+    @profiled('interpolator')
+    def regrid(self, var, raster_lon, raster_lat, t_start=[], t_end=[],
+               time_ind=[], debug=False):
+        """
+        Regrids any given variable on a regular lon/lat raster, ex: for
+        plotting or GIS export.
+
+        Inputs:
+          - var = any FVCOM variable, numpy array, netcdf variable or OpenDap
+                  proxy, dim=(nele or nnode), (time, nele or nnode) or
+                  (time, nlevel, nele or nnode)
+          - raster_lon = raster cell centre longitudes, 1D array (nx)
+          - raster_lat = raster cell centre latitudes, 1D array (ny)
+
+        Outputs:
+          - raster = regridded variable, dim=(ny, nx), (time, ny, nx) or
+                     (time, nlevel, ny, nx), nan on land
+
+        Options:
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+
+        *Notes*
+          - the sparse barycentric operator of each raster is computed once,
+            kept and cached in the derived store if any, see RasterRegridder
+        """
+        debug = (debug or self._debug)
+        if debug: print "Regridding..."
+        if not hasattr(self._grid, 'triangleLL'):
+            self._grid.triangleLL = Tri.Triangulation(self._grid.lon[:], self._grid.lat[:],
+                                                      triangles=self._grid.trinodes[:])
+        if not hasattr(self, '_regridders'):
+            self._regridders = {}
+        key = raster_key(self._grid.lon[:], self._grid.lat[:], self._grid.trinodes[:],
+                         raster_lon, raster_lat)
+        if not key in self._regridders:
+            self._regridders[key] = RasterRegridder(self._grid.lon[:], self._grid.lat[:],
+                                                    self._grid.trinodes[:],
+                                                    raster_lon, raster_lat,
+                                                    finder=self._grid.triangleLL.get_trifinder(),
+                                                    directory=self._store.folder('raster'),
+                                                    debug=debug)
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+
+        return self._regridders[key].regrid(var, time_ind=argtime,
+                                            memory=self._memory, debug=debug)
+
+    @profiled('interpolator')
+    def interpolation_at_points(self, var, pt_lon, pt_lat, index=[],
+                                time_ind=slice(None), debug=False):
+        """
+        This function interpolates any given variables at many locations at once.
+
+        Inputs:
+          - var = any FVCOM grid data or variable, numpy array or netcdf variable
+          - pt_lon = longitudes in decimal degrees East, 1D array
+          - pt_lat = latitudes in decimal degrees North, 1D array
+
+        Outputs:
+           - varInterp = var interpolated at (pt_lon, pt_lat),
+                         array (npts), (ntime, npts) or (ntime, nlevel, npts)
+
+        Options:
+          - index = surrounding element indices, 1D array of integers.
+                    Use only if already known
+          - time_ind = time indices to read, slice or list of integers
+
+        *Notes*
+          - only the surrounding nodes/elements of the points are read,
+            so var does not need to be loaded in memory
+        """
+        debug = (debug or self._debug)
+        if debug:
+            print 'Interpolating at points...'
+        node = (var.shape[-1] == self._grid.nnode)
+        cols, weights = self.point_stencils(pt_lon, pt_lat, index=index,
+                                            node=node, debug=debug)
+        varInterp = apply_stencils(var, cols, weights, time_ind=time_ind,
+                                   debug=debug)
+        if debug:
+            print '...Passed'
+
+        return varInterp
+
+    @profiled('interpolator')
+    def interpolation_along_track(self, var, pt_time, pt_lon, pt_lat, level=None,
+                                  index=[], debug=False):
+        """
+        This function samples any given variables along a space-time track,
+        i.e. drifter trajectory.
+
+        Inputs:
+          - var = any FVCOM variable, numpy array or netcdf variable,
+                  dim=(time, nnode or nele) or (time, level, nnode or nele)
+          - pt_time = times in matlab time, 1D array
+          - pt_lon = longitudes in decimal degrees East, 1D array
+          - pt_lat = latitudes in decimal degrees North, 1D array
+
+        Outputs:
+           - varInterp = var along the track, dim=(npts) or (npts, nlevel)
+
+        Options:
+          - level = vertical level to sample if var is 3D, integer.
+                    0 being the surface
+          - index = surrounding element indices, 1D array of integers.
+                    Use only if already known
+
+        *Notes*
+          - linear interpolation in time between the bracketing model time steps
+          - points outside of the domain or of the simulated period are nan
+        """
+        debug = (debug or self._debug)
+        if debug:
+            print 'Interpolating along track...'
+
+        pt_time = np.asarray(pt_time, dtype=float).ravel()
+        node = (var.shape[-1] == self._grid.nnode)
+        cols, weights = self.point_stencils(pt_lon, pt_lat, index=index,
+                                            node=node, debug=debug)
+
+        #Bracketing model time steps
+        mtime = self._var.matlabTime[:]
+        nt = mtime.shape[0]
+        t1 = np.clip(np.searchsorted(mtime, pt_time, side='right'), 1, nt - 1)
+        t0 = t1 - 1
+        dt = mtime[t1] - mtime[t0]
+        dt[dt == 0.0] = 1.0
+        w1 = np.clip((pt_time - mtime[t0]) / dt, 0.0, 1.0)
+        outside = (pt_time < mtime[0]) | (pt_time > mtime[-1])
+
+        #Only read the needed time steps and columns
+        steps, tinv = np.unique(np.hstack((t0, t1)), return_inverse=True)
+        uniq, inv = np.unique(cols, return_inverse=True)
+        inv = inv.reshape(cols.shape)
+        sub = gather_columns(var, uniq, time_ind=steps, debug=debug)
+        if not level is None:
+            sub = sub[:, level, :]
+        if sub.ndim == 3:
+            #columns first, levels last
+            sub = np.swapaxes(sub, 1, 2)
+            w = weights[:, :, None]
+            w1 = w1[:, None]
+        else:
+            w = weights
+        npts = t0.shape[0]
+        v0 = (sub[tinv[:npts][:, None], inv] * w).sum(axis=1)
+        v1 = (sub[tinv[npts:][:, None], inv] * w).sum(axis=1)
+        varInterp = (1.0 - w1) * v0 + w1 * v1
+        varInterp[outside] = np.nan
+
+
+        return varInterp
+
+    @profiled('analysis')
+    def particle_tracking(self, pt_lon, pt_lat, t_start, t_end, dt=60.0, sigma=None,
+                          every=1, workers=1, debug=False):
+        """
+        This function advects virtual particles through the simulated flow.
+
+        Inputs:
+          - pt_lon = initial longitudes in decimal degrees East, 1D array
+          - pt_lat = initial latitudes in decimal degrees North, 1D array
+          - t_start = release time, as string ('yyyy-mm-dd hh:mm:ss') or matlab time
+          - t_end = end time, as string ('yyyy-mm-dd hh:mm:ss') or matlab time
+
+        Outputs:
+          - times = output times in matlab time, 1D array (nout)
+          - lon, lat = trajectories in decimal degrees, 2D arrays (nout, npts)
+          - sig = sigma trajectories, 2D array (nout, npts). None if 2D
+          - stuck = particles having left the domain, 1D boolean array
+
+        Options:
+          - dt = time step in seconds, float
+          - sigma = initial sigma coordinates, 0 = surface and -1 = bottom,
+                    float or 1D array. Only for 3D runs, tracking done with
+                    ua and va if None
+          - every = positions stored every 'every' time steps, integer
+          - workers = number of processes, integer
+
+        *Notes*
+          - 4th order Runge-Kutta scheme, elements being found by walking
+            through neighbouring elements
+          - only the simulated period between t_start and t_end is loaded
+        """
+        debug = (debug or self._debug)
+        if debug:
+            print 'Tracking particles...'
+
+        if type(t_start)==str:
+            t_start = datetime_to_mattime(
+                      datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S'))
+            t_end = datetime_to_mattime(
+                    datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S'))
+
+        #Triangulation not stored in pickle files and caches
+        if not hasattr(self._grid, 'triangleLL'):
+            self._grid.triangleLL = Tri.Triangulation(self._grid.lon[:],
+                                    self._grid.lat[:],
+                                    triangles=self._grid.trinodes[:])
+
+        #Simulated period needed
+        mtime = self._var.matlabTime[:]
+        first = max(int(np.searchsorted(mtime, t_start, side='right')) - 1, 0)
+        last = min(int(np.searchsorted(mtime, t_end, side='left')) + 1, mtime.shape[0])
+        tw = slice(first, last)
+
+        try:
+            if (sigma is None) or (not self._var._3D):
+                mesh = _TrackingMesh(self._grid, mtime[tw],
+                                     np.asarray(self._var.ua[tw, :]),
+                                     np.asarray(self._var.va[tw, :]))
+            else:
+                ww = None
+                el = None
+                if hasattr(self._var, 'ww'):
+                    ww = np.asarray(self._var.ww[tw, :, :])
+                    el = np.asarray(self._var.el[tw, :])
+                mesh = _TrackingMesh(self._grid, mtime[tw],
+                                     np.asarray(self._var.u[tw, :, :]),
+                                     np.asarray(self._var.v[tw, :, :]),
+                                     ww=ww, el=el)
+        except (MemoryError, server_error()) as e:
+            if isinstance(e, server_error()):
+                print '---Data too large for server---'
+                print 'Tip: Save data on your machine or use partial data'
+            else:
+                print '---Data too large for machine memory---'
+                print 'Tip: use ax or tx during class initialisation'
+                print '---  to use partial data'
+            raise
+
+        times, lon, lat, sig, stuck = track_particles(mesh, pt_lon, pt_lat,
+                                                      t_start, t_end, dt=dt,
+                                                      sigma0=sigma, every=every,
+                                                      workers=workers, debug=debug)
+        if debug:
+            print '...Passed'
+
+        return times, lon, lat, sig, stuck
+
+    def virtual_drifter(self, drifter, dt=60.0, sigma=None, debug=False):
+        """
+        This function releases a virtual drifter at the first position of
+        an observed drifter and samples its track at the observed times.
+
+        Inputs:
+          - drifter = PySeidon Drifter object
+
+        Outputs:
+          - lon, lat = virtual drifter positions at the drifter times, 1D arrays
+
+        Options:
+          - dt = time step in seconds, float
+          - sigma = sigma coordinate of the drifter, float. Only for 3D runs
+        """
+        debug = (debug or self._debug)
+        obsTime = drifter.Variables.matlabTime[:]
+        obsLon = drifter.Variables.lon[:]
+        obsLat = drifter.Variables.lat[:]
+        t_end = min(obsTime[-1], self._var.matlabTime[-1])
+        times, lon, lat, sig, stuck = self.particle_tracking(
+                                             [obsLon[0]], [obsLat[0]],
+                                             obsTime[0], t_end, dt=dt,
+                                             sigma=sigma, debug=debug)
+        lonV = np.interp(obsTime, times, lon[:, 0], right=np.nan)
+        latV = np.interp(obsTime, times, lat[:, 0], right=np.nan)
+
+        return lonV, latV
+
+    def _time_window(self, t_start=[], t_end=[], time_ind=[], debug=False):
+        """
+        Resolves the time window of the *_at_point methods.
+
+        Options:
+          - t_start = start time, as a string ('yyyy-mm-dd hh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-dd hh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+
+        Outputs:
+          - argtime = slice if the window is contiguous, 1D array of indices
+                      otherwise, slice(None) if no window is given
+        """
+        argtime = slice(None)
+        if not time_ind==[]:
+            argtime = time_ind
+        elif not t_start==[]:
+            if type(t_start)==str:
+                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
+                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
+                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
+            else:
+                argtime = np.arange(t_start, t_end)
+
+        return as_slice(argtime)
+
+    def _point_extraction(self, var, pt_lon, pt_lat, index=[],
+                          time_ind=slice(None), debug=False):
+        """
+        Interpolates any given variable at a point, only the time window and
+        the surrounding nodes or elements being read.
+
+        Inputs:
+          - var = any FVCOM grid data or variable, numpy array, netcdf variable
+                  or OpenDap proxy
+          - pt_lon = longitude in decimal degrees East, float number
+          - pt_lat = latitude in decimal degrees North, float number
+
+        Outputs:
+          - varInterp = var at (pt_lon, pt_lat), dim=(window) or (window, nlevel)
+
+        Options:
+          - index = element index, integer. Use only if already known
+          - time_ind = time window, slice or 1D array of integers
+        """
+        if index == []:
+            index = self.index_finder(pt_lon, pt_lat, debug=False)
+        if type(index)==list:
+            index = index[0]
+        varInterp = self.interpolation_at_points(var, [pt_lon], [pt_lat],
+                                                 index=[index], time_ind=time_ind,
+                                                 debug=debug)
+
+        return varInterp[..., 0]
+
+    @profiled('interpolator')
     def interpolation_at_point(self, var, pt_lon, pt_lat, index=[], debug=False):
         """
         This function interpolates any given variables at any give location.
@@ -463,7 +848,6 @@ class FunctionsFvcom:
         debug = (debug or self._debug)
         if debug:
             print 'Interpolaling at point...'
-        if debug: start = time.time()
 
         if index == []:
             index = self.index_finder(pt_lon, pt_lat, debug=False)
@@ -484,7 +868,6 @@ class FunctionsFvcom:
             latweight = (lat[int(trinodes[index,0])]\
                        + lat[int(trinodes[index,1])]\
                        + lat[int(trinodes[index,2])]) / 3.0
-            TPI=111194.92664455874 #No sure what is this coeff, yet comes from FVCOM
             pt_y = TPI * (pt_lat - latweight)
             dx_sph = pt_lon - lonweight
             if (dx_sph > 180.0):
@@ -503,12 +886,10 @@ class FunctionsFvcom:
                                           self._grid.a1u, self._grid.a2u,
                                           debug=debug)
 
-        if debug:
-            end = time.time()
-            print "Processing time: ", (end - start)
 
         return varInterp
 
+    @profiled('analysis')
     def exceedance(self, var, pt_lon=[], pt_lat=[],
                    graph=True, dump=False, debug=False, **kwargs):
         """
@@ -576,6 +957,7 @@ class FunctionsFvcom:
 
         return Exceedance, Ranges
 
+    @profiled('derived')
     def vorticity(self, debug=False):
         """
         This method creates a new variable: 'depth averaged vorticity (1/s)'
@@ -587,7 +969,10 @@ class FunctionsFvcom:
         debug = (debug or self._debug)
         if debug:
             print 'Computing vorticity...'
-            start = time.time()
+
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'depth_av_vorticity', self._History):
+            return
 
         t = np.arange(self._grid.ntime)  
 
@@ -613,8 +998,6 @@ class FunctionsFvcom:
         N3[:] = n3[:]
 
         if debug:
-            end = time.time()
-            print "Check element=0, computation time in (s): ", (end - start)
             print "start np.multiply" 
         
         dvdx = np.zeros((self._grid.ntime,self._grid.nele))
@@ -638,13 +1021,12 @@ class FunctionsFvcom:
 
         # Add metadata entry
         setattr(self._var, 'depth_av_vorticity', vort)
+        self._store.save('depth_av_vorticity', vort, depends=['ua', 'va'])
         self._History.append('depth averaged vorticity computed')
         print '-Depth averaged vorticity added to FVCOM.Variables.-'
 
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start) 
 
+    @profiled('derived')
     def vorticity_over_period(self, time_ind=[], t_start=[], t_end=[], debug=False):
         """
         This function computes the depth averaged vorticity for a time period.
@@ -662,7 +1044,6 @@ class FunctionsFvcom:
         debug = (debug or self._debug)
         if debug:
             print 'Computing vorticity...'
-            start = time.time()
 
         # Find time interval to work in
         t = []
@@ -704,8 +1085,6 @@ class FunctionsFvcom:
 
 
             if debug:
-                end = time.time()
-                print "Check element=0, computation time in (s): ", (end - start)
                 print "start np.multiply" 
         
             dvdx = np.zeros((t.shape[0],self._grid.nele))
@@ -729,11 +1108,9 @@ class FunctionsFvcom:
         else:
             vort = self._var.depth_av_vorticity[t[:], :]
 
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start) 
         return vort
 
+    @profiled('derived')
     def depth(self, debug=False):
         """
         This method creates a new grid variable: 'depth2D' (m)
@@ -742,41 +1119,44 @@ class FunctionsFvcom:
         *Notes*
           - depth convention: 0 = free surface
           - Can take time over the full domain
+          - computed by blocks fitting in the memory budget, see MemoryBudget
         """
         debug = debug or self._debug
         if debug:
-            start = time.time()
             print "Computing depth..."
 
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._grid, 'depth2D', self._History):
+            return
+
         #Compute depth      
-        size = self._grid.nele
-        size1 = self._grid.ntime
-        size2 = self._grid.nlevel
-        elc = np.zeros((size1, size))
-        hc = np.zeros((size))
+        trinodes = np.asarray(self._grid.trinodes[:], dtype=int)
+        shape = (self._grid.ntime, self._grid.nele)
 
         try:
-            for ind, value in enumerate(self._grid.trinodes[:]):
-                value.sort()#due to new version of netCDF4
-                elc[:, ind] = np.mean(self._var.el[:, value], axis=1)
-                hc[ind] = np.mean(self._grid.h[value])
-
-            dep = elc[:,:] + hc[None,:]
+            hc = np.mean(np.asarray(self._grid.h[:])[trinodes], axis=1)
+            dep = self._memory.allocate(shape, name='depth2D')
+            #surrounding node elevations and depth held at once
+            for block in self._memory.blocks(shape, copies=4):
+                nodes = trinodes[block[-1]]
+                cols, inv = np.unique(nodes, return_inverse=True)
+                el = gather_columns(self._var.el, cols, time_ind=block[0])
+                elc = np.mean(el[:, inv.reshape(nodes.shape)], axis=2)
+                dep[block] = elc + hc[None, block[-1]]
         except MemoryError:
             print '---Data too large for machine memory---'
             print 'Tip: use ax or tx during class initialisation'
             print '---  to use partial data'
             raise
 
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start)
 
         # Add metadata entry
         setattr(self._grid, 'depth2D', dep)
+        self._store.save('depth2D', dep, depends=['el', 'h'])
         self._History.append('depth 2D computed')
         print '-Depth 2D added to FVCOM.Variables.-'
 
+    @profiled('interpolator')
     def depth_at_point(self, pt_lon, pt_lat, index=[], debug=False):
         """
         This function computes the depth at any given point.
@@ -799,7 +1179,6 @@ class FunctionsFvcom:
         debug = debug or self._debug
         if debug:
             print "Computing depth..."
-            start = time.time()
 
         #Finding index
         if index==[]:      
@@ -824,12 +1203,10 @@ class FunctionsFvcom:
             else:
                 d2D = self._grid.depth2D
             dep = self.interpolation_at_point(d2D, pt_lon, pt_lat, index=index, debug=debug)
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start)
 
         return dep
 
+    @profiled('derived')
     def depth_averaged_power_density(self, debug=False):
         """
         This method creates a new variable: 'depth averaged power density' (W/m2)
@@ -841,7 +1218,11 @@ class FunctionsFvcom:
         """
         debug = (debug or self._debug)
         if debug: print "Computing depth averaged power density..."
-    
+
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'depth_av_power_density', self._History):
+            return
+
         if not hasattr(self._var, 'hori_velo_norm'):
             self.hori_velo_norm(debug=debug)
         if debug: print "Computing powers of hori velo norm..."
@@ -852,9 +1233,11 @@ class FunctionsFvcom:
     
         # Add metadata entry
         setattr(self._var, 'depth_av_power_density', pd)
+        self._store.save('depth_av_power_density', pd, depends=['hori_velo_norm'])
         self._History.append('depth averaged power density computed')
         print '-Depth averaged power density to FVCOM.Variables.-' 
 
+    @profiled('derived')
     def depth_averaged_power_assessment(self, power_mat, rated_speed,
                                         cut_in=1.0, cut_out=4.5, debug=False):
         """
@@ -874,7 +1257,9 @@ class FunctionsFvcom:
           - The power density (pd) is then calculated as follows: pd = Cp*(1/2)*1025*(u**3)
           - This function performs tidal turbine power assessment by accounting for
             cut-in and cut-out speed, power curve/function (pc): Cp = pc(u) (where u is the flow speed)
+          - masked outside of cut-in and cut-out speeds
           - This may take some time to compute depending on the size of the data set
+          - computed by blocks fitting in the memory budget, see MemoryBudget
         """
         debug = (debug or self._debug)
         if debug: print "Computing depth averaged power density..."
@@ -882,46 +1267,221 @@ class FunctionsFvcom:
         if not hasattr(self._var, 'depth_av_power_density'):
             if debug: print "Computing power density..."
             self.depth_averaged_power_density(debug=debug)
+        #Power density may be reloaded from the store without the norm
+        if not hasattr(self._var, 'hori_velo_norm'):
+            self.hori_velo_norm(debug=debug)
 
-        if debug: print "Initialising power curve..."
-        Cp = interp1d(power_mat[0,:],power_mat[1,:])
-
-        u = self._var.hori_velo_norm[:]
-        pd = self._var.depth_av_power_density[:]
-
-        pa = Cp(u)*pd
-
-        if debug: print "finding cut-in and out..."
-        #TR comment huge bottleneck here
-        #ind = np.where(pd<pdin)[0]
-        #if not ind.shape[0]==0:
-        #    pd[ind] = 0.0
-        #for i in range(pa.shape[0]):
-        #    for j in range(pa.shape[1]):
-        #        if (u[i,j] < cut_in) or (u[i,j] > cut_out):
-        #           pa[i,j] = 0.0
-        inM = np.ma.masked_where(u<cut_in, u).mask
-        outM = np.ma.masked_where(u>cut_out, u).mask
-        ioM = inM * outM * u.mask
-        pa=np.ma.masked_where(ioM, pa)
-
-        if debug: print "finding rated speed..."
-        parated = Cp(rated_speed)*0.5*1025.0*(rated_speed**3.0)
-        #TR comment huge bottleneck here
-        #ind = np.where(pd>pdout)[0]
-        #if not ind.shape[0]==0:
-        #    pd[ind] = pdout
-        #for i in range(pa.shape[0]):
-        #    for j in range(pa.shape[1]):
-        #        if u[i,j] > rated_speed:
-        #           pa[i,j] = parated 
-        pa[u>rated_speed] = parated    
+        if debug: print "Applying power curve..."
+        u = self._var.hori_velo_norm
+        pd = self._var.depth_av_power_density
+        shape = u.shape
+        parated = np.interp(rated_speed, power_mat[0,:], power_mat[1,:])\
+                * 0.5*1025.0*(rated_speed**3.0)
+        pa = self._memory.allocate(shape, name='depth_av_power_assessment')
+        for block in self._memory.blocks(shape, copies=5):
+            speed = np.asarray(u[block])
+            pb = np.interp(speed, power_mat[0,:], power_mat[1,:]) * np.asarray(pd[block])
+            #rated power above rated speed, then nothing outside cut-in/out
+            pb[speed > rated_speed] = parated
+            pb[(speed < cut_in) | (speed > cut_out)] = np.nan
+            pa[block] = pb
+        pa = np.ma.masked_invalid(pa, copy=False)
 
         # Add metadata entry
-        setattr(self._var, 'depth_av_power_assessment', pd)
+        setattr(self._var, 'depth_av_power_assessment', pa)
         self._History.append('depth averaged power assessment computed')
         print '-Depth averaged power assessment to FVCOM.Variables.-'   
 
+    @profiled('analysis')
+    def turbine_farm(self, pt_lon, pt_lat, power_curves, curve_index=None,
+                     t_start=[], t_end=[], time_ind=[], debug=False):
+        """
+        This function assesses a farm of tidal turbines from the depth
+        averaged flow, i.e. computes the power and yield of each turbine.
+
+        Inputs:
+          - pt_lon = turbine longitudes in decimal degrees East, 1D array (nturb)
+          - pt_lat = turbine latitudes in decimal degrees North, 1D array (nturb)
+          - power_curves = power curve (speed (m/s), power (W)), 2D array (2, n),
+                           or list of them
+
+        Outputs:
+          - farm = dictionary: 'hub_speed' (m/s) and 'power' (W), 2D arrays
+                   (ntime, nturb), 'mean_power' (W), 'capacity_factor' and
+                   'annual_energy' (MWh/year), 1D arrays (nturb), 'farm_power' (W),
+                   1D array (ntime), 'farm_mean_power' (W) and
+                   'farm_annual_energy' (MWh/year)
+
+        Options:
+          - curve_index = power curve of each turbine, 1D array of integers (nturb)
+          - t_start = start time, as a string ('yyyy-mm-dd hh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-dd hh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+
+        *Notes*
+          - depth averaged speed, see Util3D.turbine_farm for hub depths
+          - no power below the first speed (cut-in) or above the last speed
+            (cut-out) of a curve, see turbine_farm.curve_power
+          - only the columns surrounding the turbines are read
+          - turbines outside of the domain are nan
+        """
+        debug = (debug or self._debug)
+        if debug: print "Assessing turbine farm..."
+        pt_lon = np.asarray(pt_lon, dtype=float).ravel()
+        pt_lat = np.asarray(pt_lat, dtype=float).ravel()
+        curves, curve_index = power_curves_array(power_curves, pt_lon.shape[0],
+                                                 curve_index)
+        cols, weights = self.point_stencils(pt_lon, pt_lat, debug=debug)
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        u = apply_stencils(self._var.ua, cols, weights, time_ind=argtime, debug=debug)
+        v = apply_stencils(self._var.va, cols, weights, time_ind=argtime, debug=debug)
+        speed = np.sqrt(u**2 + v**2)
+
+        farm = farm_assessment(speed, curves, curve_index)
+        if debug: print '...Passed'
+
+        return farm
+
+    @profiled('derived')
+    def time_statistics(self, var, quantiles=[50, 90, 99], thresholds=[], edges=None,
+                        t_start=[], t_end=[], time_ind=[], workers=1, debug=False):
+        """
+        This function computes statistic maps over time of any given variable,
+        in one pass over the data.
+
+        Inputs:
+          - var = any FVCOM variable, numpy array, netcdf variable or OpenDap
+                  proxy, dim=(time, nele or nnode) or (time, nlevel, nele or nnode)
+
+        Outputs:
+          - stats = dictionary of arrays of dim=(nele or nnode) or
+                    (nlevel, nele or nnode): 'mean', 'std', 'min', 'max',
+                    'count', 'P50', 'P90',... per quantile and 'exceedance'
+                    (fraction of time above each threshold, first dimension)
+
+        Options:
+          - quantiles = percentages, list of floats
+          - thresholds = exceedance thresholds, list of floats
+          - edges = histogram bin edges used for the quantiles, 1D array.
+                    Default: 1000 bins growing with the range of the values
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - workers = number of element blocks processed in parallel, integer
+
+        *Notes*
+          - reduced by time chunks and element blocks fitting in the memory
+            budget, see streaming_stats.time_statistics
+          - quantiles from 1000-bin histograms, i.e. exact to 1/500 of the
+            range of the values, or to one bin width given edges
+        """
+        debug = (debug or self._debug)
+        if debug: print "Computing statistics over time..."
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+
+        return time_statistics(var, quantiles=quantiles, thresholds=thresholds,
+                               edges=edges, time_ind=argtime, memory=self._memory,
+                               workers=workers, debug=debug)
+
+    @profiled('derived')
+    def resource_maps(self, quantiles=[50, 90, 99], cut_in=1.0,
+                      t_start=[], t_end=[], time_ind=[], workers=1, debug=False):
+        """
+        This function computes tidal resource maps, i.e. statistics over time
+        of the depth averaged flow speed, in one pass over the data.
+
+        Outputs:
+          - maps = dictionary of 1D arrays (nele): 'mean_speed', 'std_speed',
+                   'max_speed' (m/s), 'P50_speed', 'P90_speed',... (m/s) per
+                   quantile, 'mean_power_density' (W/m2) and 'time_above_cut_in'
+                   (fraction of time)
+
+        Options:
+          - quantiles = speed percentages, list of floats
+          - cut_in = cut-in speed in m/s, float number
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - workers = number of element blocks processed in parallel, integer
+
+        *Notes*
+          - the power density is 0.5*1025*(u**3), as in depth_averaged_power_density
+          - the (time, nele) speed field is never held in memory
+          - speed quantiles exact to 0.01 m/s
+        """
+        debug = (debug or self._debug)
+        if debug: print "Computing resource maps..."
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        if hasattr(self._var, 'hori_velo_norm'):
+            variables = [self._var.hori_velo_norm]
+            func = None
+        else:
+            variables = [self._var.ua, self._var.va]
+            func = lambda u, v: ne.evaluate('sqrt(u**2 + v**2)')
+        stats = time_statistics(variables, func=func, quantiles=quantiles,
+                                thresholds=[cut_in],
+                                means={'power_density': lambda u: 0.5*1025.0*(u**3)},
+                                edges=np.linspace(0.0, 8.0, 801), time_ind=argtime,
+                                memory=self._memory, workers=workers, debug=debug)
+        maps = {'mean_speed': stats['mean'], 'std_speed': stats['std'],
+                'max_speed': stats['max'],
+                'mean_power_density': stats['mean_power_density'],
+                'time_above_cut_in': stats['exceedance'][0]}
+        for q in quantiles:
+            maps['P' + ('%g' % q) + '_speed'] = stats['P' + ('%g' % q)]
+
+        return maps
+
+    @profiled('analysis')
+    def tidal_residual(self, var, kind='godin', cutoff=None, step=1,
+                       t_start=[], t_end=[], time_ind=[], filename=None,
+                       debug=False):
+        """
+        This function computes the residual, i.e. non-tidal, part of any
+        given variable with a tidal low-pass filter.
+
+        Inputs:
+          - var = any FVCOM variable, numpy array, netcdf variable or OpenDap
+                  proxy, dim=(time, nele or nnode) or (time, nlevel, nele or nnode),
+                  ex: fvcom.Variables.ua or fvcom.Variables.u
+
+        Outputs:
+          - time = matlab time of the residuals, 1D array
+          - residual = filtered variable, dim=(time, nele or nnode) or
+                       (time, nlevel, nele or nnode), array or memmap
+
+        Options:
+          - kind = filter family, 'godin', 'lanczos' or 'moving_average'
+          - cutoff = cut-off period (lanczos) or window length (moving_average)
+                     in hours, float
+          - step = subsampling of the residuals, integer, ex: 24 for daily
+                   residuals of hourly outputs
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - filename = path to a .npy file the residuals are written to, string
+
+        *Notes*
+          - half the filter length is lost at both ends of the time window,
+            i.e. 35h with Godin
+          - streamed over time chunks fitting in the memory budget, see
+            tidal_filters.low_pass
+        """
+        debug = (debug or self._debug)
+        if debug: print "Computing tidal residual..."
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        mtime = self._var.matlabTime[:]
+        dt = np.diff(mtime[argtime]) * 24.0 * 3600.0
+        if dt.shape[0] == 0 or np.abs(dt - dt[0]).max() > 1.0:
+            raise PyseidonError("---Filtering needs evenly spaced time steps---")
+        weights = filter_weights(kind, dt=dt[0], cutoff=cutoff)
+        residual, index = low_pass(var, weights, time_ind=argtime, step=step,
+                                   filename=filename, memory=self._memory,
+                                   debug=debug)
+
+        return mtime[index], residual
+
+    @profiled('analysis')
     def Harmonic_analysis_at_point(self, pt_lon, pt_lat,
                                    time_ind=[], t_start=[], t_end=[],
                                    elevation=True, velocity=False,
@@ -961,51 +1521,25 @@ class FunctionsFvcom:
         debug = (debug or self._debug)
         #TR_comments: Add debug flag in Utide: debug=self._debug
         index = self.index_finder(pt_lon, pt_lat, debug=False)
-        argtime = []
-        if not time_ind==[]:
-            argtime = time_ind
-        elif not t_start==[]:
-            if type(t_start)==str:
-                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-            else:
-                argtime = np.arange(t_start, t_end)
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
 
         if velocity == elevation:
             raise PyseidonError("---Can only process either velocities or elevation. Change options---")
         
         if velocity:
-            time = self._var.matlabTime[:]
-            if type(self._var.ua).__name__=='Variable': #Fix for netcdf4 lib
-                ua = self._var.ua[:]
-                va = self._var.va[:]
-            else:
-                ua = self._var.ua
-                va = self._var.va
-
-            u = self.interpolation_at_point(ua, pt_lon, pt_lat, index=index, debug=debug)  
-            v = self.interpolation_at_point(va, pt_lon, pt_lat, index=index, debug=debug) 
-            if not argtime==[]:
-                time = time[argtime[:]]
-                u = u[argtime[:]]
-                v = v[argtime[:]]
+            time = self._var.matlabTime[argtime]
+            u = self._point_extraction(self._var.ua, pt_lon, pt_lat, index=index,
+                                       time_ind=argtime, debug=debug)
+            v = self._point_extraction(self._var.va, pt_lon, pt_lat, index=index,
+                                       time_ind=argtime, debug=debug)
 
             lat = self._grid.lat[index]
             harmo = solve(time, u, v, lat, **kwarg)
 
         else:
-            time = self._var.matlabTime[:]
-            if type(self._var.el).__name__=='Variable': #Fix for netcdf4 lib
-                el = self._var.el[:]
-            else:
-                el = self._var.el
-            el = self.interpolation_at_point(el, pt_lon, pt_lat,
-                                             index=index, debug=debug)
-
-            if not argtime==[]:
-                time = time[argtime[:]]
-                el = el[argtime[:]]
+            time = self._var.matlabTime[argtime]
+            el = self._point_extraction(self._var.el, pt_lon, pt_lat, index=index,
+                                        time_ind=argtime, debug=debug)
 
             lat = self._grid.lat[index]
             harmo = solve(time, el, None, lat, **kwarg)
@@ -1013,6 +1547,7 @@ class FunctionsFvcom:
 
         return harmo
 
+    @profiled('analysis')
     def Harmonic_reconstruction(self, harmo, time_ind=slice(None), debug=False, **kwarg):
         """
         This function reconstructs the velocity components or the surface elevation
@@ -1043,3 +1578,47 @@ class FunctionsFvcom:
         Reconstruct = reconstruct(time,harmo)
 
         return Reconstruct  
+
+    @profiled('analysis')
+    def Harmonic_prediction(self, harmo, time=None, t_start=[], t_end=[],
+                            time_ind=[], minsnr=2.0, debug=False):
+        """
+        This function predicts the velocity components or the surface elevation
+        of many nodes or elements from their harmonic coefficients, i.e.
+        reconstruction maps, over the model period or any other one.
+
+        Inputs:
+          - harmo = harmonic coefficients of each node or element, list of
+                    'solve' outputs (see Harmonic_analysis_at_point),
+                    HarmonicPredictor or path to a file written by
+                    HarmonicPredictor.save
+
+        Outputs:
+          - prediction = predicted signals, dictionary: 'h', or 'u' and 'v',
+                         2D arrays (time, npts)
+
+        Options:
+          - time = matlab times to predict at, 1D array, ex: a forecast period.
+                   Default: model times
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - minsnr = constituents below this signal to noise ratio are left
+                     out, as in 'reconstruct', float
+
+        *Notes*
+          - nodal factors and astronomical arguments computed once per time
+            vector, predictions of all the points as matrix products by
+            blocks fitting in the memory budget, see harmonic_prediction
+          - keep the HarmonicPredictor to reuse its basis over many calls
+        """
+        debug = (debug or self._debug)
+        if debug: print "Computing harmonic prediction..."
+        if time is None:
+            argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+            time = self._var.matlabTime[argtime]
+        if not isinstance(harmo, HarmonicPredictor):
+            harmo = HarmonicPredictor(harmo, minsnr=minsnr, memory=self._memory,
+                                      debug=debug)
+
+        return harmo.predict(time, debug=debug)
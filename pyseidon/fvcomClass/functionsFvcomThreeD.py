@@ -8,24 +8,55 @@ from scipy.interpolate import interp1d
 from pyseidon.utilities.interpolation_utils import *
 from pyseidon.utilities.miscellaneous import *
 from pyseidon.utilities.BP_tools import *
-from pyseidon.utilities.shortest_element_path import *
+from pyseidon.utilities.lazy_import import LazyModule, lazy_function
 import time
-import matplotlib.pyplot as plt
-from pydap.exceptions import ServerError
+from pyseidon.utilities.opendap_access import server_error
+from pyseidon.utilities.derived_store import StoreBinding
+from pyseidon.utilities.profiling import Profiler, profiled
+from pyseidon.utilities.memory_budget import memory_budget
+from pyseidon.utilities.streaming_stats import time_statistics
+from pyseidon.utilities.turbine_farm import *
+from pyseidon.utilities.regridding import sigma_to_z as _sigma_to_z
+from pyseidon.utilities.regridding import vertical_integral
+from pyseidon.utilities.element_graph import element_graph
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Heavy dependencies imported on first use
+plt = LazyModule('matplotlib.pyplot')
+shortest_element_path = lazy_function('pyseidon.utilities.shortest_element_path',
+                                      'shortest_element_path')
 
 #TR comment: This all routine needs to be tested and debugged
 class FunctionsFvcomThreeD:
     """
     **'Utils3D' subset of FVCOM class gathers useful methods and functions for 3D runs**
     """
-    def __init__(self, variable, grid, plot, util, History, debug):
+    def __init__(self, variable, grid, plot, util, History, debug, store=None,
+                 profiler=None, memory=None):
         #Inheritance
         self._debug = debug
         self._plot = plot
         self._util = util
+        #Derived-field store, see DerivedStore
+        if store is None:
+            store = StoreBinding()
+        self._store = store
+        #Profiled calls, see Profiler
+        if profiler is None:
+            profiler = Profiler()
+        self._profiler = profiler
+        #Memory budget, see MemoryBudget
+        if memory is None:
+            memory = memory_budget()
+        self._memory = memory
         self.interpolation_at_point = self._util.interpolation_at_point
+        self._point_extraction = self._util._point_extraction
+        self._time_window = self._util._time_window
         self.index_finder = self._util.index_finder
         self.hori_velo_norm = self._util.hori_velo_norm
+        self.time_statistics = self._util.time_statistics
+        self.tidal_residual = self._util.tidal_residual
+        self.regrid = self._util.regrid
 
         #Create pointer to FVCOM class
         setattr(self, '_var', variable)
@@ -34,6 +65,7 @@ class FunctionsFvcomThreeD:
 
         return
 
+    @profiled('derived')
     def depth(self, debug=False):
         """
         This method computes new grid variable: 'depth' (m)
@@ -42,18 +74,29 @@ class FunctionsFvcomThreeD:
         *Notes*
           - depth convention: 0 = free surface
           - Can take time over the full domain
+          - computed by blocks fitting in the memory budget, see MemoryBudget
         """
         debug = debug or self._debug
         if debug:
-            start = time.time()
             print "Computing depth..."
 
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._grid, 'depth', self._History):
+            return
+
         try:
-            elc = interpN(self._var.el[:], self._grid.trinodes[:], self._grid.aw0[:], debug=debug)
-            hc = interpN(self._grid.h[:], self._grid.trinodes[:], self._grid.aw0[:], debug=debug)
-            siglay = interpN(self._grid.siglay[:], self._grid.trinodes[:], self._grid.aw0[:], debug=debug)
-            zeta = elc[:,:] + hc[None,:]
-            dep = zeta[:,None,:]*siglay[None,:,:]
+            trinodes = np.asarray(self._grid.trinodes[:], dtype=int)
+            aw0 = np.asarray(self._grid.aw0[:])
+            siglay = interpN(self._grid.siglay[:], trinodes, aw0, debug=debug)
+            shape = (self._grid.ntime, self._grid.nlevel, self._grid.nele)
+            dep = self._memory.allocate(shape, name='depth')
+            #depth and surrounding node elevations held at once
+            for block in self._memory.blocks(shape, copies=2):
+                ele = block[-1]
+                stencils = self._column_stencils(np.arange(shape[-1])[ele],
+                                                 trinodes, aw0)
+                zeta = self._water_column(stencils, time_ind=block[0])
+                dep[block] = zeta[:, None, :] * siglay[None, :, ele]
 
         except MemoryError:
              print '---Data too large for machine memory---'
@@ -61,9 +104,6 @@ class FunctionsFvcomThreeD:
              print '---  to use partial data'
              raise
 
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start)
 
         # TR: need to find vectorized alternative
         #Compute depth
@@ -95,10 +135,13 @@ class FunctionsFvcomThreeD:
 
         # Add metadata entry
         setattr(self._grid, 'depth', dep)
+        self._store.save('depth', dep, depends=['el', 'h', 'siglay'])
         self._History.append('depth computed')
         print '-Depth added to FVCOM.Variables.-'
 
-    def depth_at_point(self, pt_lon, pt_lat, index=[], debug=False):
+    @profiled('interpolator')
+    def depth_at_point(self, pt_lon, pt_lat, index=[], time_ind=slice(None),
+                       debug=False):
         """
         This function computes depth at any given point.
 
@@ -112,6 +155,7 @@ class FunctionsFvcomThreeD:
         Options:
           - index = element index, interger. Use only if closest element
                     index is already known
+          - time_ind = time window, slice or 1D array of integers
 
         *Notes*
           - depth convention: 0 = free surface
@@ -121,7 +165,6 @@ class FunctionsFvcomThreeD:
         debug = debug or self._debug
         if debug:
             print "Computing depth..."
-            start = time.time()
 
         #Finding index
         if index==[]:      
@@ -129,24 +172,22 @@ class FunctionsFvcomThreeD:
 
         if not hasattr(self._grid, 'depth'):
             #Compute depth
-            h = self.interpolation_at_point(self._grid.h, pt_lon, pt_lat,
+            h = self._point_extraction(self._grid.h, pt_lon, pt_lat,
+                                       index=index, debug=debug)
+            el = self._point_extraction(self._var.el, pt_lon, pt_lat,
+                                        index=index, time_ind=time_ind, debug=debug)
+            siglay = self._point_extraction(self._grid.siglay, pt_lon, pt_lat,
                                             index=index, debug=debug)
-            el = self.interpolation_at_point(self._var.el, pt_lon, pt_lat,
-                                             index=index, debug=debug)
-            siglay = self.interpolation_at_point(self._grid.siglay, pt_lon, pt_lat,
-                                                 index=index, debug=debug)
             zeta = el + h
             dep = zeta[:,None]*siglay[None,:]
         else:
-            dep = self.interpolation_at_point(self._grid.depth[:],
-                                              pt_lon, pt_lat, index=index,
-                                              debug=debug)          
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start)
+            dep = self._point_extraction(self._grid.depth, pt_lon, pt_lat,
+                                         index=index, time_ind=time_ind,
+                                         debug=debug)
 
         return dep
 
+    @profiled('interpolator')
     def interp_at_depth(self, var, depth, ind=[], debug=False):
         """
         This function interpolates any given FVCOM.Variables field
@@ -268,6 +309,152 @@ class FunctionsFvcomThreeD:
 
         return interpVar, ind
 
+    @profiled('interpolator')
+    def sigma_to_z(self, var, z, from_bottom=False, t_start=[], t_end=[],
+                   time_ind=[], filename=None, debug=False):
+        """
+        This function regrids any given 3D variable from sigma levels onto
+        fixed z levels, ex: depth plane maps or ADCP bins.
+
+        Inputs:
+          - var = 3 dimensional (time, sigma level, element or node) variable,
+                  numpy array, netcdf variable or OpenDap proxy
+          - z = z levels (m), 1D array (nz), negative from the free surface
+                downwards, or heights above the seabed if from_bottom
+
+        Outputs:
+          - varZ = 3 dimensional (time, nz, element or node) variable,
+                   masked array outside of the water column, or memmap
+                   with nan there if filename
+
+        Options:
+          - from_bottom = True if z levels are heights above the seabed
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - filename = path to a .npy file the regridded variable is
+                       written to, string
+
+        *Notes*
+          - depth convention: 0 = free surface
+          - one vectorized pass per block of time steps and elements fitting
+            in the memory budget, the sigma level depths being computed
+            block by block
+          - nearest sigma level between the surface and the top level, and
+            between the bottom level and the seabed
+        """
+        debug = debug or self._debug
+        if debug: print "Regridding on z levels..."
+        z = np.asarray(z, dtype=float).ravel()
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        tind = np.arange(var.shape[0])[argtime]
+        trinodes = np.asarray(self._grid.trinodes[:], dtype=int)
+        node = (var.shape[-1] == self._grid.nnode)
+        siglay = np.asarray(self._grid.siglay[:])
+        aw0 = np.asarray(self._grid.aw0[:])
+        if not node:
+            siglay = interpN(siglay, trinodes, aw0, debug=debug)
+        shape = (tind.shape[0], z.shape[0], var.shape[-1])
+        if filename is None:
+            varZ = self._memory.allocate(shape, name='sigma_to_z')
+        else:
+            varZ = np.lib.format.open_memmap(filename, mode='w+', dtype=float,
+                                             shape=shape)
+        #Profiles, their depths and the level indices held at once
+        copies = 4 + int(np.ceil(3.0 * siglay.shape[0] / max(z.shape[0], 1)))
+        for block in self._memory.blocks(shape, copies=copies):
+            ind = as_slice(tind[block[0]])
+            cols = np.arange(shape[-1])[block[-1]]
+            values = gather_columns(var, cols, time_ind=ind)
+            values = np.asarray(np.ma.filled(values, np.nan), dtype=float)
+            stencils = self._column_stencils(cols, trinodes, aw0, node=node)
+            total = self._water_column(stencils, time_ind=ind)
+            depth = total[:, None, :] * siglay[None, :, cols]
+            block_z = _sigma_to_z(values, depth, total, z, from_bottom=from_bottom)
+            varZ[block] = block_z.filled(np.nan)
+        if debug: print '...Passed'
+        if filename is not None:
+            varZ.flush()
+            return varZ
+
+        return np.ma.masked_invalid(varZ, copy=False)
+
+    @profiled('derived')
+    def depth_average(self, var, zmin=None, zmax=None, from_bottom=False,
+                      integral=False, t_start=[], t_end=[], time_ind=[],
+                      filename=None, debug=False):
+        """
+        This function depth averages, or integrates, any given 3D variable
+        weighted by the sigma layer thicknesses, over the water column or a
+        depth range.
+
+        Inputs:
+          - var = 3 dimensional (time, sigma layer or level, element or node)
+                  variable, numpy array, netcdf variable or OpenDap proxy,
+                  ex: fvcom.Variables.velo_norm or fvcom.Variables.tke, or
+                  defined between sigma layers, ex: fvcom.Variables.verti_shear
+
+        Outputs:
+          - varI = 2 dimensional (time, element or node) variable, nan where
+                   the depth range is out of the water column, array or
+                   memmap
+
+        Options:
+          - zmin, zmax = depth range (m), negative from the free surface
+                         downwards, or heights above the seabed if from_bottom,
+                         ex: zmin=hub-radius, zmax=hub+radius, from_bottom=True
+                         for a rotor swept area
+          - from_bottom = True if zmin and zmax are heights above the seabed
+          - integral = True for the integral over the range (units of var
+                       times m) instead of the average
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - filename = path to a .npy file the result is written to, string
+
+        *Notes*
+          - depth convention: 0 = free surface
+          - layers partly in the range weighted by their overlap, values at
+            sigma levels averaged over each layer, values between layers
+            spanning the adjacent layer centres
+          - streamed over blocks of time steps and elements fitting in the
+            memory budget, see regridding.vertical_integral
+        """
+        debug = debug or self._debug
+        if debug: print "Computing depth average..."
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        tind = np.arange(var.shape[0])[argtime]
+        trinodes = np.asarray(self._grid.trinodes[:], dtype=int)
+        node = (var.shape[-1] == self._grid.nnode)
+        siglev = np.asarray(self._grid.siglev[:])
+        aw0 = np.asarray(self._grid.aw0[:])
+        if not node:
+            siglev = interpN(siglev, trinodes, aw0, debug=debug)
+        shape = (tind.shape[0], var.shape[-1])
+        if filename is None:
+            varI = self._memory.allocate(shape, name='depth_average')
+        else:
+            varI = np.lib.format.open_memmap(filename, mode='w+', dtype=float,
+                                             shape=shape)
+        #Profiles, their weights and interfaces held at once
+        for block in self._memory.blocks(shape, copies=4 * (siglev.shape[0] + 1)):
+            ind = as_slice(tind[block[0]])
+            cols = np.arange(shape[-1])[block[-1]]
+            values = gather_columns(var, cols, time_ind=ind)
+            values = np.asarray(np.ma.filled(values, np.nan), dtype=float)
+            stencils = self._column_stencils(cols, trinodes, aw0, node=node)
+            total = self._water_column(stencils, time_ind=ind)
+            varI[block] = vertical_integral(values, siglev[:, cols], total,
+                                            zmin=zmin, zmax=zmax,
+                                            from_bottom=from_bottom,
+                                            average=not integral)
+        if filename is not None:
+            varI.flush()
+        if debug: print '...Passed'
+
+        return varI
+
+    @profiled('derived')
     def verti_shear(self, debug=False):
         """
         This method computes a new variable: 'vertical shear' (1/s)
@@ -275,31 +462,39 @@ class FunctionsFvcomThreeD:
 
         *Notes*
           - Can take time over the full doma
+          - computed by blocks fitting in the memory budget, see MemoryBudget
         """
         debug = debug or self._debug
         if debug:
             print 'Computing vertical shear...'
-              
+
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'verti_shear', self._History):
+            return
+
         #Compute depth if necessary
         if not hasattr(self._grid, 'depth'):        
            depth = self.depth(debug=debug)
-        depth = self._grid.depth[:]
+        depth = self._grid.depth
 
         # Checking if horizontal velocity norm already exists
         if not hasattr(self._var, 'velo_norm'):
             self.velo_norm()
-        vel = self._var.velo_norm[:]
+        vel = self._var.velo_norm
 
         try:
-            #Sigma levels to consider
-            top_lvl = self._grid.nlevel - 1
-            bot_lvl = 0
-            sLvl = range(bot_lvl, top_lvl+1)
-
             # Compute shear
-            dz = depth[:,sLvl[1:],:] - depth[:,sLvl[:-1],:]
-            dvel = vel[:,sLvl[1:],:] - vel[:,sLvl[:-1],:]           
-            dveldz = dvel / dz
+            shape = (self._grid.ntime, self._grid.nlevel - 1, self._grid.nele)
+            #Velocity precision kept, ex: float32 netCDF variables
+            dtype = np.result_type(vel.dtype, np.float32)
+            dveldz = self._memory.allocate(shape, dtype=dtype, name='verti_shear')
+            #depth, velocity, their differences and shear held at once
+            for block in self._memory.blocks(shape, dtype=dtype, copies=7):
+                dep = np.asarray(depth[block[0], :, block[-1]])
+                vn = np.asarray(vel[block[0], :, block[-1]])
+                dz = dep[:, 1:, :] - dep[:, :-1, :]
+                dvel = vn[:, 1:, :] - vn[:, :-1, :]
+                dveldz[block] = dvel / dz
         except MemoryError:
             print '---Data too large for machine memory---'
             print 'Tip: use ax or tx during class initialisation'
@@ -308,6 +503,7 @@ class FunctionsFvcomThreeD:
 
         #Custom return
         setattr(self._var, 'verti_shear', dveldz)
+        self._store.save('verti_shear', dveldz, depends=['depth', 'velo_norm'])
             
         # Add metadata entry
         self._History.append('vertical shear computed')
@@ -316,6 +512,7 @@ class FunctionsFvcomThreeD:
         if debug:
             print '...Passed'
 
+    @profiled('interpolator')
     def verti_shear_at_point(self, pt_lon, pt_lat, t_start=[], t_end=[],  time_ind=[],
                              bot_lvl=[], top_lvl=[], graph=True, dump=False, debug=False):
         """
@@ -347,22 +544,14 @@ class FunctionsFvcomThreeD:
             print 'Computing vertical shear at point...'
 
         # Find time interval to work in
-        argtime = []
-        if not time_ind==[]:
-            argtime = time_ind
-        elif not t_start==[]:
-            if type(t_start)==str:
-                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-            else:
-                argtime = np.arange(t_start, t_end) 
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
 
         # Finding closest point
         index = self.index_finder(pt_lon, pt_lat, debug=False)
 
         #Compute depth
-        depth = self.depth_at_point(pt_lon, pt_lat, index=index, debug=debug)       
+        depth = self.depth_at_point(pt_lon, pt_lat, index=index,
+                                    time_ind=argtime, debug=debug)       
 
         #Sigma levels to consider
         if top_lvl==[]:
@@ -374,20 +563,13 @@ class FunctionsFvcomThreeD:
 
         # Checking if vertical shear already exists
         if not hasattr(self._var, 'verti_shear'):
-            if type(self._var.u).__name__=='Variable': 
-                u = self._var.u[:]
-                v = self._var.v[:]
-            else:
-                u = self._var.u
-                v = self._var.v
-
-            #Extraction at point
+            #Extraction at point, only the time window is read
             if debug:
                 print 'Extraction of u and v at point...'
-            U = self.interpolation_at_point(u, pt_lon, pt_lat,
-                                            index=index, debug=debug)  
-            V = self.interpolation_at_point(v, pt_lon, pt_lat,
-                                            index=index, debug=debug)
+            U = self._point_extraction(self._var.u, pt_lon, pt_lat, index=index,
+                                       time_ind=argtime, debug=debug)
+            V = self._point_extraction(self._var.v, pt_lon, pt_lat, index=index,
+                                       time_ind=argtime, debug=debug)
             norm = ne.evaluate('sqrt(U**2 + V**2)').squeeze()
 
             # Compute shear
@@ -395,20 +577,12 @@ class FunctionsFvcomThreeD:
             dvel = norm[:,sLvl[1:]] - norm[:,sLvl[:-1]]           
             dveldz = dvel / dz
         else:
-            if type(self._var.verti_shear).__name__=='Variable':
-                shear = self._var.verti_shear[:]
-            else:
-                shear = self._var.verti_shear
-            dveldz = self.interpolation_at_point(self._var.verti_shear,
-                                                 pt_lon, pt_lat,
-                                                 index=index, debug=debug)
+            dveldz = self._point_extraction(self._var.verti_shear,
+                                            pt_lon, pt_lat, index=index,
+                                            time_ind=argtime, debug=debug)
 
         if debug:
             print '...Passed'
-        #use time indices of interest
-        if not argtime==[]:
-            dveldz = dveldz[argtime,:]
-            depth = depth[argtime,:]
 
         #Plot mean values
         if graph:
@@ -423,6 +597,7 @@ class FunctionsFvcomThreeD:
 
         return dveldz             
 
+    @profiled('derived')
     def velo_norm(self, debug=False):
         """
         This method computes a new variable: 'velocity norm' (m/s)
@@ -430,18 +605,32 @@ class FunctionsFvcomThreeD:
 
         *Notes*
           -Can take time over the full domain
+          - computed by blocks fitting in the memory budget, see MemoryBudget
         """
         if debug or self._debug:
             print 'Computing velocity norm...'
+
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'velo_norm', self._History):
+            return
+
+        shape = self._var.u.shape
         #Check if w if there
         try:
             try:
-                #Computing velocity norm
-                u = self._var.u[:]
-                v = self._var.v[:]
-                w = self._var.w[:]
-                vel = ne.evaluate('sqrt(u**2 + v**2 + w**2)').squeeze()
-            except (MemoryError, ServerError) as e:
+                #Computing velocity norm, u, v, w, squares and norm held at once
+                w = self._var.w
+                #Input precision kept, ex: float32 netCDF variables
+                dtype = np.result_type(self._var.u.dtype, self._var.v.dtype,
+                                       w.dtype)
+                vel = self._memory.allocate(shape, dtype=dtype, name='velo_norm')
+                for block in self._memory.blocks(shape, dtype=dtype, copies=7):
+                    u = np.asarray(self._var.u[block])
+                    v = np.asarray(self._var.v[block])
+                    w = np.asarray(self._var.w[block])
+                    vel[block] = ne.evaluate('sqrt(u**2 + v**2 + w**2)')
+                vel = vel.squeeze()
+            except (MemoryError, server_error()) as e:
                 print '---Data too large for machine memory or server---'
                 print 'Tip: Save data on your machine first'
                 print 'Tip: use ax or tx during class initialisation'
@@ -450,10 +639,14 @@ class FunctionsFvcomThreeD:
         except AttributeError:
             try:
                 #Computing velocity norm
-                u = self._var.u[:]
-                v = self._var.v[:]
-                vel = ne.evaluate('sqrt(u**2 + v**2)').squeeze()
-            except (MemoryError, ServerError) as e:
+                dtype = np.result_type(self._var.u.dtype, self._var.v.dtype)
+                vel = self._memory.allocate(shape, dtype=dtype, name='velo_norm')
+                for block in self._memory.blocks(shape, dtype=dtype, copies=5):
+                    u = np.asarray(self._var.u[block])
+                    v = np.asarray(self._var.v[block])
+                    vel[block] = ne.evaluate('sqrt(u**2 + v**2)')
+                vel = vel.squeeze()
+            except (MemoryError, server_error()) as e:
                 print '---Data too large for machine memory or server---'
                 print 'Tip: Save data on your machine first'
                 print 'Tip: use ax or tx during class initialisation'
@@ -462,6 +655,7 @@ class FunctionsFvcomThreeD:
 
         #Custom return    
         setattr(self._var, 'velo_norm', vel)
+        self._store.save('velo_norm', vel, depends=['u', 'v', 'w'])
        
         # Add metadata entry
         self._History.append('Velocity norm computed')
@@ -470,6 +664,7 @@ class FunctionsFvcomThreeD:
         if debug or self._debug:
             print '...Passed'
 
+    @profiled('interpolator')
     def velo_norm_at_point(self, pt_lon, pt_lat, t_start=[], t_end=[], time_ind=[],
                            graph=True, dump=False, debug=False):
         """
@@ -499,73 +694,36 @@ class FunctionsFvcomThreeD:
             print 'Computing velocity norm at point...'
        
         # Find time interval to work in
-        argtime = []
-        if not time_ind==[]:
-            argtime = time_ind
-        elif not t_start==[]:
-            if type(t_start)==str:
-                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-            else:
-                argtime = np.arange(t_start, t_end)
-
-        try:
-            if not hasattr(self._var, 'velo_norm'):
-                if type(self._var.u).__name__=='Variable': #Fix for netcdf4 lib            
-                    u = self._var.u[:]
-                    v = self._var.v[:]
-                    w = self._var.w[:]
-                else:
-                    u = self._var.u
-                    v = self._var.v
-                    w = self._var.w
-            else:
-                vel = self._var.velo_norm
-        except AttributeError:
-            if not hasattr(self._var, 'velo_norm'): 
-                if type(self._var.u).__name__=='Variable': #Fix for netcdf4 lib            
-                    u = self._var.u[:]
-                    v = self._var.v[:]
-                else:
-                    u = self._var.u
-                    v = self._var.v
-            else:
-                if type(self._var.velo_norm).__name__=='Variable': #Fix for netcdf4 lib:
-                    vel = self._var.velo_norm[:]
-                else:
-                    vel = self._var.velo_norm
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
 
         # Finding closest point
         index = self.index_finder(pt_lon, pt_lat, debug=False)
 
-        #Computing horizontal velocity norm
+        #Computing horizontal velocity norm, only the time window is read
         if debug:
             print 'Extraction of u, v and w at point...'
         if not hasattr(self._var, 'velo_norm'): 
-            U = self.interpolation_at_point(u, pt_lon, pt_lat,
-                                            index=index, debug=debug)  
-            V = self.interpolation_at_point(v, pt_lon, pt_lat,
-                                            index=index, debug=debug)
-            if 'w' in locals():
-                W = self.interpolation_at_point(w, pt_lon, pt_lat,
-                                                index=index, debug=debug)
+            U = self._point_extraction(self._var.u, pt_lon, pt_lat, index=index,
+                                       time_ind=argtime, debug=debug)
+            V = self._point_extraction(self._var.v, pt_lon, pt_lat, index=index,
+                                       time_ind=argtime, debug=debug)
+            if hasattr(self._var, 'w'):
+                W = self._point_extraction(self._var.w, pt_lon, pt_lat, index=index,
+                                           time_ind=argtime, debug=debug)
                 velo_norm = ne.evaluate('sqrt(U**2 + V**2 + W**2)').squeeze()
             else:
                 velo_norm = ne.evaluate('sqrt(U**2 + V**2)').squeeze()
         else:
-            velo_norm = self.interpolation_at_point(vel, pt_lon, pt_lat,
-                                                    index=index, debug=debug)
+            velo_norm = self._point_extraction(self._var.velo_norm, pt_lon, pt_lat,
+                                               index=index, time_ind=argtime,
+                                               debug=debug)
         if debug:
             print '...passed'
 
-        #use only the time indices of interest
-        if not argtime==[]:
-            velo_norm = velo_norm[argtime[:],:,:]
-
         #Plot mean values
         if graph:
-            depth = self.depth_at_point(pt_lon, pt_lat, index=index)
+            depth = self.depth_at_point(pt_lon, pt_lat, index=index,
+                                        time_ind=argtime)
             mean_depth = np.mean(depth, 0)
             mean_vel = np.mean(velo_norm,0)
             error = np.std(velo_norm,axis=0)/2.0
@@ -577,6 +735,7 @@ class FunctionsFvcomThreeD:
         return velo_norm 
 
 
+    @profiled('interpolator')
     def flow_dir_at_point(self, pt_lon, pt_lat, t_start=[], t_end=[], time_ind=[], 
                           vertical=True, debug=False):
         """
@@ -612,52 +771,32 @@ class FunctionsFvcomThreeD:
         index = self.index_finder(pt_lon, pt_lat, debug=False)
 
         # Find time interval to work in
-        argtime = []
-        if not time_ind==[]:
-            argtime = time_ind
-        elif not t_start==[]:
-            if type(t_start)==str:
-                start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-            else:
-                argtime = np.arange(t_start, t_end)
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
         
         #Choose the right pair of velocity components
         if self._var._3D and vertical:
-            if type(self._var.u).__name__=='Variable': #Fix for netcdf4 lib
-                u = self._var.u[:]
-                v = self._var.v[:]
-            else:
-                u = self._var.u
-                v = self._var.v
+            u = self._var.u
+            v = self._var.v
         else:
-            if type(self._var.ua).__name__=='Variable': #Fix for netcdf4 lib:
-                u = self._var.ua[:]
-                v = self._var.va[:]
-            else:
-                u = self._var.ua
-                v = self._var.va
+            u = self._var.ua
+            v = self._var.va
 
-        #Extraction at point
+        #Extraction at point, only the time window is read
         if debug:
             print 'Extraction of u and v at point...'
-        U = self._util.interpolation_at_point(u, pt_lon, pt_lat,
-                                              index=index, debug=debug)  
-        V = self._util.interpolation_at_point(v, pt_lon, pt_lat,
-                                              index=index, debug=debug)       
+        U = self._point_extraction(u, pt_lon, pt_lat, index=index,
+                                   time_ind=argtime, debug=debug)
+        V = self._point_extraction(v, pt_lon, pt_lat, index=index,
+                                   time_ind=argtime, debug=debug)
         #Compute directions
         if debug:
             print 'Computing arctan2...'
         dirFlow = np.rad2deg(np.arctan2(V,U))
 
         if debug: print '...Passed'
-        #use only the time indices of interest
-        if not argtime==[]:
-            dirFlow = dirFlow[argtime[:],:]
-
         return dirFlow
 
+    @profiled('derived')
     def flow_dir(self, debug=False):
         """"
         This method computes a new variable: 'flow directions' (deg.)
@@ -671,11 +810,15 @@ class FunctionsFvcomThreeD:
         if debug or self._debug:
             print 'Computing flow directions...'
 
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'flow_dir', self._History):
+            return
+
         try:
             u = self._var.u[:]
             v = self._var.v[:]
             dirFlow = np.rad2deg(np.arctan2(v,u))
-        except (MemoryError, ServerError) as e:
+        except (MemoryError, server_error()) as e:
             print '---Data too large for machine memory or server---'
             print 'Tip: Save data on your machine'
             print 'Tip: use ax or tx during class initialisation'
@@ -684,6 +827,7 @@ class FunctionsFvcomThreeD:
 
         #Custom return    
         setattr(self._var, 'flow_dir', dirFlow)
+        self._store.save('flow_dir', dirFlow, depends=['u', 'v'])
 
         # Add metadata entry
         self._History.append('flow directions computed')
@@ -692,6 +836,7 @@ class FunctionsFvcomThreeD:
         if debug or self._debug:
             print '...Passed'
 
+    @profiled('derived')
     def vorticity(self, debug=False):
         """
         This method creates a new variable: 'depth averaged vorticity' (1/s)
@@ -703,7 +848,10 @@ class FunctionsFvcomThreeD:
         debug = (debug or self._debug)
         if debug:
             print 'Computing vorticity...'
-            start = time.time()
+
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'vorticity', self._History):
+            return
 
         t = np.arange(self._grid.ntime)  
 
@@ -729,8 +877,6 @@ class FunctionsFvcomThreeD:
         N3[:] = n3[:]
 
         if debug:
-            end = time.time()
-            print "Check element=0, computation time in (s): ", (end - start)
             print "start np.multiply" 
 
         x0 = self._grid.xc
@@ -766,13 +912,12 @@ class FunctionsFvcomThreeD:
 
         # Add metadata entry
         setattr(self._var, 'vorticity', vort)
+        self._store.save('vorticity', vort, depends=['u', 'v'])
         self._History.append('vorticity computed')
         print '-Vorticity added to FVCOM.Variables.-'
 
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start) 
 
+    @profiled('derived')
     def vorticity_over_period(self, time_ind=[], t_start=[], t_end=[], debug=False):
         """
         This function computes the vorticity for a time period.
@@ -792,7 +937,6 @@ class FunctionsFvcomThreeD:
         debug = (debug or self._debug)
         if debug:
             print 'Computing vorticity...'
-            start = time.time()
 
         # Find time interval to work in
         t = []
@@ -831,8 +975,6 @@ class FunctionsFvcomThreeD:
             N3[:] = n3[:]
 
             if debug:
-                end = time.time()
-                print "Check element=0, computation time in (s): ", (end - start)
                 print "start np.multiply" 
 
             x0 = self._grid.xc[:]
@@ -859,11 +1001,9 @@ class FunctionsFvcomThreeD:
         else:
             vort = self._var.vorticity[t[:],:,:]
 
-        if debug:
-            end = time.time()
-            print "Computation time in (s): ", (end - start) 
         return vort
 
+    @profiled('derived')
     def power_density(self, debug=False):
         """
         This method creates a new variable: 'power density' (W/m2)
@@ -879,6 +1019,10 @@ class FunctionsFvcomThreeD:
         debug = (debug or self._debug)
         if debug: print "Computing power density..."
 
+        #Reloaded from the derived-field store if already computed
+        if self._store.restore(self._var, 'power_density', self._History):
+            return
+
         if not hasattr(self._var, 'velo_norm'):
             self.velo_norm(debug=debug)
         if debug: print "Computing power density variable..."
@@ -889,9 +1033,11 @@ class FunctionsFvcomThreeD:
 
         # Add metadata entry
         setattr(self._var, 'power_density', pd)
+        self._store.save('power_density', pd, depends=['velo_norm'])
         self._History.append('power density computed')
         print '-Power density to FVCOM.Variables.-' 
 
+    @profiled('analysis')
     def power_assessment_at_depth(self, depth, power_mat, rated_speed, 
                                         cut_in=1.0, cut_out=4.5, debug=False):
         """
@@ -929,45 +1075,340 @@ class FunctionsFvcomThreeD:
 
         if not hasattr(self._var, 'power_density'):
             self.power_density(debug=debug)
-
-        if debug: print "Initialising power curve..."
-        Cp = interp1d(power_mat[0,:],power_mat[1,:])
+        #Power density may be reloaded from the store without the norm
+        if not hasattr(self._var, 'velo_norm'):
+            self.velo_norm(debug=debug)
 
         u, ind = self.interp_at_depth(self._var.velo_norm[:], depth, debug=debug)
         pd, ind2 = self.interp_at_depth(self._var.power_density[:], depth,
                                                    ind=ind, debug=debug)
 
-        pa = Cp(u)*pd
-
-        if debug: print "finding cut-in..."
-        #TR comment huge bottleneck here
-        #ind = np.where(pd<pdin)[0]
-        #if not ind.shape[0]==0:
-        #    pd[ind] = 0.0
-        #for i in range(pa.shape[0]):
-        #    for j in range(pa.shape[1]):
-        #        if (u[i,j] < cut_in) or (u[i,j] > cut_out):
-        #           pa[i,j] = 0.0
-        
-        inM = np.ma.masked_where(u<cut_in, u).mask
-        outM = np.ma.masked_where(u>cut_out, u).mask
-        ioM = inM * outM * u.mask
-        pa=np.ma.masked_where(ioM, pa)
-
-        if debug: print "finding rated speed..."
-        parated = Cp(rated_speed)*0.5*1025.0*(rated_speed**3.0)
-        #TR comment huge bottleneck here
-        #ind = np.where(pd>pdout)[0]
-        #if not ind.shape[0]==0:
-        #    pd[ind] = pdout
-        #for i in range(pa.shape[0]):
-        #    for j in range(pa.shape[1]):
-        #        if u[i,j] > rated_speed:
-        #           pa[i,j] = parated
-        pa[u>rated_speed] = parated     
+        if debug: print "Applying power curve..."
+        speed = np.ma.filled(u, np.nan)
+        Cp = np.interp(speed, power_mat[0,:], power_mat[1,:])
+        pa = Cp*np.ma.filled(pd, np.nan)
+        #rated power above rated speed, then nothing outside cut-in/out
+        parated = np.interp(rated_speed, power_mat[0,:], power_mat[1,:])\
+                * 0.5*1025.0*(rated_speed**3.0)
+        pa[speed > rated_speed] = parated
+        pa = np.ma.masked_where((speed < cut_in) | (speed > cut_out) |
+                                np.ma.getmaskarray(u), pa)
 
         return pa 
 
+    @profiled('analysis')
+    def turbine_farm(self, pt_lon, pt_lat, hub_depth, power_curves,
+                     curve_index=None, above_seabed=False,
+                     t_start=[], t_end=[], time_ind=[], debug=False):
+        """
+        This function assesses a farm of tidal turbines, i.e. extracts the
+        flow speed at hub height and computes the power and yield of each
+        turbine.
+
+        Inputs:
+          - pt_lon = turbine longitudes in decimal degrees East, 1D array (nturb)
+          - pt_lat = turbine latitudes in decimal degrees North, 1D array (nturb)
+          - hub_depth = hub depths (m) below the free surface, ex: -20 or 20
+                        for 20 m below it, float or 1D array (nturb)
+          - power_curves = power curve (speed (m/s), power (W)), 2D array (2, n),
+                           or list of them
+
+        Outputs:
+          - farm = dictionary: 'hub_speed' (m/s) and 'power' (W), 2D arrays
+                   (ntime, nturb), 'mean_power' (W), 'capacity_factor' and
+                   'annual_energy' (MWh/year), 1D arrays (nturb), 'farm_power' (W),
+                   1D array (ntime), 'farm_mean_power' (W) and
+                   'farm_annual_energy' (MWh/year)
+
+        Options:
+          - curve_index = power curve of each turbine, 1D array of integers (nturb)
+          - above_seabed = hub_depth is the hub height above the seabed (m),
+                           positive, if True
+          - t_start = start time, as a string ('yyyy-mm-dd hh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-dd hh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+
+        *Notes*
+          - horizontal speed from u and v interpolated at the turbines, then
+            linearly between sigma levels at hub depth
+          - no power below the first speed (cut-in) or above the last speed
+            (cut-out) of a curve, see turbine_farm.curve_power
+          - streamed over time chunks fitting in the memory budget, only the
+            columns surrounding the turbines being read
+          - turbines outside of the domain are nan
+        """
+        debug = (debug or self._debug)
+        if not self._var._3D:
+            raise PyseidonError("---Only available for 3D runs---")
+        if debug: print "Assessing turbine farm..."
+        pt_lon = np.asarray(pt_lon, dtype=float).ravel()
+        pt_lat = np.asarray(pt_lat, dtype=float).ravel()
+        nturb = pt_lon.shape[0]
+        curves, curve_index = power_curves_array(power_curves, nturb, curve_index)
+        hub = np.asarray(hub_depth, dtype=float) * np.ones(nturb)
+        #Depth convention: negative from the free surface, heights positive
+        if above_seabed:
+            hub = np.abs(hub)
+        else:
+            hub = -np.abs(hub)
+
+        index = self.index_finder(pt_lon, pt_lat, debug=False)
+        node_st = self._util.point_stencils(pt_lon, pt_lat, index=index,
+                                            node=True, debug=debug)
+        cols, weights = self._util.point_stencils(pt_lon, pt_lat, index=index,
+                                                  node=False, debug=debug)
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        tind = np.arange(self._grid.ntime)[argtime]
+        speed = np.zeros((tind.shape[0], nturb))
+        #u, v, speed and depth profiles held at once
+        for block in block_slices((tind.shape[0], self._grid.nlevel, nturb), 8*6,
+                                  self._memory.budget):
+            window = as_slice(tind[block])
+            depth = self._section_depth(node_st, time_ind=window, debug=debug)
+            u = apply_stencils(self._var.u, cols, weights, time_ind=window, debug=debug)
+            v = apply_stencils(self._var.v, cols, weights, time_ind=window, debug=debug)
+            if above_seabed:
+                z = hub[None, :] - self._water_column(node_st, time_ind=window,
+                                                      debug=debug)
+            else:
+                z = hub
+            speed[block] = hub_interpolation(np.sqrt(u**2 + v**2), depth, z)
+
+        farm = farm_assessment(speed, curves, curve_index)
+        if debug: print '...Passed'
+
+        return farm
+
+    @profiled('derived')
+    def resource_maps(self, quantiles=[50, 90, 99], cut_in=1.0,
+                      t_start=[], t_end=[], time_ind=[], workers=1, debug=False):
+        """
+        This function computes tidal resource maps per sigma level, i.e.
+        statistics over time of the flow speed, in one pass over the data.
+
+        Outputs:
+          - maps = dictionary of 2D arrays (nlevel, nele): 'mean_speed',
+                   'std_speed', 'max_speed' (m/s), 'P50_speed', 'P90_speed',...
+                   (m/s) per quantile, 'mean_power_density' (W/m2) and
+                   'time_above_cut_in' (fraction of time)
+
+        Options:
+          - quantiles = speed percentages, list of floats
+          - cut_in = cut-in speed in m/s, float number
+          - t_start = start time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-ddThh:mm:ss'), or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - workers = number of element blocks processed in parallel, integer
+
+        *Notes*
+          - speed as in velo_norm, power density as in power_density
+          - the (time, nlevel, nele) speed field is never held in memory
+          - speed quantiles exact to 0.01 m/s
+        """
+        debug = (debug or self._debug)
+        if debug: print "Computing resource maps..."
+        argtime = self._time_window(t_start, t_end, time_ind, debug=debug)
+        if hasattr(self._var, 'velo_norm'):
+            variables = [self._var.velo_norm]
+            func = None
+        elif hasattr(self._var, 'w'):
+            variables = [self._var.u, self._var.v, self._var.w]
+            func = lambda u, v, w: ne.evaluate('sqrt(u**2 + v**2 + w**2)')
+        else:
+            variables = [self._var.u, self._var.v]
+            func = lambda u, v: ne.evaluate('sqrt(u**2 + v**2)')
+        stats = time_statistics(variables, func=func, quantiles=quantiles,
+                                thresholds=[cut_in],
+                                means={'power_density': lambda u: 0.5*1025.0*(u**3)},
+                                edges=np.linspace(0.0, 8.0, 801), time_ind=argtime,
+                                memory=self._memory, workers=workers, debug=debug)
+        maps = {'mean_speed': stats['mean'], 'std_speed': stats['std'],
+                'max_speed': stats['max'],
+                'mean_power_density': stats['mean_power_density'],
+                'time_above_cut_in': stats['exceedance'][0]}
+        for q in quantiles:
+            maps['P' + ('%g' % q) + '_speed'] = stats['P' + ('%g' % q)]
+
+        return maps
+
+    def _section_stencils(self, start_pt, end_pt, npts=100, resolution=None,
+                          element_path=False, debug=False):
+        """
+        Sampling points of a transect and their node/element stencils.
+
+        Inputs:
+          - start_pt = starting point, [longitude, latitude]
+          - end_pt = ending point, [longitude, latitude]
+
+        Options:
+          - npts = number of points along a straight line, integer
+          - resolution = spacing of the points along a straight line (m),
+                         float. Overrides npts
+          - element_path = follows the shortest element path if True,
+                           i.e. one point per element centre
+
+        Outputs:
+          - lon, lat = coordinates of the points, 1D arrays (npts)
+          - dist = distance along the transect (m), 1D array (npts)
+          - node_st = node stencils, (cols, weights) tuple
+          - ele_st = element stencils, (cols, weights) tuple
+        """
+        if element_path:
+            #Finding the closest elements to start and end points
+            index = closest_points([start_pt[0], end_pt[0]],
+                                   [start_pt[1], end_pt[1]],
+                                   self._grid.lonc, self._grid.latc, debug=debug)
+            paths, _ = element_graph(self._grid, debug=debug).paths([index[0]],
+                                                                    [index[1]])
+            ele = paths[0]
+            if ele.shape[0] == 0:
+                raise PyseidonError("---No element path between start and end points---")
+            lon = self._grid.lonc[:][ele]
+            lat = self._grid.latc[:][ele]
+            #Node to element operator, i.e. mean of the surrounding nodes
+            cols = np.asarray(self._grid.trinodes[:])[ele, :].astype(int)
+            node_st = (cols, np.ones(cols.shape) / 3.0)
+            ele_st = (ele[:, None], np.ones((ele.shape[0], 1)))
+        else:
+            if resolution is not None:
+                dy = TPI * (end_pt[1] - start_pt[1])
+                dx = TPI * (end_pt[0] - start_pt[0]) *\
+                     np.cos(np.deg2rad(start_pt[1] + end_pt[1]) * 0.5)
+                npts = int(np.ceil(np.hypot(dx, dy) / resolution)) + 1
+            lon = np.linspace(start_pt[0], end_pt[0], max(npts, 2))
+            lat = np.linspace(start_pt[1], end_pt[1], max(npts, 2))
+            index = self.index_finder(lon, lat, debug=debug)
+            node_st = self._util.point_stencils(lon, lat, index=index, node=True,
+                                                debug=debug)
+            ele_st = self._util.point_stencils(lon, lat, index=index, node=False,
+                                               debug=debug)
+
+        #Cumulative distance along the transect
+        dy = TPI * np.diff(lat)
+        dx = TPI * np.diff(lon) * np.cos(np.deg2rad(lat[1:] + lat[:-1]) * 0.5)
+        dist = np.hstack((0.0, np.cumsum(np.hypot(dx, dy))))
+
+        return lon, lat, dist, node_st, ele_st
+
+    def _column_stencils(self, cols, trinodes, aw0, node=False):
+        """
+        Node stencils of any given elements, i.e. their three nodes
+        weighted by aw0, or of any given nodes. See _water_column
+        """
+        if node:
+            return cols[:, None], np.ones((cols.shape[0], 1))
+        return trinodes[cols], aw0[:, cols].T
+
+    def _water_column(self, node_st, time_ind=slice(None), debug=False):
+        """
+        Water column height, i.e. free surface elevation plus bathymetry,
+        at the points of any given node stencils, dim=(time, npts).
+        See _column_stencils and _section_stencils
+        """
+        cols, weights = node_st
+        h = apply_stencils(self._grid.h, cols, weights, debug=debug)
+        el = apply_stencils(self._var.el, cols, weights, time_ind=time_ind,
+                            debug=debug)
+
+        return el.reshape(-1, cols.shape[0]) + h[None, :]
+
+    def _section_depth(self, node_st, time_ind=slice(None), debug=False):
+        """
+        Depth of the sigma layers at the points of a transect,
+        dim=(time, nlevel, npts). See _section_stencils
+        """
+        cols, weights = node_st
+        siglay = apply_stencils(self._grid.siglay, cols, weights, debug=debug)
+        zeta = self._water_column(node_st, time_ind=time_ind, debug=debug)
+
+        return zeta[:, None, :] * siglay[None, :, :]
+
+    @profiled('interpolator')
+    def vertical_section(self, var, start_pt, end_pt, npts=100, resolution=None,
+                         element_path=False, t_start=[], t_end=[], time_ind=[],
+                         plot=False, title='Title', debug=False):
+        """
+        This function extracts any given variable along a transect,
+        for many times at once.
+
+        Inputs:
+          - var = 3D variable, numpy array, netcdf variable or OpenDap proxy,
+                  dim=(time, nlevel, nnode or nele)
+          - start_pt = starting point, [longitude, latitude]
+          - end_pt = ending point, [longitude, latitude]
+
+        Outputs:
+          - dist = distance along the transect (m), 1D array (npts)
+          - depth = depth of the sigma layers (m), 3D array (ntime, nlevel, npts)
+          - varS = var along the transect, 3D array (ntime, nlevel, npts)
+
+        Options:
+          - npts = number of points along a straight line, integer
+          - resolution = spacing of the points along a straight line (m),
+                         float. Overrides npts
+          - element_path = follows the shortest element path if True,
+                           i.e. one point per element centre
+          - t_start = start time, as a string ('yyyy-mm-dd hh:mm:ss'),
+                      or time index as an integer
+          - t_end = end time, as a string ('yyyy-mm-dd hh:mm:ss'),
+                    or time index as an integer
+          - time_ind = time indices to work in, list of integers
+          - plot = plots the time averaged section if True, boolean
+          - title = plot title, string
+
+        *Notes*
+          - depth convention: 0 = free surface
+          - points outside of the domain are nan
+          - only the time window and the columns surrounding the transect
+            are read, each variable in a single gather
+        """
+        debug = debug or self._debug
+        if not self._var._3D:
+            raise PyseidonError("---Only available for 3D runs---")
+        if debug:
+            print "Extracting vertical section..."
+
+        argtime = self._time_window(t_start=t_start, t_end=t_end,
+                                    time_ind=time_ind, debug=debug)
+        lon, lat, dist, node_st, ele_st = self._section_stencils(start_pt, end_pt,
+                                          npts=npts, resolution=resolution,
+                                          element_path=element_path, debug=debug)
+        depth = self._section_depth(node_st, time_ind=argtime, debug=debug)
+        if var.shape[-1] == self._grid.nnode:
+            cols, weights = node_st
+        else:
+            cols, weights = ele_st
+        varS = apply_stencils(var, cols, weights, time_ind=argtime, debug=debug)
+
+        if plot:
+            self._section_plot(dist, depth.mean(axis=0), varS.mean(axis=0),
+                               title=title)
+
+        return dist, depth, varS
+
+    def _section_plot(self, dist, depth, varP, title='Title', cmax=[], cmin=[]):
+        """Plots a section, i.e. varP (nlevel, npts) against distance and depth"""
+        line = np.ones(depth.shape) * dist[None, :]
+        #Plot features
+        #setting limits and levels of colormap
+        if cmax==[]:
+            cmax = np.nanmax(varP[:])
+        if cmin==[]:
+            cmin = np.nanmin(varP[:])
+        step = (cmax-cmin) / 20.0
+        levels=np.arange(cmin, (cmax+step), step)
+        #plt.clf()
+        fig = plt.figure(figsize=(18,10))
+        plt.rc('font',size='22')
+        ax = fig.add_subplot(111) #,aspect=(1.0/np.cos(np.mean(lat)*np.pi/180.0)))
+        cs = ax.contourf(line,depth,varP,levels=levels, vmax=cmax,vmin=cmin,
+                          cmap=plt.get_cmap('jet'))
+        cbar = fig.colorbar(cs)
+        ax.contour(line,depth,varP,cs.levels) #, linewidths=0.5,colors='k')
+        plt.title(title)
+        plt.xlabel('Distance along line (m)')
+        plt.ylabel('Depth (m)')
+
     def _vertical_slice(self, var, start_pt, end_pt,
                         time_ind=[], t_start=[], t_end=[],
                         title='Title', cmax=[], cmin=[], debug=False):
@@ -991,103 +1432,38 @@ class FunctionsFvcomThreeD:
           - title = plot title, string
           - cmin = minimum limit colorbar
           - cmax = maximum limit colorbar
+
+        *Notes*
+          - see vertical_section for sections over time
         """
         debug = debug or self._debug
         if not self._var._3D:
-            print "Error: Only available for 3D runs."
-            raise
-        else: 
-            lons = [start_pt[0], end_pt[0]]
-            lats = [start_pt[1], end_pt[1]]
-            #Finding the closest elements to start and end points
-            index = closest_points(lons, lats,
-                              self._grid.lonc,
-                              self._grid.latc, debug=debug)
-    
-            #Finding the shortest path between start and end points
-            if debug : print "Computing shortest path..."
-            short_path = shortest_element_path(self._grid.lonc[:],
-                                               self._grid.latc[:],
-                                               self._grid.lon[:],
-                                               self._grid.lat[:],
-                                               self._grid.trinodes[:],
-                                               self._grid.h[:], debug=debug)
-            el, _ = short_path.getTargets([index])
-            # Plot shortest path
-            short_path.graphGrid(plot=True)
-
-            # Find time interval to work in
-            argtime = []
-            if not time_ind==[]:
-                argtime = time_ind
-            elif not t_start==[]:
-                if type(t_start)==str:
-                    start = datetime.datetime.strptime(t_start, '%Y-%m-%d %H:%M:%S')
-                    end = datetime.datetime.strptime(t_end, '%Y-%m-%d %H:%M:%S')
-                    argtime = time_to_index(start, end, self._var.julianTime[:], debug=debug)
-                else:
-                    argtime = np.arange(t_start, t_end)
- 
-            #Extract along line
-            ele=np.asarray(el[:])[0,:]
-            varP = var[:,ele]
-            # Depth along line
-            if debug : print "Computing depth..."
-            depth = np.zeros((self._grid.ntime, self._grid.nlevel, ele.shape[0]))
-            I=0
-            for ind in ele:
-                value = self._grid.trinodes[ind]
-                h = np.mean(self._grid.h[value])
-                zeta = np.mean(self._var.el[:,value],1) + h
-                siglay = np.mean(self._grid.siglay[:,value],1)
-                depth[:,:,I] =  zeta[:,None]*siglay[None,:]
-                I+=1
-            # Average depth over time
-            if not argtime==[]:
-                depth = np.mean(depth[argtime,:,:], 0)
-            else:
-                depth = np.mean(depth, 0)
-              
-            # Compute distance along line
-            x = self._grid.xc[ele]
-            y = self._grid.yc[ele]
-            # Pythagore + cumulative path 
-            line = np.zeros(depth.shape)
-            dl = np.sqrt(np.square(x[1:]-x[:-1]) + np.square(y[1:]-y[:-1]))
-            for i in range(1,dl.shape[0]):
-                dl[i] = dl[i] + dl[i-1]
-            line[:,1:] = dl[:]
-           
-            #turn into gridded
-            #print 'Compute gridded data'
-            #nx, ny = 100, 100
-            #xi = np.linspace(x.min(), x.max(), nx)
-            #yi = np.linspace(y.min(), y.max(), ny)
-
-            #Plot features
-            #setting limits and levels of colormap
-            if cmax==[]:
-                cmax = varP[:].max()
-            if cmin==[]:
-                cmin = varP[:].min()
-            step = (cmax-cmin) / 20.0
-            levels=np.arange(cmin, (cmax+step), step)
-            #plt.clf()
-            fig = plt.figure(figsize=(18,10))
-            plt.rc('font',size='22')
-            ax = fig.add_subplot(111) #,aspect=(1.0/np.cos(np.mean(lat)*np.pi/180.0)))
-            #levels = np.linspace(0,3.3,34)
-            #cs = ax.contourf(line,depth,varP,levels=levels, cmap=plt.cm.jet)
-            cs = ax.contourf(line,depth,varP,levels=levels, vmax=cmax,vmin=cmin,
-                              cmap=plt.get_cmap('jet'))
-            cbar = fig.colorbar(cs)
-            #cbar.set_label(title, rotation=-90,labelpad=30)
-            ax.contour(line,depth,varP,cs.levels) #, linewidths=0.5,colors='k')
-            #ax.set_title()
-            plt.title(title)
-            #scale = 1
-            #ticks = ticker.FuncFormatter(lambda lon, pos: '{0:g}'.format(lon/scale))
-            #ax.xaxis.set_major_formatter(ticks)
-            #ax.yaxis.set_major_formatter(ticks)
-            plt.xlabel('Distance along line (m)')
-            plt.ylabel('Depth (m)')
+            raise PyseidonError("---Only available for 3D runs---")
+        #Finding the shortest path between start and end points
+        if debug : print "Computing shortest path..."
+        lon, lat, dist, node_st, ele_st = self._section_stencils(start_pt, end_pt,
+                                          element_path=True, debug=debug)
+        # Plot shortest path
+        short_path = shortest_element_path(self._grid.lonc[:],
+                                           self._grid.latc[:],
+                                           self._grid.lon[:],
+                                           self._grid.lat[:],
+                                           self._grid.trinodes[:],
+                                           self._grid.h[:],
+                                           graph=element_graph(self._grid,
+                                                               debug=debug),
+                                           debug=debug)
+        short_path.getTargets([[ele_st[0][0, 0], ele_st[0][-1, 0]]])
+        short_path.graphGrid(plot=True)
+
+        # Find time interval to work in
+        argtime = self._time_window(t_start=t_start, t_end=t_end,
+                                    time_ind=time_ind, debug=debug)
+        #Extract along line
+        if debug : print "Computing depth..."
+        cols, weights = ele_st
+        varP = apply_stencils(var, cols, weights, debug=debug)
+        # Average depth over time
+        depth = np.mean(self._section_depth(node_st, time_ind=argtime,
+                                            debug=debug), 0)
+        self._section_plot(dist, depth, varP, title=title, cmax=cmax, cmin=cmin)
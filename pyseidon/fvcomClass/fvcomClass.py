@@ -4,18 +4,23 @@
 #Libs import
 from __future__ import division
 #TR comment: 2 alternatives
-import netCDF4 as nc
 from scipy.io import netcdf
-from pydap.client import open_url
 import cPickle as pkl
 import pickle as Pkl
 import copy
+import os
 from os.path import isfile
 import gc
 
 #Utility import
 from pyseidon.utilities.object_from_dict import ObjectFromDict
+from pyseidon.utilities.lazy_import import LazyModule, LazyObject
+from pyseidon.utilities.opendap_access import open_dataset
+from pyseidon.utilities.derived_store import DerivedStore, StoreBinding
+from pyseidon.utilities.profiling import Profiler
+from pyseidon.utilities.memory_budget import MemoryBudget, memory_budget
 from pyseidon.utilities.pyseidon2pickle import pyseidon_to_pickle
+from pyseidon.utilities.pyseidon2cache import pyseidon_to_cache, cache_to_pyseidon
 from pyseidon.utilities.pyseidon2matlab import pyseidon_to_matlab
 from pyseidon.utilities.pyseidon2netcdf_alter import pyseidon_to_netcdf
 
@@ -26,7 +31,9 @@ from pyseidon_error import PyseidonError
 from variablesFvcom import _load_var, _load_grid
 from functionsFvcom import *
 from functionsFvcomThreeD import *
-from plotsFvcom import *
+
+#Heavy dependencies imported on first use
+nc = LazyModule('netCDF4')
 
 class FVCOM:
     """
@@ -45,7 +52,8 @@ class FVCOM:
     Inputs:
       - filename = path to file, string,
                 ex: testFvcom = FVCOM('./path_to_FVOM_output_file/filename')
-                Note that the file can be a pickle file (i.e. *.p) or a netcdf file (i.e. *.nc)
+                Note that the file can be a pickle file (i.e. *.p), a PySeidon cache
+                (i.e. *.cache directory) or a netcdf file (i.e. *.nc)
                 Additionally, either a file path or a OpenDap url could be used
 
     Options:
@@ -60,6 +68,22 @@ class FVCOM:
            Note that this option permits to extract partial data from the overall file
            and therefore reduce memory and cpu use
 
+      - store = on-disk store of derived fields (depth, velo_norm, vorticity,...)
+           reloaded across sessions: True for the default location, path to
+           a folder or DerivedStore object. Also on when the PYSEIDON_STORE
+           environment variable is set
+
+      - profile = records wall time, bytes read, arrays allocated and cache
+           hits of the loaders and methods, boolean. Also on when the
+           PYSEIDON_PROFILE environment variable is set.
+           See FVCOM.profiler.summary() and FVCOM.profiler.to_dataframe()
+
+      - memory = memory budget of the whole-field operations (loading, depth,
+           velocity norms, shear,...), in bytes or string, ex: '4G'. Larger
+           operations are split into time or element blocks and larger
+           outputs memory mapped to disk. Default: shared budget, see
+           pyseidon.utilities.memory_budget.set_memory_budget
+
     *Notes*
     Throughout the package, the following conventions apply:
       - Date = string of 'yyyy-mm-dd hh:mm:ss'
@@ -68,23 +92,40 @@ class FVCOM:
       - Depth = 0m is the free surface and depth is negative
     """
 
-    def __init__(self, filename, ax=[], tx=[], debug=False):
+    def __init__(self, filename, ax=[], tx=[], store=None, profile=None,
+                 memory=None, debug=False):
         """ Initialize FVCOM class."""
         self._debug = debug
         if debug: print '-Debug mode on-'
+        #Profiled calls, turned on/off with profiler.enable()/disable()
+        if profile is None:
+            profile = os.environ.get('PYSEIDON_PROFILE', '').lower() in ['1', 'true', 'yes']
+        self.profiler = Profiler(enabled=profile)
+        #Memory budget, see MemoryBudget
+        if memory is None:
+            self.memory = memory_budget()
+        elif isinstance(memory, MemoryBudget):
+            self.memory = memory
+        else:
+            self.memory = MemoryBudget(memory, debug=debug)
         #Force garbage collector when fvcom object created
         gc.collect()
 
-        #Loading pickle file
-        if filename.endswith('.p'):
-            f = open(filename, "rb")
-            try:
-                data = pkl.load(f)
-            except MemoryError:
+        #Loading pickle file or PySeidon cache
+        if filename.endswith('.p') or filename.rstrip('/').endswith('.cache'):
+            if filename.endswith('.p'):
+                f = open(filename, "rb")
                 try:
-                    data = Pkl.load(f)
-                except KeyError:
-                    data = pkl.load(f,2)
+                    data = pkl.load(f)
+                except MemoryError:
+                    try:
+                        data = Pkl.load(f)
+                    except KeyError:
+                        data = pkl.load(f,2)
+            else:
+                #Arrays memory mapped, nothing loaded yet
+                with self.profiler.span('cache_to_pyseidon', 'loader'):
+                    data = cache_to_pyseidon(filename, debug=debug)
             self._origin_file = data['Origin']
             self.History = data['History']
             if debug: print "Turn keys into attributs"
@@ -94,9 +135,7 @@ class FVCOM:
                 if self._origin_file.startswith('http'):
                     #Look for file through OpenDAP server
                     print "Retrieving data through OpenDap server..."
-                    self.Data = open_url(data['Origin'])
-                    #Create fake attribut to be consistent with the rest of the code
-                    self.Data.variables = self.Data
+                    self.Data = open_dataset(data['Origin'], debug=debug)
                 else:
                     #WB_Alternative: self.Data = sio.netcdf.netcdf_file(filename, 'r')
                     #WB_comments: scipy has causes some errors, and even though can be
@@ -118,9 +157,7 @@ class FVCOM:
             if filename.startswith('http'):
                 #Look for file through OpenDAP server
                 print "Retrieving data through OpenDap server..."
-                self.Data = open_url(filename)
-                #Create fake attribut to be consistent with the rest of the code
-                self.Data.variables = self.Data
+                self.Data = open_dataset(filename, debug=debug)
             else:
                 #Look for file locally
                 print "Retrieving data from " + filename + " ..."
@@ -140,15 +177,18 @@ class FVCOM:
             print "Initialisation..."
             #print "This might take some time..."
             try:
-                self.Grid = _load_grid(self.Data,
-                                       ax,
-                                       self.History,
-                                       debug=self._debug)
-                self.Variables = _load_var(self.Data,
-                                           self.Grid,
-                                           tx,
+                with self.profiler.span('_load_grid', 'loader'):
+                    self.Grid = _load_grid(self.Data,
+                                           ax,
                                            self.History,
                                            debug=self._debug)
+                with self.profiler.span('_load_var', 'loader'):
+                    self.Variables = _load_var(self.Data,
+                                               self.Grid,
+                                               tx,
+                                               self.History,
+                                               memory=self.memory,
+                                               debug=self._debug)
             except MemoryError:
                 print '---Data too large for machine memory---'
                 print 'Tip: use ax or tx during class initialisation'
@@ -160,14 +200,29 @@ class FVCOM:
         else:
             raise PyseidonError("---Wrong file format---")
 
-        self.Plots = PlotsFvcom(self.Variables,
+        self.Plots = LazyObject('plotsFvcom', 'PlotsFvcom',
+                                self.Variables,
                                 self.Grid,
                                 self._debug)
+        #Derived-field store
+        if store is None and 'PYSEIDON_STORE' in os.environ:
+            store = True
+        if store:
+            if not isinstance(store, DerivedStore):
+                if store is True:
+                    store = None
+                store = DerivedStore(store, debug=self._debug)
+            self._store = store.bind(self)
+        else:
+            self._store = StoreBinding()
         self.Util2D = FunctionsFvcom(self.Variables,
                                      self.Grid,
                                      self.Plots,
                                      self.History,
-                                     self._debug)
+                                     self._debug,
+                                     store=self._store,
+                                     profiler=self.profiler,
+                                     memory=self.memory)
 
         if self.Variables._3D:
             self.Util3D = FunctionsFvcomThreeD(self.Variables,
@@ -175,7 +230,10 @@ class FVCOM:
                                                self.Plots,
                                                self.Util2D,
                                                self.History,
-                                               self._debug)
+                                               self._debug,
+                                               store=self._store,
+                                               profiler=self.profiler,
+                                               memory=self.memory)
             self.Plots.vertical_slice = self.Util3D._vertical_slice
 
         ##Re-assignement of utility functions as methods
@@ -282,18 +340,34 @@ class FVCOM:
         return newself
 
     #Methods
-    def save_as(self, filename, fileformat='netcdf', debug=False):
+    def save_as(self, filename, fileformat='netcdf', compress=False,
+                chunk_time=None, derived=[], matlab_version='5',
+                skip_derived=False, debug=False):
         """
         This method saves the current FVCOM structure as:
            - *.nc, i.e. netcdf file
            - *.p, i.e. python file
            - *.mat, i.e. Matlab file
+           - *.cache, i.e. PySeidon cache directory
 
         Inputs:
           - filename = path + name of the file to be saved, string
 
         Options:
-          - fileformat = format of the file to be saved, i.e. 'pickle', .netcdf. or 'matlab'
+          - fileformat = format of the file to be saved, i.e. 'pickle', .netcdf.,
+                         'matlab' or 'cache'
+          - compress = compression if True, for 'cache', 'netcdf' and 'matlab'
+          - chunk_time = number of time steps per netcdf chunk, integer
+          - derived = fields computed block by block while writing the netcdf
+                      file, ex: ['hori_velo_norm', 'power_density'],
+                      see pyseidon_to_netcdf
+          - matlab_version = '5' or '7.3', i.e. HDF5 based matlab file
+                             streamed by blocks (requires h5py)
+          - skip_derived = derived fields not exported in matlab files if True
+
+        *Notes*
+          - the cache is written variable by variable and reopened lazily,
+            i.e. FVCOM('filename.cache'), prefer it to 'pickle' for large data
         """
         debug = debug or self._debug
         if debug:
@@ -301,10 +375,14 @@ class FVCOM:
         #Save as different formats
         if fileformat=='pickle':
             pyseidon_to_pickle(self, filename, debug)
+        elif fileformat=='cache':
+            pyseidon_to_cache(self, filename, compress=compress, debug=debug)
         elif fileformat=='matlab':
-            pyseidon_to_matlab(self, filename, debug)
+            pyseidon_to_matlab(self, filename, debug, version=matlab_version,
+                               skip_derived=skip_derived, compress=compress)
         elif fileformat=='netcdf':
-            pyseidon_to_netcdf(self, filename, debug)
+            pyseidon_to_netcdf(self, filename, debug, compress=compress,
+                               chunk_time=chunk_time, derived=derived)
         else:
             print "---Wrong file format---"
 
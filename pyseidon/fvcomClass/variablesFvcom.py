@@ -2,8 +2,6 @@
 # encoding: utf-8
 
 from __future__ import division
-from itertools import groupby
-from operator import itemgetter
 import datetime
 # Parallel computing
 import multiprocessing as mp
@@ -11,6 +9,8 @@ import multiprocessing as mp
 from pyseidon.utilities.regioner import *
 from pyseidon.utilities.miscellaneous import time_to_index
 from pyseidon.utilities.miscellaneous import mattime_to_datetime
+from pyseidon.utilities.opendap_access import read_columns
+from pyseidon.utilities.memory_budget import memory_budget
 
 class _load_var:
     """
@@ -45,9 +45,13 @@ class _load_var:
                       |_vorticity...
 
     """
-    def __init__(self, data, grid, tx, History, debug=False):
+    def __init__(self, data, grid, tx, History, memory=None, debug=False):
         self._debug = debug
         self._3D = False
+        #Memory budget of the loaded arrays, only kept while loading
+        if memory is None:
+            memory = memory_budget()
+        self._memory = memory
         self._opendap = type(data.variables).__name__=='DatasetType'
 
         # Pointer to History
@@ -227,6 +231,7 @@ class _load_var:
             # if debug: print "...-loading 2D & 3D- processing time: ", (endT - startT)
             # #-------end-------
 
+        del self._memory
         if debug: print '...Passed'
         return
 
@@ -284,38 +289,17 @@ class _load_var:
             self._scipynetcdf = False
 
         if self._opendap:
-        # loop over contiguous indexes for opendap
-            H = 0 #local counter
-            for k, g in groupby(enumerate(region), lambda (i,x):i-x):
-                ID = map(itemgetter(1), g)
-                #if debug: print 'Index bound: ' + str(ID[0]) + '-' + str(ID[-1]+1)
-                if key in self._kwl2D:
-                    if self._scipynetcdf:
-                        #TR : Don't I need to transpose here?
-                        var = data.variables[key].data[ts:te,ID[0]:(ID[-1]+1)]
-                    else:
-                        var = data.variables[key][ts:te,ID[0]:(ID[-1]+1)]
-                    if H == 0:
-                        setattr(self, aliaS,var)
-                        H = 1
-                    else:
-                        setattr(self, aliaS, np.hstack((getattr(self, aliaS), var)))
-                else:
-                    if self._scipynetcdf:
-                        #TR : Don't I need to transpose here?
-                        var = data.variables[key].data[ts:te,:,ID[0]:(ID[-1]+1)]
-                    else:
-                        var = data.variables[key][ts:te,:,ID[0]:(ID[-1]+1)]
-                    if H == 0:
-                        setattr(self, aliaS,var)
-                        H = 1
-                    else:
-                        setattr(self, aliaS, np.dstack((getattr(self, aliaS), var)))
+            # contiguous indexes coalesced into concurrent requests for opendap
+            if self._scipynetcdf:
+                var = data.variables[key].data
+            else:
+                var = data.variables[key]
+            setattr(self, aliaS, read_columns(var, region, lead=(slice(ts, te),)))
         # TR comment: looping on time indices is a trick from Mitchell O'Flaherty-Sproul to improve loading time
         else:
             I = 0
             if key in self._kwl2D:
-                setattr(self, aliaS, np.zeros((grid.ntime, horiDim)))
+                setattr(self, aliaS, self._memory.allocate((grid.ntime, horiDim), name=aliaS))
                 for i in self._region_time:
                     if self._scipynetcdf:
                         getattr(self, aliaS)[I,:] = np.transpose(data.variables[key].data[i, region])
@@ -323,7 +307,8 @@ class _load_var:
                         getattr(self, aliaS)[I,:] = (data.variables[key][i, region])
                     I += 1
             else:
-                setattr(self, aliaS, np.zeros((grid.ntime, vertiDim, horiDim)))
+                setattr(self, aliaS, self._memory.allocate((grid.ntime, vertiDim, horiDim),
+                                                            name=aliaS))
                 for i in self._region_time:
                     if self._scipynetcdf:
                         getattr(self, aliaS)[I,:,:] = np.transpose(data.variables[key].data[i, :, region])
@@ -364,44 +349,24 @@ class _load_var:
             self._scipynetcdf = False
 
         if self._opendap:
-        # loop over contiguous indexes for opendap
-            H = 0 #local counter
-            for k, g in groupby(enumerate(region), lambda (i,x):i-x):
-                ID = map(itemgetter(1), g)
-                #if debug: print 'Index bound: ' + str(ID[0]) + '-' + str(ID[-1]+1)
-                if key in self._kwl2D:
-                    if self._scipynetcdf:
-                        #TR : Don't I need to transpose here?
-                        var = data.variables[key].data[:,ID[0]:(ID[-1]+1)]
-                    else:
-                        var = data.variables[key][:,ID[0]:(ID[-1]+1)]
-                    if H == 0:
-                        setattr(self, aliaS,var)
-                        H = 1
-                    else:
-                        setattr(self, aliaS, np.hstack((getattr(self, aliaS), var)))
-                else:
-                    if self._scipynetcdf:
-                        #TR : Don't I need to transpose here?
-                        var = data.variables[key].data[:,:,ID[0]:(ID[-1]+1)]
-                    else:
-                        var = data.variables[key][:,:,ID[0]:(ID[-1]+1)]
-                    if H == 0:
-                        setattr(self, aliaS,var)
-                        H = 1
-                    else:
-                        setattr(self, aliaS, np.dstack((getattr(self, aliaS), var)))
+            # contiguous indexes coalesced into concurrent requests for opendap
+            if self._scipynetcdf:
+                var = data.variables[key].data
+            else:
+                var = data.variables[key]
+            setattr(self, aliaS, read_columns(var, region, lead=(slice(None),)))
         else:
             # TR comment: looping on time indices is a trick from Mitchell O'Flaherty-Sproul to improve loading time
             if key in self._kwl2D:
-                setattr(self, aliaS, np.zeros((grid.ntime, horiDim)))
+                setattr(self, aliaS, self._memory.allocate((grid.ntime, horiDim), name=aliaS))
                 for i in range(grid.ntime):
                     if self._scipynetcdf:
                         getattr(self, aliaS)[i,:] = np.transpose(data.variables[key].data[i, region])
                     else:
                         getattr(self, aliaS)[i,:] = (data.variables[key][i, region])
             else:
-                setattr(self, aliaS, np.zeros((grid.ntime, vertiDim, horiDim)))
+                setattr(self, aliaS, self._memory.allocate((grid.ntime, vertiDim, horiDim),
+                                                            name=aliaS))
                 for i in range(grid.ntime):
                     if self._scipynetcdf:
                         getattr(self, aliaS)[i,:,:] = np.transpose(data.variables[key].data[i, :, region])
@@ -443,22 +408,18 @@ class _load_var:
             self._scipynetcdf = False
 
         if self._opendap:
-            if key in self._kwl2D:
-                if self._scipynetcdf:
-                    var = data.variables[key].data[ts:te,:]
-                else:
-                    var = data.variables[key][ts:te,:]
+            # split into concurrent requests for opendap
+            if self._scipynetcdf:
+                var = data.variables[key].data
             else:
-                if self._scipynetcdf:
-                    var = data.variables[key].data[ts:te,:,:]
-                else:
-                    var = data.variables[key][ts:te,:,:]
-            setattr(self, aliaS,var)
+                var = data.variables[key]
+            setattr(self, aliaS, read_columns(var, np.arange(horiDim),
+                                              lead=(slice(ts, te),)))
         else:
             I = 0
             # TR comment: looping on time indices is a trick from Mitchell O'Flaherty-Sproul to improve loading time
             if key in self._kwl2D:
-                setattr(self, aliaS, np.zeros((grid.ntime, horiDim)))
+                setattr(self, aliaS, self._memory.allocate((grid.ntime, horiDim), name=aliaS))
                 for i in self._region_time:
                     if self._scipynetcdf:
                         getattr(self, aliaS)[I,:] = np.transpose(data.variables[key].data[i, :])
@@ -466,7 +427,8 @@ class _load_var:
                         getattr(self, aliaS)[I,:] = (data.variables[key][i, :])
                     I += 1
             else:
-                setattr(self, aliaS, np.zeros((grid.ntime, vertiDim, horiDim)))
+                setattr(self, aliaS, self._memory.allocate((grid.ntime, vertiDim, horiDim),
+                                                            name=aliaS))
                 for i in self._region_time:
                     if self._scipynetcdf:
                         getattr(self, aliaS)[I,:,:] = np.transpose(data.variables[key].data[i, :, :])
@@ -599,38 +561,15 @@ class _load_grid:
 
             #different loading technique if using OpenDap server
             if type(data.variables).__name__=='DatasetType':
-                #Split into consecutive integers to optimise loading
                 #TR comment: data.variables['ww'].data[:,:,region_n] doesn't
                 #            work with non consecutive indices
-                H=0
-                for k, g in groupby(enumerate(self._node_index), lambda (i,x):i-x):
-                    ID = map(itemgetter(1), g)
-                    #if debug: print 'Index bound: ' + str(ID[0]) + '-' + str(ID[-1]+1)
-                    if H==0:
-                        try:
-                            self.h = data.variables['h'].data[ID[0]:(ID[-1]+1)]
-                            self.siglay = data.variables['siglay'].data[:,ID[0]:(ID[-1]+1)]
-                            self.siglev = data.variables['siglev'].data[:,ID[0]:(ID[-1]+1)]
-                        except AttributeError: #exception for nc.dataset type data
-                            self.h = data.variables['h'][ID[0]:(ID[-1]+1)]
-                            self.siglay = data.variables['siglay'][:,ID[0]:(ID[-1]+1)]
-                            self.siglev = data.variables['siglev'][:,ID[0]:(ID[-1]+1)]
-                    else:
-                        try:
-                            self.h = np.hstack((self.h,
-                            data.variables['h'].data[ID[0]:(ID[-1]+1)]))
-                            self.siglay = np.hstack((self.siglay,
-                            data.variables['siglay'].data[:,ID[0]:(ID[-1]+1)]))
-                            self.siglev = np.hstack((self.siglev,
-                            data.variables['siglev'].data[:,ID[0]:(ID[-1]+1)]))
-                        except AttributeError: #exception for nc.dataset type data
-                            self.h = np.hstack((self.h,
-                            data.variables['h'][ID[0]:(ID[-1]+1)]))
-                            self.siglay = np.hstack((self.siglay,
-                            data.variables['siglay'][:,ID[0]:(ID[-1]+1)]))
-                            self.siglev = np.hstack((self.siglev,
-                            data.variables['siglev'][:,ID[0]:(ID[-1]+1)]))
-                    H=1
+                #Contiguous indexes coalesced into concurrent requests
+                for key in ['h', 'siglay', 'siglev']:
+                    try:
+                        var = data.variables[key].data
+                    except AttributeError: #exception for nc.dataset type data
+                        var = data.variables[key]
+                    setattr(self, key, read_columns(var, self._node_index))
             else:
                 try:  
                     self.h = data.variables['h'].data[self._node_index]
@@ -3,6 +3,7 @@
 
 #Local import
 from stationClass import Station
+from stationDataset import StationDataset
 
 __authors__ = ['Wesley Bowman, Thomas Roc, Jonathan Smith']
 __licence__ = 'GNU Affero GPL v3.0'
@@ -7,12 +7,16 @@ import sys
 import numexpr as ne
 from pyseidon.utilities.miscellaneous import *
 from pyseidon.utilities.BP_tools import *
-from utide import solve, reconstruct
+from pyseidon.utilities.lazy_import import lazy_function
 import time
 
 # Custom error
 from pyseidon_error import PyseidonError
 
+#Imported on first use
+solve = lazy_function('utide', 'solve')
+reconstruct = lazy_function('utide', 'reconstruct')
+
 class FunctionsStation:
     """
     **'Util2D' subset of Station class gathers useful functions for 2D and 3D runs**
@@ -31,13 +35,14 @@ class FunctionsStation:
             index = station
         elif type(station).__name__ in ['str', 'ndarray']:
             station = "".join(station).strip().upper()
-            for i in range(self._grid.nele):
-                if station=="".join(self._grid.name[i]).strip().upper():
-                   index=i
+            # Name map built at load time and when stations are added
+            if not hasattr(self._grid, '_name_index'):
+                self._grid._name_index = name_index(self._grid.name)
+            index = self._grid._name_index.get(station, -1)
+            if index < 0:
+                raise PyseidonError("---Wrong station input---")
         else:
             raise PyseidonError("---Wrong station input---")
-        if not 'index' in locals():
-            raise PyseidonError("---Wrong station input---")
 
         return index
 
@@ -16,32 +16,18 @@ class FunctionsStationThreeD:
     """
     **'Utils3D' subset of Station class gathers useful functions for 3D runs**
     """
-    def __init__(self, variable, grid, plot, History, debug):
+    def __init__(self, variable, grid, plot, util, History, debug):
         #Inheritance
         self._debug = debug
         self._plot = plot
+        self._util = util
+        self.search_index = self._util.search_index
 
         #Create pointer to FVCOM class
         setattr(self, '_var', variable)
         setattr(self, '_grid', grid)
         setattr(self, '_History', History)
 
-    def search_index(self, station):
-        """Search for the station index"""
-        if type(station)==int:
-            index = station
-        elif type(station).__name__ in ['str', 'ndarray']:
-            station = "".join(station).strip().upper()
-            for i in range(self._grid.nele):
-                if station=="".join(self._grid.name[i]).strip().upper():
-                   index=i
-        else:
-            raise PyseidonError("---Wrong station input---")
-        if not 'index' in locals():
-            raise PyseidonError("---Wrong station input---")
-
-        return index
-
     def depth(self, station, debug=False):
         """
         Compute depth at given point
@@ -4,25 +4,28 @@
 from __future__ import division
 
 import numpy as np
-import netCDF4 as nc
 from scipy.io import netcdf
 from scipy.io import savemat
-from pydap.client import open_url
 import cPickle as pkl
 import copy
 
 #Utility import
 from pyseidon.utilities.object_from_dict import ObjectFromDict
-from pyseidon.utilities.miscellaneous import findFiles
+from pyseidon.utilities.miscellaneous import findFiles, match_coordinates, name_index
+from pyseidon.utilities.lazy_import import LazyModule, LazyObject
+from pyseidon.utilities.opendap_access import open_dataset
 
 # Custom error
 from pyseidon.utilities.pyseidon_error import PyseidonError
 
 #Local import
 from variablesStation import _load_var, _load_grid
+from stationDataset import StationDataset, TimeConcat
 from functionsStation import *
 from functionsStationThreeD import *
-from plotsStation import *
+
+#Heavy dependencies imported on first use
+nc = LazyModule('netCDF4')
 
 class Station:
     """
@@ -46,11 +49,13 @@ class Station:
                        testFvcom=Station('./path_to_FVOM_output_file/folder/')
 
         Note that if the path point to a folder all the similar netCDF station files
-        will be stack together.
+        will be stack together, lazily, see StationDataset.
         Note that the file can be a pickle file (i.e. *.p) or a netcdf file (i.e. *.nc).
 
     Options:
       - elements = indices to extract, list of integers
+      - tolerance = maximum distance in m between matching stations of
+                    different files, float. Only for folders
 
     *Notes*
       Throughout the package, the following conventions apply:
@@ -61,15 +66,16 @@ class Station:
       - Depth = 0m is the free surface and depth is negative
 
     """
-    def __init__(self, filename, elements=slice(None), debug=False):
+    def __init__(self, filename, elements=slice(None), tolerance=0.0, debug=False):
         #Class attributs
         self._debug = debug
         self._isMulti(filename)
         if not self._multi:
             self._load(filename, elements, debug=debug )
-            self.Plots = PlotsStation(self.Variables,
-                                      self.Grid,
-                                      self._debug)
+            self.Plots = LazyObject('plotsStation', 'PlotsStation',
+                                    self.Variables,
+                                    self.Grid,
+                                    self._debug)
             self.Util2D = FunctionsStation(self.Variables,
                                            self.Grid,
                                            self.Plots,
@@ -80,16 +86,23 @@ class Station:
                                        self.Variables,
                                        self.Grid,
                                        self.Plots,
+                                       self.Util2D,
                                        self.History,
                                        self._debug) 
         else:
             print "---Finding matching files---"
-            self._matches = findFiles(filename, 'STATION')
-            filename = self._matches.pop(0)
-            self._load(filename, elements, debug=debug )
-            self.Plots = PlotsStation(self.Variables,
-                                      self.Grid,
-                                      self._debug)
+            #Stations matched on coordinates and stacked lazily along time
+            dataset = StationDataset(filename, elements=elements,
+                                     tolerance=tolerance, debug=debug)
+            self.Data = dataset.Data
+            self._origin_file = dataset._origin_file
+            self.History = dataset.History
+            self.Grid = dataset.Grid
+            self.Variables = dataset.Variables
+            self.Plots = LazyObject('plotsStation', 'PlotsStation',
+                                    self.Variables,
+                                    self.Grid,
+                                    self._debug)
             self.Util2D = FunctionsStation(self.Variables,
                                            self.Grid,
                                            self.Plots,
@@ -100,22 +113,12 @@ class Station:
                                        self.Variables,
                                        self.Grid,
                                        self.Plots,
+                                       self.Util2D,
                                        self.History,
                                        self._debug) 
-            for entry in self._matches:
-                #Define new 
-                text = 'Created from ' + entry
-                tmp = {}
-                tmp['Data'] = self._load_nc(entry)
-                tmp['History'] = [text]
-                tmp['Grid'] = _load_grid(tmp['Data'], elements, [], debug=self._debug)
-                tmp['Variables'] = _load_var(tmp['Data'], elements, tmp['Grid'], [],
-                                             debug=self._debug)
-                tmp = ObjectFromDict(tmp)
-                self = self.__add__(tmp)
 
         ##Re-assignement of utility functions as methods
-        self.dump_profile_data = self.Plots._dump_profile_data_as_csv
+        self.dump_profile_data = self.Plots._method('_dump_profile_data_as_csv')
 
         return
 
@@ -142,9 +145,7 @@ class Station:
                 if self._origin_file.startswith('http'):
                     #Look for file through OpenDAP server
                     print "Retrieving data through OpenDap server..."
-                    self.Data = open_url(data['Origin'])
-                    #Create fake attribut to be consistent with the rest of the code
-                    self.Data.variables = self.Data
+                    self.Data = open_dataset(data['Origin'], debug=debug)
                 else:
                     self.Data = self._load_nc(data['Origin'])
             except: #TR: need to precise the type of error here
@@ -155,9 +156,7 @@ class Station:
             if filename.startswith('http'):
                 #Look for file through OpenDAP server
                 print "Retrieving data through OpenDap server..."
-                self.Data = open_url(filename)
-                #Create fake attribut to be consistent with the rest of the code
-                self.Data.variables = self.Data
+                self.Data = open_dataset(filename, debug=debug)
             else:
                 #Look for file locally
                 print "Retrieving data from " + filename + " ..."
@@ -204,7 +203,7 @@ class Station:
         return Data
 
     #Special methods
-    def __add__(self, StationClass, debug=False):
+    def __add__(self, StationClass, tolerance=0.0, debug=False):
         """
         This special method permit to stack variables
         of 2 Station objects through a simple addition: ::
@@ -216,30 +215,16 @@ class Station:
             same spatial domain
           - last time step of station1 must be <= to the 
             first time step of station2 
+          - stations are matched on coordinates, within tolerance (m)
         """
         debug = debug or self._debug
         if debug: print "Find matching elements..."
         #Find matching elements
-        origNele = self.Grid.nele
-        origEle = []
-        #origName = self.Grid.name
-        origX = self.Grid.x[:]
-        origY = self.Grid.y[:]
-        newNele = StationClass.Grid.nele
-        newEle = []
-        #newName = StationClass.Grid.name
-        newX = StationClass.Grid.x[:]
-        newY = StationClass.Grid.y[:]
-        for i in range(origNele):
-            for j in range(newNele):
-                #Match based on names
-                #if (all(origName[i,:]==newName[j,:])):
-                #    origEle.append(i)
-                #    newEle.append(j)
-                #Match based on coordinates
-                if ((origX[i]==newX[j]) and (origY[i]==newY[j])):
-                    origEle.append(i)
-                    newEle.append(j)
+        #Match based on coordinates
+        origEle, newEle = match_coordinates(self.Grid.x[:], self.Grid.y[:],
+                                            StationClass.Grid.x[:],
+                                            StationClass.Grid.y[:],
+                                            tolerance=tolerance)
                 
         print len(origEle), " points will be stacked..."
 
@@ -267,31 +252,29 @@ class Station:
 
             #keyword list for vstack
             kwl=['u', 'v', 'w', 'tke', 'gls', 'ua', 'va','el']
-            kwl2D=['ua', 'va','el']
             for key in kwl:
                 try:
-                    if key in kwl2D:
-                        tmpN = getattr(newself.Variables, key)\
-                               [:,newEle[:]]
-                        tmpO = getattr(StationClass.Variables, key)\
-                               [:,origEle[:]]                   
-                        setattr(newself.Variables, key,
-                        np.vstack((tmpN[:], tmpO[:])))
-                        if debug: print "Stacking " + key + "..."
-                    else:
-                        tmpN = getattr(newself.Variables, key)\
-                               [:,:,newEle[:]]
-                        tmpO = getattr(StationClass.Variables, key)\
-                               [:,:,origEle[:]]                   
-                        setattr(newself.Variables, key,
-                        np.vstack((tmpN[:], tmpO[:])))  
-                        if debug: print "Stacking " + key + "..."    
+                    tmpN = getattr(newself.Variables, key)[...,origEle]
+                    tmpO = getattr(StationClass.Variables, key)[...,newEle]
+                    #Preallocated, each record being copied once
+                    stack = np.empty((tmpN.shape[0]+tmpO.shape[0],)+tmpN.shape[1:],
+                                     dtype=tmpN.dtype)
+                    stack[:tmpN.shape[0]] = tmpN
+                    stack[tmpN.shape[0]:] = tmpO
+                    setattr(newself.Variables, key, stack)
+                    if debug: print "Stacking " + key + "..."
                 except AttributeError:
                     continue
             #New time dimension
             newself.Grid.ntime = newself.Grid.ntime + StationClass.Grid.ntime
-            #Keep only matching names
-            newself.Grid.name = self.Grid.name[origEle[:]]
+            #Keep only matching stations
+            for key in ['x', 'y', 'lon', 'lat', 'h', 'name']:
+                setattr(newself.Grid, key, getattr(self.Grid, key)[origEle])
+            for key in ['siglay', 'siglev']:
+                setattr(newself.Grid, key, getattr(self.Grid, key)[:,origEle])
+            newself.Grid.nele = len(origEle)
+            newself.Grid.nnode = len(origEle)
+            newself.Grid._name_index = name_index(newself.Grid.name)
             #Append to new object history
             text = 'Data from ' + StationClass.History[0].split('/')[-1] \
                  + ' has been stacked'
@@ -335,7 +318,7 @@ class Station:
             #TR: Force caching Variables otherwise error during loading
             #    with 'netcdf4.Variable' type (see above)
             for key in data['Variables']:
-                listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
+                listkeys=['Variable', 'ArrayProxy', 'BaseType', 'TimeConcat']
                 if any([type(data['Variables'][key]).__name__==x for x in listkeys]):
                     if debug:
                         print "Force caching for " + key
@@ -345,7 +328,7 @@ class Station:
             #TR: Force caching Variables otherwise error during loading
             #    with 'netcdf4.Variable' type (see above)
             for key in data['Grid']:
-                listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
+                listkeys=['Variable', 'ArrayProxy', 'BaseType', 'TimeConcat']
                 if any([type(data['Grid'][key]).__name__==x for x in listkeys]):
                     if debug:
                         print "Force caching for " + key
@@ -376,7 +359,7 @@ class Station:
             #TR: Force caching Variables otherwise error during loading
             #    with 'netcdf4.Variable' type (see above)
             for key in Var:
-                listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
+                listkeys=['Variable', 'ArrayProxy', 'BaseType', 'TimeConcat']
                 if any([type(Var[key]).__name__==x for x in listkeys]):
                     if debug:
                         print "Force caching for " + key
@@ -387,7 +370,7 @@ class Station:
             #Unpickleable objects
             Grd.pop("triangle", None)
             for key in Grd:
-                listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
+                listkeys=['Variable', 'ArrayProxy', 'BaseType', 'TimeConcat']
                 if any([type(Grd[key]).__name__==x for x in listkeys]):
                     if debug:
                         print "Force caching for " + key
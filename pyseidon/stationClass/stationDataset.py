@@ -0,0 +1,238 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+from __future__ import division
+
+import numpy as np
+from scipy.io import netcdf
+
+#Utility import
+from pyseidon.utilities.object_from_dict import ObjectFromDict
+from pyseidon.utilities.lazy_import import LazyModule
+from pyseidon.utilities.miscellaneous import findFiles, match_coordinates,\
+                                             mattime_to_datetime, name_index
+from pyseidon.utilities.interpolation_utils import gather_columns
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Imported on first use
+nc = LazyModule('netCDF4')
+
+def _open_nc(filename):
+    """loads netcdf file, see Station._load_nc"""
+    try:
+        Data = netcdf.netcdf_file(filename, 'r', mmap=True)
+    except ValueError: #TR: quick fix due to mmap
+        Data = nc.Dataset(filename, 'r')
+    return Data
+
+def _raw(data, key):
+    """Raw variable, without loading it"""
+    try:
+        return data.variables[key].data
+    except AttributeError: #exeception due nc.Dataset
+        return data.variables[key]
+
+class TimeConcat:
+    """
+    Lazy concatenation along time of the same variable stored in several files
+
+    Inputs:
+      - parts = variables of each file, time being their first dimension
+      - columns = station indices to read in each file, list of 1D arrays
+                  of integers. Station i of the dataset is station columns[k][i]
+                  of file k
+
+    *Notes*
+      - nothing is read until the object is indexed, ex: var[t0:t1, index],
+        and then only the requested time steps and stations are read
+    """
+    def __init__(self, parts, columns):
+        self._parts = parts
+        self._columns = columns
+        nt = [p.shape[0] for p in parts]
+        self._bounds = np.hstack((0, np.cumsum(nt))).astype(int)
+        self.shape = (int(self._bounds[-1]),) + tuple(parts[0].shape[1:-1]) +\
+                     (columns[0].shape[0],)
+        self.ndim = len(self.shape)
+        self.dtype = parts[0].dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        out = self[:]
+        if dtype is not None:
+            out = out.astype(dtype)
+        return out
+
+    def __getitem__(self, key):
+        if not type(key) == tuple:
+            key = (key,)
+        if any([k is Ellipsis for k in key]):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i+1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        tind = np.arange(self.shape[0])[key[0]]
+        scalar = (np.ndim(tind) == 0)
+        tind = np.atleast_1d(tind)
+        #Stations selected before reading
+        skey = key[-1]
+        pieces = []
+        order = np.argsort(tind, kind='mergesort')
+        sortedT = tind[order]
+        for k in range(len(self._parts)):
+            t0 = self._bounds[k]
+            t1 = self._bounds[k + 1]
+            lo = np.searchsorted(sortedT, t0, side='left')
+            hi = np.searchsorted(sortedT, t1, side='left')
+            if hi == lo:
+                continue
+            local = sortedT[lo:hi] - t0
+            cols = np.atleast_1d(self._columns[k][skey])
+            if local.shape[0] == local[-1] - local[0] + 1:
+                local = slice(int(local[0]), int(local[-1]) + 1)
+            # gather_columns expects sorted unique columns
+            uniq, inv = np.unique(cols, return_inverse=True)
+            sub = gather_columns(self._parts[k], uniq, time_ind=local)
+            pieces.append(np.asarray(sub)[..., inv])
+        out = np.concatenate(pieces, axis=0)
+        out = out[np.argsort(order, kind='mergesort')]
+        #Intermediate dimensions, i.e. vertical levels
+        out = out[(slice(None),) + key[1:-1]]
+        if np.ndim(skey) == 0 and not type(skey) == slice:
+            out = out[..., 0]
+        if scalar:
+            out = out[0]
+
+        return out
+
+class StationDataset:
+    """
+    **Multi-file Station dataset**
+
+    Opens a list or a folder of Station files, matches their stations on
+    coordinates and concatenates their variables along time without
+    loading them.
+
+    Class structured as follows: ::
+
+                       _Data = list of raw netcdf files
+                      |_Variables. = lazily concatenated variables
+     StationDataset._|_Grid. = grid of the matching stations
+                      |_History = Quality Control metadata
+
+    Inputs:
+      - filename = path to folder, string, or list of paths to netcdf files
+
+    Options:
+      - elements = station indices of the first file to extract,
+                   list of integers
+      - tolerance = maximum distance in m between matching stations, float.
+                    0.0 for exact matches
+    """
+    def __init__(self, filename, elements=slice(None), tolerance=0.0, debug=False):
+        self._debug = debug
+        if type(filename) in [list, tuple]:
+            files = list(filename)
+        else:
+            files = findFiles(filename, 'STATION')
+        if len(files) == 0:
+            raise PyseidonError("---No station file found---")
+        if debug: print "Opening " + str(len(files)) + " files..."
+        self.Data = [_open_nc(f) for f in files]
+
+        #Sort files by time
+        start = [_raw(d, 'time_JD')[0] + _raw(d, 'time_second')[0] / (24*3600)
+                 for d in self.Data]
+        order = np.argsort(start)
+        self.Data = [self.Data[i] for i in order]
+        files = [files[i] for i in order]
+        self._origin_file = files[0]
+        self.History = ['Created from ' + f for f in files]
+
+        #Match stations of each file with those of the first file
+        if debug: print "Find matching stations..."
+        ref = np.arange(_raw(self.Data[0], 'x').shape[0])[elements]
+        ref = np.atleast_1d(ref)
+        x0 = _raw(self.Data[0], 'x')[:][ref]
+        y0 = _raw(self.Data[0], 'y')[:][ref]
+        keep = np.arange(ref.shape[0])
+        matches = [np.arange(ref.shape[0])]
+        for d in self.Data[1:]:
+            i1, i2 = match_coordinates(x0, y0, _raw(d, 'x')[:], _raw(d, 'y')[:],
+                                       tolerance=tolerance)
+            lookup = -np.ones(ref.shape[0], dtype=int)
+            lookup[i1] = i2
+            matches.append(lookup)
+            keep = np.intersect1d(keep, i1)
+        if keep.shape[0] == 0:
+            raise PyseidonError("---No matching element found---")
+        print len(keep), " points will be stacked..."
+        columns = [ref[keep]] + [m[keep] for m in matches[1:]]
+
+        #Check time consistency
+        for d0, d1 in zip(self.Data[:-1], self.Data[1:]):
+            if not (_raw(d0, 'time_JD')[-1] <= _raw(d1, 'time_JD')[0]):
+                raise PyseidonError("---Data not consecutive in time---")
+
+        self.Grid = self._grid(columns[0], debug=debug)
+        self.Variables = self._variables(columns, debug=debug)
+        self.Grid.ntime = self.Variables.matlabTime.shape[0]
+
+        #-Append message to History field
+        start = mattime_to_datetime(self.Variables.matlabTime[0])
+        end = mattime_to_datetime(self.Variables.matlabTime[-1])
+        text = 'Full temporal domain from ' + str(start) +\
+               ' to ' + str(end)
+        self.History.append(text)
+
+    def _grid(self, elements, debug=False):
+        """Grid of the matching stations, taken from the first file"""
+        if debug: print 'Loading grid...'
+        data = self.Data[0]
+        grid = {}
+        grid['x'] = _raw(data, 'x')[:][elements]
+        grid['y'] = _raw(data, 'y')[:][elements]
+        grid['lon'] = _raw(data, 'lon')[:][elements]
+        grid['lat'] = _raw(data, 'lat')[:][elements]
+        grid['h'] = _raw(data, 'h')[:][elements]
+        grid['siglay'] = _raw(data, 'siglay')[:][:, elements]
+        grid['siglev'] = _raw(data, 'siglev')[:][:, elements]
+        name = _raw(data, 'name_station')[:][elements]
+        if len(name.shape) > 1:
+            name = np.array(["".join(n).strip() for n in name])
+        grid['name'] = name
+        grid['nlevel'] = grid['siglay'].shape[0]
+        grid['nele'] = grid['x'].shape[0]
+        grid['nnode'] = grid['x'].shape[0]
+        grid['_name_index'] = name_index(name)
+        grid['_ax'] = [grid['lon'].min(), grid['lon'].max(),
+                       grid['lat'].min(), grid['lat'].max()]
+
+        return ObjectFromDict(grid)
+
+    def _variables(self, columns, debug=False):
+        """Time axes and lazily concatenated hydro variables"""
+        if debug: print 'Loading variables...'
+        var = {}
+        var['julianTime'] = np.hstack([_raw(d, 'time_JD')[:] for d in self.Data])
+        var['secondTime'] = np.hstack([_raw(d, 'time_second')[:] for d in self.Data])
+        var['matlabTime'] = var['julianTime'] + 678942.0 +\
+                            var['secondTime'] / (24*3600)
+        #Keywords and aliases, see _load_var
+        kwl = ['ua', 'va', 'zeta', 'ww', 'u', 'v', 'gls', 'tke']
+        al = ['ua', 'va', 'el', 'w', 'u', 'v', 'gls', 'tke']
+        var['_3D'] = False
+        for key, aliaS in zip(kwl, al):
+            try:
+                parts = [_raw(d, key) for d in self.Data]
+            except KeyError:
+                if debug: print key, " is missing !"
+                continue
+            var[aliaS] = TimeConcat(parts, columns)
+            if key in ['ww', 'u', 'v', 'gls', 'tke']:
+                var['_3D'] = True
+
+        return ObjectFromDict(var)
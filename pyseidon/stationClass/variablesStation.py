@@ -4,10 +4,29 @@
 from __future__ import division
 
 import numpy as np
-from itertools import groupby
-from operator import itemgetter
 #Local import
-from pyseidon.utilities.miscellaneous import mattime_to_datetime
+from pyseidon.utilities.miscellaneous import mattime_to_datetime, name_index
+from pyseidon.utilities.opendap_access import read_columns
+
+def _read_runs(data, key, index):
+    """
+    Reads any given variable for the given station indices with
+    coalesced and concurrent hyperslab requests
+
+    Inputs:
+      - data = OpenDap dataset
+      - key = variable name, string
+      - index = station indices, 1D array of integers
+
+    Outputs:
+      - var = numpy array
+    """
+    try:
+        var = data.variables[key].data
+    except AttributeError: #exeception due nc.Dataset
+        var = data.variables[key]
+
+    return read_columns(var, index)
 
 class _load_grid:
     """
@@ -59,6 +78,9 @@ class _load_grid:
                 newNames[i]="".join(self.name[i,:]).strip()
             self.name = newNames
 
+        # Station name -> index map
+        self._name_index = name_index(self.name)
+
         #Computing bounding box
         lon = self.lon[:]
         lat = self.lat[:]
@@ -144,51 +166,16 @@ class _load_var:
             #loading hori data
             keyCount = 0
             for key, aliaS in zip(kwl2D, al2D):
-                #Special loading for zeta
-                H = 0 #local counter
-                if key == 'zeta':
-                    for k, g in groupby(enumerate(region_n), lambda (i,x):i-x):
-                        ID = map(itemgetter(1), g)
-                        if debug: print 'Index bound: ' +\
-                            str(ID[0]) + '-' + str(ID[-1]+1)
-                        if H==0:
-                            try:
-                                setattr(self, aliaS, data.variables[key].data[:,ID[0]:(ID[-1]+1)])
-                            except AttributeError: #exeception due nc.Dataset
-                                setattr(self, aliaS, data.variables[key][:,ID[0]:(ID[-1]+1)])
-                            H=1
-                        else:
-                            try:
-                                setattr(self, aliaS,
-                                np.hstack((getattr(self, aliaS),
-                                data.variables[key].data[:,ID[0]:(ID[-1]+1)])))
-                            except AttributeError: #exeception due nc.Dataset
-                                setattr(self, aliaS,
-                                np.hstack((getattr(self, aliaS),
-                                data.variables[key][:,ID[0]:(ID[-1]+1)])))
-                else:
-                    try:                        
-                        for k, g in groupby(enumerate(region_e), lambda (i,x):i-x):
-                            ID = map(itemgetter(1), g)
-                            if debug: print 'Index bound: ' + str(ID[0]) + '-' + str(ID[-1]+1)
-                            if H==0:
-                                setattr(self, aliaS,
-                                        data.variables[key].\
-                                        data[:,ID[0]:(ID[-1]+1)])
-                                H=1
-                            else:
-                                try:
-                                    setattr(self, aliaS,
-                                    np.hstack((getattr(self, aliaS),
-                                    data.variables[key].data[:,ID[0]:(ID[-1]+1)])))
-                                except AttributeError: #exeception due nc.Dataset
-                                    setattr(self, aliaS,
-                                    np.hstack((getattr(self, aliaS),
-                                    data.variables[key][:,ID[0]:(ID[-1]+1)])))
-                            keyCount +=1
-                    except KeyError:
-                        if debug: print key, " is missing !"
-                        continue
+                try:
+                    #Special loading for zeta
+                    if key == 'zeta':
+                        setattr(self, aliaS, _read_runs(data, key, region_n))
+                    else:
+                        setattr(self, aliaS, _read_runs(data, key, region_e))
+                    keyCount +=1
+                except KeyError:
+                    if debug: print key, " is missing !"
+                    continue
             if keyCount==0:
                 print "---Horizontal variables are missing---"
             self._3D = False 
@@ -197,27 +184,7 @@ class _load_var:
             keyCount = 0
             for key, aliaS in zip(kwl3D, al3D):
                 try:
-                    H = 0 #local counter
-                    for k, g in groupby(enumerate(region_e), lambda (i,x):i-x):
-                        ID = map(itemgetter(1), g)
-                        if debug: print 'Index bound: ' + str(ID[0]) + '-' + str(ID[-1]+1)
-                        if H==0:
-                            try:
-                                setattr(self, aliaS,
-                                data.variables[key].data[:,:,ID[0]:(ID[-1]+1)])
-                            except AttributeError: #exeception due nc.Dataset
-                                setattr(self, aliaS,
-                                data.variables[key][:,:,ID[0]:(ID[-1]+1)])
-                            H=1
-                        else:
-                            try:
-                                setattr(self, aliaS,
-                                np.dstack((getattr(self, aliaS),
-                                data.variables[key].data[:,:,ID[0]:(ID[-1]+1)])))
-                            except AttributeError: #exeception due nc.Dataset
-                                setattr(self, aliaS,
-                                np.dstack((getattr(self, aliaS),
-                                data.variables[key][:,:,ID[0]:(ID[-1]+1)])))
+                    setattr(self, aliaS, _read_runs(data, key, region_e))
                     keyCount +=1
                 except KeyError:
                     if debug: print key, " is missing !"
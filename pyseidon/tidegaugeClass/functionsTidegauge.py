@@ -3,9 +3,13 @@
 
 from __future__ import division
 
-from utide import solve, reconstruct
+from pyseidon.utilities.lazy_import import lazy_function
 from pyseidon.utilities.miscellaneous import mattime_to_datetime
 
+#Imported on first use
+solve = lazy_function('utide', 'solve')
+reconstruct = lazy_function('utide', 'reconstruct')
+
 class FunctionsTidegauge:
     """
     **'Utils' subset of TideGauge class gathers useful functions**
@@ -5,10 +5,12 @@ from __future__ import division
 
 import scipy.io as sio
 
+#Utility import
+from pyseidon.utilities.lazy_import import LazyObject
+
 #Local import
 from variablesTidegauge import _load_tidegauge
 from functionsTidegauge import *
-from plotsTidegauge import *
 
 class TideGauge:
     """
@@ -45,7 +47,8 @@ class TideGauge:
                                struct_as_record=False, squeeze_me=True)
         self.Variables = _load_tidegauge(self.Data, self.History, debug=self._debug)
 
-        self.Plots = PlotsTidegauge(self.Variables, debug=self._debug)
+        self.Plots = LazyObject('plotsTidegauge', 'PlotsTidegauge',
+                                self.Variables, debug=self._debug)
 
         self.Utils = FunctionsTidegauge(self.Variables,
                                         self.Plots,
@@ -53,5 +56,5 @@ class TideGauge:
                                         debug=self._debug)
 
         ##Re-assignement of utility functions as methods
-        self.dump_profile_data = self.Plots._dump_profile_data_as_csv
+        self.dump_profile_data = self.Plots._method('_dump_profile_data_as_csv')
 
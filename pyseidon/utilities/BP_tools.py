@@ -6,7 +6,10 @@ from datetime import datetime
 from datetime import timedelta
 import scipy.io as sio
 import scipy.interpolate as sip
-import matplotlib.pyplot as plt
+from pyseidon.utilities.lazy_import import LazyModule
+
+#Imported when plotting
+plt = LazyModule('matplotlib.pyplot')
 
 def date2py(matlab_datenum):
     python_datetime = datetime.fromordinal(int(matlab_datenum)) + \
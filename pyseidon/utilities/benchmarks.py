@@ -0,0 +1,238 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+from __future__ import division
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+#Utility import
+from pyseidon.utilities.synthetic_data import synthetic_fvcom, synthetic_station
+from pyseidon.utilities.synthetic_data import synthetic_adcp, synthetic_tidegauge
+from pyseidon.utilities.synthetic_data import DOMAIN
+
+#Statements timed in fresh interpreters
+_IMPORTS = ['import pyseidon',
+            'from pyseidon import Station',
+            'from pyseidon import TideGauge',
+            'from pyseidon import FVCOM',
+            'from pyseidon import Validation']
+#Heavy dependencies reported when loaded
+_HEAVY = ['matplotlib.pyplot', 'seaborn', 'pydap.client', 'netCDF4',
+          'h5py', 'utide', 'pandas', 'numexpr', 'scipy.stats']
+_CODE = "import sys, time\n"\
+        "t = time.time()\n"\
+        "%s\n"\
+        "t = time.time() - t\n"\
+        "sys.stdout.write(repr(t) + '\\n')\n"\
+        "sys.stdout.write(','.join([m for m in %r if m in sys.modules]))\n"
+
+def import_benchmark(statements=_IMPORTS, repeat=5, headless=True, debug=False):
+    """
+    Times import statements, each one in fresh python processes
+
+    Options:
+      - statements = import statements to time, list of strings
+      - repeat = number of processes per statement, integer
+      - headless = runs in headless mode if True, i.e. PYSEIDON_HEADLESS=1
+
+    Outputs:
+      - results = dictionary, statements as keys and as values
+                  (best time in s, mean time in s, heavy modules loaded)
+
+    *Notes*
+      - run from shell: python -m pyseidon.utilities.benchmarks
+    """
+    env = dict(os.environ)
+    if headless:
+        env['PYSEIDON_HEADLESS'] = '1'
+    results = {}
+    for statement in statements:
+        times = []
+        loaded = []
+        for i in range(repeat):
+            proc = subprocess.Popen([sys.executable, '-c', _CODE % (statement, _HEAVY)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    env=env)
+            out, err = proc.communicate()
+            if not proc.returncode == 0:
+                if debug: print err
+                print "---" + statement + " failed---"
+                break
+            out = out.decode('ascii').split('\n')
+            times.append(float(out[0]))
+            loaded = [m for m in out[1].split(',') if not m == '']
+        if len(times) == 0:
+            continue
+        results[statement] = (min(times), sum(times) / len(times), loaded)
+        print statement + ": best " + "%.3f" % min(times) + " s, mean " +\
+              "%.3f" % (sum(times) / len(times)) + " s"
+        if debug or len(loaded) > 0:
+            print "   loaded: " + ", ".join(loaded)
+
+    return results
+
+#Benchmark steps: name, setup and timed statement
+_SETUP = "from pyseidon import FVCOM, Station, ADCP, TideGauge, Validation\n"\
+         "from pyseidon.utilities.regioner import regioner\n"
+_OPEN = "o = FVCOM(%(fvcom)r)"
+_STEPS = [('FVCOM open', "", _OPEN),
+          ('FVCOM open ax', "", "o = FVCOM(%(fvcom)r, ax=%(ax)r)"),
+          ('FVCOM open tx', "", "o = FVCOM(%(fvcom)r, tx=%(tx)r)"),
+          ('Station open', "", "o = Station(%(station)r)"),
+          ('regioner', _OPEN, "r = regioner(o.Grid, %(ax)r)"),
+          ('interpolation_at_point', _OPEN,
+           "r = o.Util2D.interpolation_at_point(o.Variables.ua, %(lon)r, %(lat)r)"),
+          ('depth', _OPEN, "o.Util3D.depth()"),
+          ('interp_at_depth', _OPEN, "r = o.Util3D.interp_at_depth(o.Variables.u[:], -5.0)"),
+          ('vorticity', _OPEN, "o.Util3D.vorticity()"),
+          ('harmonic analysis', _OPEN,
+           "r = o.Util2D.Harmonic_analysis_at_point(%(lon)r, %(lat)r)"),
+          ('validate_data ADCP', _OPEN + "\nv = Validation(ADCP(%(adcp)r), o)",
+           "v.validate_data()"),
+          ('validate_data TideGauge', _OPEN + "\nv = Validation(TideGauge(%(tidegauge)r), o)",
+           "v.validate_data()")]
+_STEP = "import sys, time, gc, resource\n"\
+        "def peak():\n"\
+        "    try:\n"\
+        "        for line in open('/proc/self/status'):\n"\
+        "            if line.startswith('VmHWM'):\n"\
+        "                return float(line.split()[1]) * 1024\n"\
+        "    except IOError:\n"\
+        "        pass\n"\
+        "    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"\
+        "    return float(rss) * (1 if sys.platform == 'darwin' else 1024)\n"\
+        "%s\n"\
+        "%s\n"\
+        "gc.collect()\n"\
+        "m0 = peak()\n"\
+        "t = time.time()\n"\
+        "%s\n"\
+        "t = time.time() - t\n"\
+        "m1 = peak()\n"\
+        "sys.stdout.write('\\n' + ' '.join([repr(t), repr(m0), repr(m1)]) + '\\n')\n"
+
+def synthetic_case(directory, nele=5000, nlevel=10, ntime=144, dt=600.0,
+                   domain=DOMAIN, debug=False):
+    """
+    Writes the synthetic FVCOM, Station, ADCP and tide gauge files of
+    one benchmark case
+
+    Inputs:
+      - directory = where to write the files, string
+
+    Options:
+      - see synthetic_fvcom
+
+    Outputs:
+      - case = dictionary with file names, ax, tx, lon and lat of the case
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    case = {}
+    case['fvcom'] = os.path.join(directory, 'fvcom_' + str(nele) + '.nc')
+    case['station'] = os.path.join(directory, 'station_' + str(nele) + '.nc')
+    case['adcp'] = os.path.join(directory, 'adcp.mat')
+    case['tidegauge'] = os.path.join(directory, 'tidegauge.mat')
+    grid = synthetic_fvcom(case['fvcom'], nele=nele, nlevel=nlevel, ntime=ntime,
+                           dt=dt, domain=domain, debug=debug)
+    #Stations at every 100th element
+    synthetic_station(case['station'], grid['lonc'][::100], grid['latc'][::100],
+                      nlevel=nlevel, ntime=ntime, dt=dt, domain=domain, debug=debug)
+    #Instruments in the middle of the domain
+    lon = 0.5 * (domain[0] + domain[1])
+    lat = 0.5 * (domain[2] + domain[3])
+    synthetic_adcp(case['adcp'], lon, lat, ntime=ntime, dt=dt, domain=domain,
+                   debug=debug)
+    synthetic_tidegauge(case['tidegauge'], lon, lat, ntime=2 * ntime, dt=dt / 2.0,
+                        domain=domain, debug=debug)
+    wlon = domain[1] - domain[0]
+    wlat = domain[3] - domain[2]
+    case['ax'] = [domain[0] + 0.3 * wlon, domain[0] + 0.7 * wlon,
+                  domain[2] + 0.3 * wlat, domain[2] + 0.7 * wlat]
+    case['tx'] = ['2013-08-01 03:00:00', '2013-08-01 09:00:00']
+    case['lon'] = lon
+    case['lat'] = lat
+
+    return case
+
+def benchmark_suite(sizes=[1000, 10000, 100000], steps=None, nlevel=10,
+                    ntime=144, repeat=1, directory=None, keep=False,
+                    debug=False):
+    """
+    Times PySeidon's main operations on synthetic data of several sizes,
+    each operation in fresh python processes
+
+    Options:
+      - sizes = numbers of elements, list of integers
+      - steps = names of the steps to run, list of strings. Default: all,
+                i.e. FVCOM open (with/without ax/tx), Station open, regioner,
+                interpolation_at_point, depth, interp_at_depth, vorticity,
+                harmonic analysis and validate_data
+      - nlevel = number of sigma layers, integer
+      - ntime = number of time steps, integer
+      - repeat = number of processes per step, integer
+      - directory = where to write the synthetic files, string.
+                    Default: temporary directory
+      - keep = keeps the synthetic files if True, boolean
+
+    Outputs:
+      - results = dictionary, (size, step) as keys and as values
+                  (best time in s, peak memory in MB, memory increase in MB)
+
+    *Notes*
+      - run from shell: python -m pyseidon.utilities.benchmarks suite
+      - peak memory = peak resident memory of the process (unix only),
+        the increase being due to the timed statement alone
+      - sizes limited by the memory, the synthetic files being written
+        with scipy
+    """
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='pyseidon_bench_')
+    env = dict(os.environ)
+    env['PYSEIDON_HEADLESS'] = '1'
+    #No derived field reloaded from a previous run
+    env.pop('PYSEIDON_STORE', None)
+    scale = 1024.0 * 1024.0
+    results = {}
+    try:
+        for size in sizes:
+            print "---Case with " + str(size) + " elements---"
+            case = synthetic_case(directory, nele=size, nlevel=nlevel,
+                                  ntime=ntime, debug=debug)
+            for name, setup, statement in _STEPS:
+                if steps is not None and not name in steps:
+                    continue
+                times = []
+                for i in range(repeat):
+                    code = _STEP % (_SETUP, setup % case, statement % case)
+                    proc = subprocess.Popen([sys.executable, '-c', code],
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE, env=env)
+                    out, err = proc.communicate()
+                    if not proc.returncode == 0:
+                        if debug: print err
+                        print "---" + name + " failed---"
+                        break
+                    line = [l for l in out.decode('ascii').split('\n') if not l == ''][-1]
+                    t, m0, m1 = [float(v) for v in line.split()]
+                    times.append((t, m1 / scale, (m1 - m0) / scale))
+                if len(times) == 0:
+                    continue
+                results[(size, name)] = min(times)
+                t, peak, increase = min(times)
+                print name + ": " + "%.3f" % t + " s, peak " + "%.1f" % peak +\
+                      " MB (+" + "%.1f" % increase + " MB)"
+    finally:
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+if __name__ == '__main__':
+    if 'suite' in sys.argv[1:]:
+        benchmark_suite()
+    else:
+        import_benchmark()
@@ -0,0 +1,280 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import hashlib
+import json
+import os
+import time
+from os.path import join, isdir, isfile, expanduser, abspath, getsize, getmtime
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+from pyseidon.utilities.profiling import record
+
+#Default location, overwritten by the PYSEIDON_STORE environment variable
+STORE_DIR = join(expanduser('~'), '.pyseidon', 'derived')
+#Default size cap in bytes
+STORE_SIZE = 2**32
+
+def fingerprint(origin):
+    """
+    Fingerprint of any given source file, i.e. path, size and modification
+    time, or url for OpenDap files
+
+    Inputs:
+      - origin = path to file or url, string
+
+    Outputs:
+      - fingerprint = string
+    """
+    if origin.startswith('http') or not isfile(origin):
+        return origin
+    return abspath(origin) + '|' + str(getsize(origin)) + '|' + repr(getmtime(origin))
+
+class DerivedStore:
+    """
+    **On-disk store of derived fields**
+
+    Derived fields (depth, velocity norm, vorticity,...) are saved as
+    numpy files, keyed by source file fingerprint, region, time window,
+    function and parameters, and reloaded memory mapped.
+
+    Options:
+      - directory = path to the store, string. Default: ~/.pyseidon/derived
+                    or PYSEIDON_STORE environment variable
+      - max_size = size cap in bytes, integer. Least recently used fields
+                   evicted beyond it
+
+    *Notes*
+      - fields keep track of the fields they depend on, ex: power_density
+        depends on velo_norm, and are discarded when those are recomputed
+      - fields of a source file are discarded when the file changes
+    """
+    def __init__(self, directory=None, max_size=STORE_SIZE, debug=False):
+        self._debug = debug
+        if directory is None:
+            directory = os.environ.get('PYSEIDON_STORE', STORE_DIR)
+        self.directory = directory
+        self.max_size = max_size
+        if not isdir(directory):
+            os.makedirs(directory)
+
+    def _read_index(self):
+        """Reads the index of the store"""
+        path = join(self.directory, 'index.json')
+        if not isfile(path):
+            return {}
+        f = open(path, 'r')
+        try:
+            index = json.load(f)
+        except ValueError:
+            #Corrupted index, store restarted
+            index = {}
+        f.close()
+        return index
+
+    def _write_index(self, index):
+        """Writes the index of the store, atomically"""
+        path = join(self.directory, 'index.json')
+        tmp = path + '.' + str(os.getpid())
+        f = open(tmp, 'w')
+        json.dump(index, f)
+        f.close()
+        os.rename(tmp, path)
+
+    def _remove(self, index, key):
+        """
+        Removes one entry and, recursively, the entries depending on it
+
+        Outputs:
+          - removed = removed entries, dictionary
+        """
+        entry = index.pop(key, None)
+        if entry is None:
+            return {}
+        if isfile(join(self.directory, entry['file'])):
+            os.remove(join(self.directory, entry['file']))
+        removed = {key: entry}
+        for other in [k for k in index if key in index[k]['depends'].values()]:
+            removed.update(self._remove(index, other))
+
+        return removed
+
+    def _dependencies(self, index, key):
+        """Keys of the entries any given entry depends on, recursively"""
+        keys = set()
+        stack = [key]
+        while stack:
+            k = stack.pop()
+            if not k in index or k in keys:
+                continue
+            keys.add(k)
+            stack.extend(index[k]['depends'].values())
+
+        return keys
+
+    def key(self, context, name, params={}):
+        """
+        Key of a derived field
+
+        Inputs:
+          - context = source fingerprint, region and time window, dictionary
+          - name = field name, string
+
+        Options:
+          - params = parameters of the function, dictionary
+        """
+        text = json.dumps([context, name, params], sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def load(self, context, name, params={}):
+        """
+        Reloads a derived field
+
+        Outputs:
+          - value = memory mapped array, None if not stored or outdated
+        """
+        index = self._read_index()
+        key = self.key(context, name, params)
+        if not key in index:
+            return None
+        entry = index[key]
+        if not isfile(join(self.directory, entry['file'])):
+            self._remove(index, key)
+            self._write_index(index)
+            return None
+        entry['last_access'] = time.time()
+        self._write_index(index)
+        if self._debug: print "Reloading " + name + " from " + self.directory
+
+        return np.load(join(self.directory, entry['file']), mmap_mode='c')
+
+    def save(self, context, name, value, depends=[], params={}):
+        """
+        Saves a derived field
+
+        Inputs:
+          - context = source fingerprint, region and time window, dictionary
+          - name = field name, string
+          - value = field, array
+
+        Options:
+          - depends = names of the fields it is computed from, list of strings
+          - params = parameters of the function, dictionary
+        """
+        value = np.asarray(np.ma.filled(value))
+        if value.nbytes > self.max_size:
+            if self._debug: print name + " larger than the store"
+            return
+        index = self._read_index()
+        #Stale fields of the same source, i.e. modified file
+        path = context['source'].split('|')[0]
+        for k in [k for k in index if index[k]['path'] == path and
+                  not index[k]['source'] == context['source']]:
+            self._remove(index, k)
+        key = self.key(context, name, params)
+        #Recomputed field, fields depending on it outdated
+        self._remove(index, key)
+        entry = {'name': name, 'file': key + '.npy', 'path': path,
+                 'source': context['source'], 'size': int(value.nbytes),
+                 'created': time.time(), 'last_access': time.time(),
+                 'depends': dict([(d, self.key(context, d)) for d in depends])}
+        np.save(join(self.directory, entry['file']), value)
+        index[key] = entry
+        #LRU eviction, sparing the new field and the fields it depends on
+        protected = self._dependencies(index, key)
+        total = sum([index[k]['size'] for k in index])
+        for k in sorted(index, key=lambda k: index[k]['last_access']):
+            if total <= self.max_size:
+                break
+            if k in protected or not k in index:
+                continue
+            if self._debug: print "Evicting " + index[k]['name']
+            removed = self._remove(index, k)
+            total -= sum([removed[r]['size'] for r in removed])
+        self._write_index(index)
+
+    def invalidate(self, context, name, params={}):
+        """Removes a derived field and the fields depending on it"""
+        index = self._read_index()
+        self._remove(index, self.key(context, name, params))
+        self._write_index(index)
+
+    def clear(self):
+        """Empties the store"""
+        index = self._read_index()
+        for key in index.keys():
+            self._remove(index, key)
+        self._write_index(index)
+
+    def bind(self, fvcom):
+        """
+        Store bound to any given FVCOM object, see StoreBinding
+
+        Inputs:
+          - fvcom = FVCOM object
+        """
+        mtime = fvcom.Variables.matlabTime
+        context = {'source': fingerprint(fvcom._origin_file),
+                   'region': [float(a) for a in fvcom.Grid._ax],
+                   'nele': int(fvcom.Grid.nele), 'nnode': int(fvcom.Grid.nnode),
+                   'time': [float(mtime[0]), float(mtime[-1]), int(mtime.shape[0])]}
+        return StoreBinding(self, context)
+
+class StoreBinding:
+    """
+    Derived store of one FVCOM object, i.e. fixed source, region and
+    time window
+
+    Inputs:
+      - store = DerivedStore, None for no store
+      - context = source fingerprint, region and time window, dictionary
+    """
+    def __init__(self, store=None, context={}):
+        self._store = store
+        self._context = context
+
+    def restore(self, obj, name, History, params={}):
+        """
+        Sets a stored derived field as attribute of Variables or Grid
+
+        Outputs:
+          - restored = True if found in the store, boolean
+        """
+        if self._store is None:
+            return False
+        value = self._store.load(self._context, name, params)
+        if value is None:
+            return False
+        setattr(obj, name, value)
+        record('cache_hits', backend='store')
+        History.append(name + ' reloaded from derived store')
+        print '-' + name + ' reloaded from derived store-'
+
+        return True
+
+    def folder(self, name):
+        """
+        Sub-folder of the store for other cached quantities, ex: operators,
+        None for no store
+
+        Inputs:
+          - name = sub-folder name, string
+        """
+        if self._store is None:
+            return None
+        return join(self._store.directory, name)
+
+    def save(self, name, value, depends=[], params={}):
+        """Saves a derived field, see DerivedStore.save"""
+        if self._store is None:
+            return
+        try:
+            self._store.save(self._context, name, value, depends=depends,
+                             params=params)
+        except (IOError, OSError) as e:
+            #Store not mandatory
+            print "---Derived store unavailable: " + str(e) + "---"
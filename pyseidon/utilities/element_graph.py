@@ -0,0 +1,167 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import weakref
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Graphs already built, one per grid
+_GRAPHS = weakref.WeakKeyDictionary()
+#Largest distance matrix computed at once, in number of values
+_BLOCK = 2**24
+
+def element_neighbours(trinodes):
+    """
+    Surrounding elements of each element, i.e. elements sharing an edge
+
+    Inputs:
+      - trinodes = surrounding node indices, 2D array (nele, 3)
+
+    Outputs:
+      - triele = surrounding element indices, 2D array (nele, 3),
+                 -1 for open or land boundaries
+
+    *Notes*
+      - same as FVCOM's nbe (transposed, zero based) for grids without it
+    """
+    trinodes = np.asarray(trinodes, dtype=int)
+    nele = trinodes.shape[0]
+    #Edge i of element e is opposite to its node i, as in FVCOM
+    edges = np.vstack((trinodes[:, [1, 2]], trinodes[:, [2, 0]], trinodes[:, [0, 1]]))
+    edges.sort(axis=1)
+    owner = np.tile(np.arange(nele), 3)
+    slot = np.repeat(np.arange(3), nele)
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    edges = edges[order]
+    shared = np.where((edges[1:] == edges[:-1]).all(axis=1))[0]
+    triele = -np.ones((nele, 3), dtype=int)
+    a = order[shared]
+    b = order[shared + 1]
+    triele[owner[a], slot[a]] = owner[b]
+    triele[owner[b], slot[b]] = owner[a]
+
+    return triele
+
+def _metric_coordinates(lon, lat):
+    """Local equirectangular projection in metres"""
+    lat0 = np.deg2rad(np.mean(lat))
+    x = np.deg2rad(lon) * 6371000.0 * np.cos(lat0)
+    y = np.deg2rad(lat) * 6371000.0
+
+    return x, y
+
+class ElementGraph:
+    """
+    **Element adjacency graph of an FVCOM grid**
+
+    Elements are linked to the elements they share an edge with, links
+    being weighted by the distance between element centres.
+
+    Inputs:
+      - triele = surrounding element indices, 2D array (nele, 3)
+      - xc = x coordinates at elements (m), 1D array (nele)
+      - yc = y coordinates at elements (m), 1D array (nele)
+
+    *Notes*
+      - sparse (CSR) adjacency matrix and scipy's Dijkstra, see paths
+    """
+    def __init__(self, triele, xc, yc, debug=False):
+        self._debug = debug
+        triele = np.asarray(triele, dtype=int)
+        if triele.shape[0] == 3 and not triele.shape[1] == 3:
+            triele = triele.T
+        xc = np.asarray(xc[:], dtype=float)
+        yc = np.asarray(yc[:], dtype=float)
+        self.nele = triele.shape[0]
+        if not xc.shape[0] == self.nele:
+            raise PyseidonError("---triele and xc/yc dimensions differ---")
+        self.xc = xc
+        self.yc = yc
+        rows = np.repeat(np.arange(self.nele), 3)
+        cols = triele.ravel()
+        #Ghost elements, i.e. boundaries
+        keep = (cols >= 0) & (cols < self.nele)
+        rows = rows[keep]
+        cols = cols[keep]
+        weights = np.hypot(xc[cols] - xc[rows], yc[cols] - yc[rows])
+        #Zero weights would be seen as missing links
+        weights[weights == 0.0] = np.finfo(float).tiny
+        self.graph = csr_matrix((weights, (rows, cols)),
+                                shape=(self.nele, self.nele))
+        if debug: print str(rows.shape[0]) + " links, " + str(self.nele) + " elements"
+
+    def paths(self, sources, targets):
+        """
+        Shortest element paths between many source/target pairs
+
+        Inputs:
+          - sources = source element indices, 1D array of integers
+          - targets = target element indices, 1D array of integers
+
+        Outputs:
+          - paths = element indices from source to target, list of
+                    1D arrays, empty arrays when unreachable
+          - distances = path lengths (m), 1D array, inf when unreachable
+
+        *Notes*
+          - one Dijkstra run per distinct source
+        """
+        sources = np.atleast_1d(np.asarray(sources, dtype=int))
+        targets = np.atleast_1d(np.asarray(targets, dtype=int))
+        if not sources.shape == targets.shape:
+            raise PyseidonError("---sources and targets must have the same length---")
+        paths = [None] * sources.shape[0]
+        distances = np.zeros(sources.shape[0])
+        uniq = np.unique(sources)
+        step = max(1, _BLOCK // max(self.nele, 1))
+        for i in range(0, uniq.shape[0], step):
+            block = uniq[i:i+step]
+            if self._debug: print "Dijkstra from " + str(block.shape[0]) + " elements..."
+            dist, pred = dijkstra(self.graph, directed=False, indices=block,
+                                  return_predecessors=True)
+            for j, s in enumerate(block):
+                for k in np.where(sources == s)[0]:
+                    t = targets[k]
+                    distances[k] = dist[j, t]
+                    if np.isinf(dist[j, t]):
+                        paths[k] = np.array([], dtype=int)
+                        continue
+                    path = [t]
+                    while not path[-1] == s:
+                        path.append(pred[j, path[-1]])
+                    paths[k] = np.array(path[::-1], dtype=int)
+
+        return paths, distances
+
+def element_graph(grid, debug=False):
+    """
+    Element graph of any given FVCOM grid, built once per grid
+
+    Inputs:
+      - grid = FVCOM.Grid
+
+    Outputs:
+      - graph = ElementGraph
+
+    *Notes*
+      - geographic coordinates used when xc/yc are not provided
+    """
+    cached = _GRAPHS.get(grid)
+    if cached is not None and cached[0] is grid.triele:
+        return cached[1]
+    if debug: print "Building element graph..."
+    xc = np.asarray(grid.xc[:])
+    yc = np.asarray(grid.yc[:])
+    if np.all(xc == 0.0) and np.all(yc == 0.0):
+        xc, yc = _metric_coordinates(np.asarray(grid.lonc[:]),
+                                     np.asarray(grid.latc[:]))
+    graph = ElementGraph(grid.triele[:], xc, yc, debug=debug)
+    _GRAPHS[grid] = (grid.triele, graph)
+
+    return graph
@@ -0,0 +1,233 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+
+#Utility import
+from pyseidon.utilities.lazy_import import lazy_function
+from pyseidon.utilities.memory_budget import memory_budget
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Heavy dependencies imported on first use
+FUV = lazy_function('utide.harmonics', 'FUV')
+
+#Degrees to radians
+_RPD = np.pi / 180.0
+
+def _snr(coef, twodim):
+    """Signal to noise ratios of the constituents, as in utide.reconstruct"""
+    if twodim:
+        if not ('Lsmaj_ci' in coef and 'Lsmin_ci' in coef):
+            return None
+        noise = (np.asarray(coef['Lsmaj_ci']) / 1.96)**2 +\
+                (np.asarray(coef['Lsmin_ci']) / 1.96)**2
+        signal = np.asarray(coef['Lsmaj'])**2 + np.asarray(coef['Lsmin'])**2
+    else:
+        if not 'A_ci' in coef:
+            return None
+        noise = (np.asarray(coef['A_ci']) / 1.96)**2
+        signal = np.asarray(coef['A'])**2
+    return signal / np.where(noise > 0.0, noise, np.nan)
+
+def stack_coefficients(coefs, minsnr=2.0):
+    """
+    Stacks the UTide harmonic coefficients of many points as complex
+    amplitude matrices
+
+    Inputs:
+      - coefs = UTide coefficients of each point, list of 'solve' outputs,
+                all with the same constituents
+
+    Options:
+      - minsnr = constituents below this signal to noise ratio are left
+                 out at each point, as in 'reconstruct', float
+
+    Outputs:
+      - stacked = dictionary: 'name', 'lind' (constituents), 'reftime',
+                  'lat', 'ngflgs' (see utide.harmonics.FUV), 'twodim',
+                  'ap', 'am' (complex amplitudes, 2D arrays (nconst, npts)),
+                  'mean', 'slope' (1D arrays (npts), complex if twodim)
+    """
+    if len(coefs) == 0:
+        raise PyseidonError("---No harmonic coefficients---")
+    first = coefs[0]
+    names = [str(n).strip() for n in first['name']]
+    twodim = 'Lsmaj' in first
+    opt = first['aux']['opt']
+    npts = len(coefs)
+    nconst = len(names)
+    dtype = complex if twodim else float
+    stacked = {'name': np.array(names),
+               'lind': np.asarray(first['aux']['lind']),
+               'reftime': float(first['aux']['reftime']),
+               'lat': np.mean([float(c['aux']['lat']) for c in coefs]),
+               'ngflgs': [opt['nodsatlint'], opt['nodsatnone'],
+                          opt['gwchlint'], opt['gwchnone']],
+               'twodim': twodim,
+               'ap': np.zeros((nconst, npts), dtype=complex),
+               'am': np.zeros((nconst, npts), dtype=complex),
+               'mean': np.zeros(npts, dtype=dtype),
+               'slope': np.zeros(npts, dtype=dtype)}
+    for p, coef in enumerate(coefs):
+        order = dict([(str(n).strip(), i) for i, n in enumerate(coef['name'])])
+        try:
+            ind = np.array([order[n] for n in names], dtype=int)
+        except KeyError:
+            raise PyseidonError("---Coefficients must share their constituents---")
+        if not len(order) == nconst or not ('Lsmaj' in coef) == twodim:
+            raise PyseidonError("---Coefficients must share their constituents---")
+        keep = np.ones(nconst, dtype=bool)
+        snr = _snr(coef, twodim)
+        if snr is not None and minsnr > 0:
+            keep = snr[ind] >= minsnr
+        if twodim:
+            lsmaj = np.asarray(coef['Lsmaj'])[ind]
+            lsmin = np.asarray(coef['Lsmin'])[ind]
+            theta = np.asarray(coef['theta'])[ind]
+            g = np.asarray(coef['g'])[ind]
+            stacked['ap'][:, p] = keep * 0.5 * (lsmaj + lsmin) * np.exp(1j * (theta - g) * _RPD)
+            stacked['am'][:, p] = keep * 0.5 * (lsmaj - lsmin) * np.exp(1j * (theta + g) * _RPD)
+            stacked['mean'][p] = coef['umean'] + 1j * coef['vmean']
+            if 'uslope' in coef:
+                stacked['slope'][p] = coef['uslope'] + 1j * coef['vslope']
+        else:
+            ap = keep * 0.5 * np.asarray(coef['A'])[ind] *\
+                 np.exp(-1j * np.asarray(coef['g'])[ind] * _RPD)
+            stacked['ap'][:, p] = ap
+            stacked['am'][:, p] = np.conj(ap)
+            stacked['mean'][p] = coef['mean']
+            if 'slope' in coef:
+                stacked['slope'][p] = coef['slope']
+
+    return stacked
+
+class HarmonicPredictor:
+    """
+    **Tidal predictions of many points from their harmonic coefficients**
+
+    The constituent basis, i.e. nodal factors and astronomical arguments,
+    is computed once per time vector and the predictions of all the
+    points are matrix products, ex: ::
+
+        predictor = HarmonicPredictor([fvcom.Util2D.Harmonic_analysis_at_point(lon, lat)
+                                       for lon, lat in zip(lons, lats)])
+        el = predictor.predict(time)['h']
+
+    Inputs:
+      - coefs = UTide coefficients of each point, list of 'solve' outputs,
+                or stacked coefficients, see stack_coefficients, or path to
+                a file written by save, string
+
+    Options:
+      - minsnr = constituents below this signal to noise ratio are left
+                 out at each point, as in 'reconstruct', float
+      - memory = memory budget, see MemoryBudget. Default: shared one
+
+    *Notes*
+      - same predictions as 'reconstruct' with its default options, the
+        nodal corrections using the mean latitude of the points
+    """
+    def __init__(self, coefs, minsnr=2.0, memory=None, debug=False):
+        self._debug = debug
+        if type(coefs) == str:
+            data = np.load(coefs)
+            coefs = dict([(k, data[k]) for k in data.files])
+            coefs['twodim'] = bool(coefs['twodim'])
+            coefs['reftime'] = float(coefs['reftime'])
+            coefs['lat'] = float(coefs['lat'])
+        elif not (type(coefs) == dict and 'ap' in coefs):
+            coefs = stack_coefficients(coefs, minsnr=minsnr)
+        self.coefs = coefs
+        self.npts = coefs['ap'].shape[1]
+        if memory is None:
+            memory = memory_budget()
+        self._memory = memory
+        self._basis = None
+
+    def save(self, filename):
+        """
+        Saves the stacked coefficients to a .npz file, see HarmonicPredictor
+
+        Inputs:
+          - filename = path to the file, string
+        """
+        np.savez(filename, **self.coefs)
+
+    def basis(self, time):
+        """
+        Constituent basis of a time vector, F.exp(i(U+V))
+
+        Inputs:
+          - time = matlab times, 1D array (ntime)
+
+        Outputs:
+          - basis = complex 2D array (ntime, nconst)
+
+        *Notes*
+          - the basis of the last time vector is kept
+        """
+        time = np.asarray(time, dtype=float).ravel()
+        if self._basis is not None and self._basis[0].shape == time.shape \
+           and np.array_equal(self._basis[0], time):
+            return self._basis[1]
+        if self._debug: print "Computing constituent basis..."
+        F, U, V = FUV(time, self.coefs['reftime'], self.coefs['lind'],
+                      self.coefs['lat'], self.coefs['ngflgs'])
+        basis = F * np.exp(1j * (U + V) * 2.0 * np.pi)
+        self._basis = (time.copy(), basis)
+
+        return basis
+
+    def predict(self, time, columns=slice(None), debug=False):
+        """
+        Predicted signals
+
+        Inputs:
+          - time = matlab times, 1D array (ntime)
+
+        Options:
+          - columns = points to predict, slice or 1D array of integers
+
+        Outputs:
+          - prediction = dictionary: 'h' (elevation), or 'u' and 'v'
+                         (velocity components), 2D arrays (ntime, npts),
+                         memory mapped if larger than the memory budget
+
+        *Notes*
+          - evaluated by time or point blocks fitting in the memory budget
+        """
+        debug = (debug or self._debug)
+        time = np.asarray(time, dtype=float).ravel()
+        basis = self.basis(time)
+        cols = np.arange(self.npts)[columns]
+        ap = self.coefs['ap'][:, cols]
+        am = self.coefs['am'][:, cols]
+        mean = self.coefs['mean'][cols]
+        slope = self.coefs['slope'][cols]
+        dt = time - self.coefs['reftime']
+        shape = (time.shape[0], cols.shape[0])
+        twodim = self.coefs['twodim']
+        if twodim:
+            keys = ['u', 'v']
+        else:
+            keys = ['h']
+        prediction = dict([(k, self._memory.allocate(shape, name='prediction_' + k))
+                           for k in keys])
+        #Complex products and their sum held at once
+        for block in self._memory.blocks(shape, dtype=complex, copies=3):
+            fit = np.dot(basis[block[0]], ap[:, block[1]])
+            if twodim:
+                fit += np.dot(np.conj(basis[block[0]]), am[:, block[1]])
+                fit += mean[block[1]][None, :] + dt[block[0]][:, None] * slope[block[1]][None, :]
+                prediction['u'][block] = fit.real
+                prediction['v'][block] = fit.imag
+            else:
+                prediction['h'][block] = 2.0 * fit.real + mean[block[1]][None, :] +\
+                                         dt[block[0]][:, None] * slope[block[1]][None, :]
+        if debug: print '...Passed'
+
+        return prediction
@@ -3,12 +3,13 @@
 
 import sys
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib.tri as Tri
 import matplotlib.ticker as ticker
 from matplotlib.path import Path
 from scipy.spatial import KDTree
 import scipy.interpolate as interpolate
+from pyseidon.utilities.opendap_access import read_columns
+from pyseidon.utilities.profiling import record
 
 def closest_point(pt_lon, pt_lat, lon, lat, lonc, latc, tri,
                   debug=False):
@@ -594,4 +595,160 @@ def interp_linear_to_nodes(var, xc, yc, x, y):
     varinterp = interpol(ask)
     varinterp[np.where(varinterp==np.nan)]=0.0
 
-    return  varinterp
\ No newline at end of file
+    return  varinterp
+
+def node_stencils(pt_x, pt_y, index, trinodes, aw0, awx, awy, debug=False):
+    """
+    Computes the interpolation stencils of node variables at many locations.
+
+    Inputs:
+      - pt_x = relative x coordinates in m, 1D array (npts)
+      - pt_y = relative y coordinates in m, 1D array (npts)
+      - index = indices of the surrounding elements, 1D array of integers (npts)
+      - trinodes = FVCOM trinodes, numpy array, dim=(nele,3)
+      - aw0, awx, awy = grid parameters
+
+    Outputs:
+      - cols = node indices, 2D array of integers (npts, 3)
+      - weights = interpolation weights, 2D array (npts, 3)
+
+    *Notes*
+      - same scheme as interpN_at_pt, i.e. var0 + varX*x0 + varY*y0,
+        written as a weighted sum of the 3 surrounding nodes
+    """
+    if debug: print 'Computing node stencils...'
+    index = np.asarray(index, dtype=int).ravel()
+    pt_x = np.asarray(pt_x, dtype=float).ravel()
+    pt_y = np.asarray(pt_y, dtype=float).ravel()
+    cols = np.asarray(trinodes[:])[index, :].astype(int)
+    weights = (np.asarray(aw0[:])[:, index]
+            + (np.asarray(awx[:])[:, index] * pt_x[None, :])
+            + (np.asarray(awy[:])[:, index] * pt_y[None, :])).T
+    if debug: print '...Passed'
+
+    return cols, weights
+
+def element_stencils(pt_x, pt_y, index, triele, a1u, a2u, debug=False):
+    """
+    Computes the interpolation stencils of element variables at many locations.
+
+    Inputs:
+      - pt_x = relative x coordinates in m, 1D array (npts)
+      - pt_y = relative y coordinates in m, 1D array (npts)
+      - index = indices of the surrounding elements, 1D array of integers (npts)
+      - triele = FVCOM triele, numpy array, dim=(nele,3)
+      - a1u, a2u = grid parameters
+
+    Outputs:
+      - cols = element indices, 2D array of integers (npts, 4)
+      - weights = interpolation weights, 2D array (npts, 4)
+
+    *Notes*
+      - same scheme as interpE_at_pt, ghost points having a null weight
+    """
+    if debug: print 'Computing element stencils...'
+    index = np.asarray(index, dtype=int).ravel()
+    pt_x = np.asarray(pt_x, dtype=float).ravel()
+    pt_y = np.asarray(pt_y, dtype=float).ravel()
+    A1 = np.asarray(a1u[:])
+    A2 = np.asarray(a2u[:])
+    nele = A1.shape[1]
+
+    cols = np.zeros((index.shape[0], 4), dtype=int)
+    cols[:, 0] = index
+    cols[:, 1:] = np.asarray(triele[:])[index, :]
+    weights = (A1[:, index] * pt_x[None, :]).T + (A2[:, index] * pt_y[None, :]).T
+    weights[:, 0] += 1.0
+    # Treatment of ghost points
+    ghost = (cols < 0) | (cols >= nele)
+    weights[ghost] = 0.0
+    cols[ghost] = np.repeat(index[:, None], 4, axis=1)[ghost]
+    if debug: print '...Passed'
+
+    return cols, weights
+
+def gather_columns(var, cols, time_ind=slice(None), debug=False):
+    """
+    Reads only the given horizontal columns of any FVCOM variable.
+
+    Inputs:
+      - var = variable, numpy array, netCDF4 variable or OpenDap proxy,
+              dim=(node) or (time, node) or (time, level, node)
+      - cols = sorted unique horizontal indices, 1D array of integers
+
+    Options:
+      - time_ind = time indices to read, slice or 1D array of integers
+
+    Outputs:
+      - sub = var[time_ind, ..., cols], numpy array
+
+    *Notes*
+      - OpenDap proxies only cope with hyperslabs so columns are read
+        with coalesced and concurrent requests, see opendap_access
+    """
+    if debug: print 'Gathering columns...'
+    cols = np.asarray(cols, dtype=int)
+    ndim = len(var.shape)
+    if type(var).__name__ in ['ArrayProxy', 'BaseType', 'GridType']:
+        if not type(time_ind) == slice:
+            tind = np.asarray(time_ind, dtype=int)
+            tsel = slice(tind.min(), tind.max() + 1)
+        else:
+            tind = None
+            tsel = time_ind
+        if ndim == 1:
+            sub = read_columns(var, cols)
+        else:
+            sub = read_columns(var, cols, lead=(tsel,))
+        if tind is not None and not ndim == 1:
+            sub = sub[tind - tsel.start]
+    elif type(var).__name__ == 'Variable': #Fix for netcdf4 lib
+        # netCDF4 indexes each dimension independently
+        if ndim == 1:
+            sub = var[cols]
+        elif ndim == 2:
+            sub = var[time_ind, cols]
+        else:
+            sub = var[time_ind, :, cols]
+        record('bytes_read', sub.nbytes, backend='netcdf4')
+    else:
+        if ndim == 1:
+            sub = np.asarray(var[cols])
+        elif type(time_ind) == slice:
+            # slicing first keeps a view on (memory mapped) data
+            sub = np.asarray(var[time_ind][..., cols])
+        else:
+            sub = np.asarray(var[..., cols][time_ind])
+        record('bytes_read', sub.nbytes, backend='numpy')
+    if debug: print '...Passed'
+
+    return sub
+
+def apply_stencils(var, cols, weights, time_ind=slice(None), debug=False):
+    """
+    Interpolates any given variable at many locations at once.
+
+    Inputs:
+      - var = variable, numpy array, netCDF4 variable or OpenDap proxy,
+              dim=(node or nele) or (time, node or nele) or (time, level, node or nele)
+      - cols = stencil indices, 2D array of integers (npts, 3 or 4)
+      - weights = stencil weights, 2D array (npts, 3 or 4)
+
+    Options:
+      - time_ind = time indices to read, slice or 1D array of integers
+
+    Outputs:
+      - varInterp = var at the locations, dim=(npts) or (time, npts)
+                    or (time, level, npts)
+
+    *Notes*
+      - only the columns involved in the stencils are read
+    """
+    if debug: print 'Applying stencils...'
+    uniq, inv = np.unique(cols, return_inverse=True)
+    inv = inv.reshape(cols.shape)
+    sub = gather_columns(var, uniq, time_ind=time_ind, debug=debug)
+    varInterp = (sub[..., inv] * weights).sum(axis=-1)
+    if debug: print '...Passed'
+
+    return varInterp
@@ -0,0 +1,120 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+from __future__ import division
+import os
+import importlib
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Headless mode, i.e. pyplot never imported. Set PYSEIDON_HEADLESS=1
+#in the environment or call set_headless()
+HEADLESS = os.environ.get('PYSEIDON_HEADLESS', '').lower() in ['1', 'true', 'yes']
+#Modules importing pyplot
+_PLOTTING = ['matplotlib.pyplot', 'pylab', 'seaborn']
+
+def set_headless(headless=True):
+    """
+    Turns the headless mode on or off
+
+    Options:
+      - headless = no plotting module ever imported if True, boolean
+
+    *Notes*
+      - to be called before any plotting, the Plots attribute of the
+        classes raising an error in headless mode
+    """
+    global HEADLESS
+    HEADLESS = headless
+
+class LazyModule:
+    """
+    Module imported on first use
+
+    Inputs:
+      - name = module name, string, ex: plt = LazyModule('matplotlib.pyplot')
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            if HEADLESS and self._name in _PLOTTING:
+                raise PyseidonError("---" + self._name +
+                                    " not available in headless mode---")
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def lazy_function(module, name):
+    """
+    Function imported on first call
+
+    Inputs:
+      - module = module name, string
+      - name = function name, string,
+               ex: solve = lazy_function('utide', 'solve')
+    """
+    def wrapper(*args, **kwargs):
+        return getattr(importlib.import_module(module), name)(*args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = "Lazy import of " + module + "." + name
+
+    return wrapper
+
+class LazyObject:
+    """
+    Object created on first use, its module being imported at the same time
+
+    Inputs:
+      - module = module name, string
+      - classname = class name, string
+      - *args, **kwargs = arguments of the class
+
+    *Notes*
+      - used for the Plots attributes, i.e. matplotlib and seaborn
+        only imported when plotting
+    """
+    def __init__(self, module, classname, *args, **kwargs):
+        self.__dict__['_module'] = module
+        self.__dict__['_classname'] = classname
+        self.__dict__['_args'] = args
+        self.__dict__['_kwargs'] = kwargs
+        self.__dict__['_obj'] = None
+        #Attributes set before creation
+        self.__dict__['_pending'] = {}
+
+    def _load(self):
+        if self._obj is None:
+            if HEADLESS:
+                raise PyseidonError("---Plots not available in headless mode---")
+            cls = getattr(importlib.import_module(self._module), self._classname)
+            obj = cls(*self._args, **self._kwargs)
+            for attr in self._pending:
+                setattr(obj, attr, self._pending[attr])
+            self.__dict__['_obj'] = obj
+        return self._obj
+
+    def _method(self, name):
+        """Method of the object, the object being created when called"""
+        def wrapper(*args, **kwargs):
+            return getattr(self._load(), name)(*args, **kwargs)
+        wrapper.__name__ = name
+
+        return wrapper
+
+    def __getattr__(self, attr):
+        #Special methods looked up by copy and pickle
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        if self._obj is None:
+            self._pending[attr] = value
+        else:
+            setattr(self._obj, attr, value)
@@ -0,0 +1,199 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import os
+import tempfile
+
+#Utility import
+from pyseidon.utilities.miscellaneous import block_slices
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Units of the memory sizes, ex: '512M' or '4G'
+_UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+#Budget used when the available memory is unknown
+_FALLBACK = 2**31
+
+def parse_size(size):
+    """
+    Memory size in bytes
+
+    Inputs:
+      - size = size in bytes, integer, or string with unit, ex: '512M', '4G'
+
+    Outputs:
+      - size = size in bytes, integer
+    """
+    if not type(size) == str:
+        return int(size)
+    text = size.strip().upper().rstrip('B')
+    try:
+        if text[-1:] in _UNITS:
+            return int(float(text[:-1]) * _UNITS[text[-1]])
+        return int(float(text))
+    except ValueError:
+        raise PyseidonError("---Wrong memory size: " + size + "---")
+
+def available_memory():
+    """
+    Memory available to new processes in bytes, None if unknown
+    """
+    try:
+        f = open('/proc/meminfo', 'r')
+        try:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 2**10
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+class MemoryBudget:
+    """
+    **Memory budget of whole-field operations**
+
+    Estimates the footprint of an operation from its output shape and
+    dtype and splits it into time blocks, or element blocks when a single
+    time step does not fit, so that it stays within the budget. Outputs
+    larger than the budget are memory mapped to disk.
+
+    Options:
+      - budget = budget in bytes, integer, or string, ex: '4G'.
+                 Default: PYSEIDON_MEMORY_BUDGET environment variable or
+                 half of the available memory
+      - directory = folder of the memory mapped outputs, string.
+                    Default: PYSEIDON_SCRATCH environment variable or
+                    temporary folder
+
+    *Notes*
+      - copies = number of arrays of the output size held at once by an
+        operation, i.e. inputs, intermediates and output
+    """
+    def __init__(self, budget=None, directory=None, debug=False):
+        self._debug = debug
+        if budget is None:
+            budget = os.environ.get('PYSEIDON_MEMORY_BUDGET', None)
+        if budget is None:
+            available = available_memory()
+            if available is None:
+                budget = _FALLBACK
+            else:
+                budget = available // 2
+        self.budget = parse_size(budget)
+        if directory is None:
+            directory = os.environ.get('PYSEIDON_SCRATCH', tempfile.gettempdir())
+        self.directory = directory
+
+    def footprint(self, shape, dtype=float, copies=1):
+        """
+        Memory footprint of an operation in bytes
+
+        Inputs:
+          - shape = output shape, tuple of integers
+
+        Options:
+          - dtype = output dtype
+          - copies = number of arrays of the output size held at once
+        """
+        return int(np.prod(shape)) * np.dtype(dtype).itemsize * copies
+
+    def fits(self, shape, dtype=float, copies=1):
+        """True if the operation fits in the budget, boolean"""
+        return self.footprint(shape, dtype, copies) <= self.budget
+
+    def blocks(self, shape, dtype=float, copies=1):
+        """
+        Blocks of an operation fitting in the budget
+
+        Inputs:
+          - shape = output shape, tuple of integers, dim=(time, ..., ele)
+
+        Options:
+          - dtype = output dtype
+          - copies = number of arrays of the output size held at once
+
+        Outputs:
+          - blocks = indices of the blocks, list of tuples of slices,
+                     ex: out[block] = f(var[block])
+
+        *Notes*
+          - one single block when the whole operation fits, time blocks
+            when a time step fits, element blocks otherwise
+        """
+        shape = tuple(shape)
+        if len(shape) == 0:
+            return [()]
+        itemsize = np.dtype(dtype).itemsize * copies
+        if self.fits(shape, dtype, copies) or len(shape) == 1:
+            return [(slice(None),) * len(shape)]
+        if self.fits(shape[1:], dtype, copies):
+            blocks = block_slices(shape, itemsize, self.budget)
+            if self._debug: print str(len(blocks)) + " time blocks"
+            return [(s,) + (slice(None),) * (len(shape) - 1) for s in blocks]
+        column = int(np.prod(shape[:-1])) * itemsize
+        step = max(int(self.budget // max(column, 1)), 1)
+        if self._debug: print str(-(-shape[-1] // step)) + " element blocks"
+        return [(slice(None),) * (len(shape) - 1) + (slice(i, min(i + step, shape[-1])),)
+                for i in range(0, shape[-1], step)]
+
+    def allocate(self, shape, dtype=float, name='array'):
+        """
+        Output array, memory mapped to disk if larger than the budget
+
+        Inputs:
+          - shape = shape, tuple of integers
+
+        Options:
+          - dtype = dtype
+          - name = name of the memory mapped file, string
+
+        Outputs:
+          - out = zeroed array, numpy array or memmap
+        """
+        if self.fits(shape, dtype):
+            return np.zeros(shape, dtype=dtype)
+        if self._debug: print name + " memory mapped to " + self.directory
+        fd, path = tempfile.mkstemp(prefix=name + '_', suffix='.npy',
+                                    dir=self.directory)
+        os.close(fd)
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                        shape=tuple(shape))
+        try:
+            #File removed once unmapped
+            os.remove(path)
+        except OSError:
+            pass
+
+        return out
+
+#Shared budget, see set_memory_budget
+_BUDGET = []
+
+def memory_budget():
+    """Shared memory budget, see MemoryBudget"""
+    if not _BUDGET:
+        _BUDGET.append(MemoryBudget())
+    return _BUDGET[0]
+
+def set_memory_budget(budget=None, directory=None, debug=False):
+    """
+    Sets the shared memory budget, used by the objects created without
+    their own budget
+
+    Options:
+      - budget = budget in bytes, integer, or string, ex: '4G'
+      - directory = folder of the memory mapped outputs, string
+    """
+    del _BUDGET[:]
+    _BUDGET.append(MemoryBudget(budget, directory, debug=debug))
+
+    return _BUDGET[0]
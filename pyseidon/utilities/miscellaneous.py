@@ -9,11 +9,13 @@ import fnmatch
 import os
 import time
 from scipy.io import netcdf
-from pydap.client import open_url
 
 # Custom error
 from pyseidon_error import PyseidonError
 
+#Metres per degree of latitude, as in FVCOM's spherical distances
+TPI = 111194.92664455874
+
 def date2py(matlab_datenum):
     python_datetime = datetime.fromordinal(int(matlab_datenum)) + \
         timedelta(days=matlab_datenum%1) - timedelta(days = 366)
@@ -156,4 +158,192 @@ def date_to_julian_day(my_date):
     # day = 24.0*60.0*60.0
     # jtime = my_date.day + ((153*m + 2)//5) + 365*y + y//4 - y//100 + y//400 - 32045 + s/day
     jtime = datetime_to_mattime(my_date) - 678942.0
-    return jtime
\ No newline at end of file
+    return jtime
+
+def contiguous_runs(index):
+    """
+    Splits any given list of indices into runs of consecutive integers
+
+    Inputs:
+      - index = indices, 1D array or list of integers
+
+    Outputs:
+      - runs = list of (start, stop) tuples, stop being exclusive
+
+    *Notes*
+      - equivalent to the groupby(enumerate(index), lambda (i,x):i-x) trick
+        without creating a Python list per run
+    """
+    index = np.asarray(index, dtype=int).ravel()
+    if index.shape[0] == 0:
+        return []
+    breaks = np.where(np.diff(index) != 1)[0] + 1
+    starts = index[np.hstack((0, breaks))]
+    stops = index[np.hstack((breaks - 1, index.shape[0] - 1))] + 1
+
+    return zip(starts.tolist(), stops.tolist())
+
+def time_overlap(time, tmin, tmax, debug=False):
+    """
+    Finds the indices of any given time axis falling within [tmin, tmax]
+
+    Inputs:
+      - time = time axis, 1D array
+      - tmin = lower bound, float
+      - tmax = upper bound, float
+
+    Outputs:
+      - ind = slice if time is monotonic without nan,
+              sorted 1D array of indices otherwise
+
+    *Notes*
+      - a slice keeps the downstream reads as views on the loaded arrays
+    """
+    time = np.asarray(time[:])
+    if (not np.isnan(time).any()) and np.all(np.diff(time) >= 0.0):
+        start = int(np.searchsorted(time, tmin, side='left'))
+        stop = int(np.searchsorted(time, tmax, side='right'))
+        if debug: print "Time overlap: ", start, stop
+        return slice(start, max(start, stop))
+    if debug: print "Non-monotonic time, fall back on index array"
+    with np.errstate(invalid='ignore'):
+        return np.where((time >= tmin) & (time <= tmax))[0]
+
+def overlap_indices(ind, size):
+    """
+    Converts the output of time_overlap into an array of indices
+
+    Inputs:
+      - ind = slice or 1D array of indices
+      - size = length of the indexed time axis, integer
+
+    Outputs:
+      - ind = 1D array of indices
+    """
+    if type(ind) == slice:
+        return np.arange(size)[ind]
+    return np.asarray(ind)
+
+def name_index(names):
+    """
+    Builds a name -> index map of any given list of station names
+
+    Inputs:
+      - names = station names, list or array of strings or of characters
+
+    Outputs:
+      - index = dictionary, upper case stripped names as keys
+
+    *Notes*
+      - duplicated names point to their last occurrence
+    """
+    index = {}
+    for i in range(len(names)):
+        index["".join(names[i]).strip().upper()] = i
+
+    return index
+
+def as_slice(index):
+    """
+    Converts any given indices into a slice when they are contiguous
+
+    Inputs:
+      - index = slice, list or 1D array of integers or booleans
+
+    Outputs:
+      - index = slice if contiguous, 1D array of integers otherwise
+    """
+    if type(index) == slice:
+        return index
+    index = np.asarray(index).ravel()
+    if index.dtype == bool:
+        index = np.where(index)[0]
+    runs = contiguous_runs(index)
+    if len(runs) == 1:
+        return slice(runs[0][0], runs[0][1])
+
+    return index
+
+def match_coordinates(x1, y1, x2, y2, tolerance=0.0):
+    """
+    Matches two sets of coordinates with a hash join
+
+    Inputs:
+      - x1, y1 = first set of coordinates, 1D arrays
+      - x2, y2 = second set of coordinates, 1D arrays
+
+    Outputs:
+      - ind1, ind2 = indices of the matching points, 1D arrays of integers,
+                     i.e. (x1[ind1], y1[ind1]) matches (x2[ind2], y2[ind2])
+
+    Options:
+      - tolerance = maximum distance between matching points, float,
+                    in the units of the coordinates. 0.0 for exact matches
+
+    *Notes*
+      - with a tolerance, coordinates are hashed on a grid of cell size
+        'tolerance' and only the neighbouring cells are searched
+      - the closest candidate is kept, each point being matched once
+    """
+    x1 = np.asarray(x1, dtype=float).ravel()
+    y1 = np.asarray(y1, dtype=float).ravel()
+    x2 = np.asarray(x2, dtype=float).ravel()
+    y2 = np.asarray(y2, dtype=float).ravel()
+    ind1 = []
+    ind2 = []
+    if tolerance == 0.0:
+        table = dict(zip(zip(x2.tolist(), y2.tolist()), range(x2.shape[0])))
+        for i, key in enumerate(zip(x1.tolist(), y1.tolist())):
+            j = table.get(key, -1)
+            if j >= 0:
+                ind1.append(i)
+                ind2.append(j)
+    else:
+        table = {}
+        cx = np.floor(x2 / tolerance).astype(int).tolist()
+        cy = np.floor(y2 / tolerance).astype(int).tolist()
+        for j in range(x2.shape[0]):
+            table.setdefault((cx[j], cy[j]), []).append(j)
+        cx = np.floor(x1 / tolerance).astype(int).tolist()
+        cy = np.floor(y1 / tolerance).astype(int).tolist()
+        used = set()
+        for i in range(x1.shape[0]):
+            best = -1
+            dist = tolerance
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for j in table.get((cx[i] + dx, cy[i] + dy), []):
+                        d = np.hypot(x1[i] - x2[j], y1[i] - y2[j])
+                        if d <= dist and not j in used:
+                            best = j
+                            dist = d
+            if best >= 0:
+                used.add(best)
+                ind1.append(i)
+                ind2.append(best)
+
+    return np.asarray(ind1, dtype=int), np.asarray(ind2, dtype=int)
+
+def block_slices(shape, itemsize, block_size=2**26):
+    """
+    Splits an array along its first dimension into blocks of limited size
+
+    Inputs:
+      - shape = shape of the array, tuple of integers
+      - itemsize = size of one element in bytes, integer
+
+    Outputs:
+      - blocks = list of slices along the first dimension
+
+    Options:
+      - block_size = maximum size of a block in bytes, integer
+
+    *Notes*
+      - a block always holds at least one row of the array
+    """
+    if len(shape) == 0 or shape[0] == 0:
+        return []
+    row = int(itemsize * np.prod(shape[1:]))
+    step = max(int(block_size // max(row, 1)), 1)
+
+    return [slice(i, min(i + step, shape[0])) for i in range(0, shape[0], step)]
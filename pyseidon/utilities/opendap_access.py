@@ -0,0 +1,340 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import time
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+#Utility import
+from pyseidon.utilities.miscellaneous import contiguous_runs
+from pyseidon.utilities.lazy_import import lazy_function
+from pyseidon.utilities.profiling import record
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Imported on first use
+open_url = lazy_function('pydap.client', 'open_url')
+
+#Datasets already opened, i.e. DDS and DAS requested once per url
+_DATASETS = {}
+_LOCK = threading.Lock()
+
+class _NoServerError(Exception):
+    """Stands for pydap's ServerError when pydap is not installed"""
+    pass
+
+def server_error():
+    """pydap's ServerError class, imported on first use"""
+    try:
+        from pydap.exceptions import ServerError
+    except ImportError:
+        return _NoServerError
+
+    return ServerError
+
+def _transient_errors():
+    """Errors worth retrying, i.e. server and socket errors"""
+    return (IOError, server_error())
+
+def open_dataset(url, reuse=True, debug=False):
+    """
+    Opens an OpenDap dataset, reusing the dataset and its http session
+    when the url has already been opened
+
+    Inputs:
+      - url = OpenDap url, string
+
+    Options:
+      - reuse = reuses previously opened dataset if True, boolean
+
+    Outputs:
+      - data = pydap dataset, with the 'variables' attribute used
+               throughout PySeidon
+    """
+    with _LOCK:
+        if reuse and url in _DATASETS:
+            if debug: print "Reusing connection to " + url
+            return _DATASETS[url]
+    if debug: print "Opening " + url
+    try:
+        import requests
+        #Keep-alive connections shared by all the requests
+        data = open_url(url, session=requests.Session())
+    except (ImportError, TypeError):
+        #Older pydap without session
+        data = open_url(url)
+    #Create fake attribut to be consistent with the rest of the code
+    data.variables = data
+    with _LOCK:
+        _DATASETS[url] = data
+
+    return data
+
+def coalesce_runs(index, max_gap=0):
+    """
+    Merges runs of consecutive indices separated by small gaps,
+    i.e. fewer and larger hyperslab requests
+
+    Inputs:
+      - index = sorted unique indices, 1D array of integers
+
+    Options:
+      - max_gap = largest number of unwanted indices read between
+                  two runs, integer
+
+    Outputs:
+      - runs = list of (start, stop) tuples, stop being exclusive
+    """
+    runs = contiguous_runs(index)
+    if len(runs) == 0:
+        return runs
+    merged = [list(runs[0])]
+    for start, stop in runs[1:]:
+        if start - merged[-1][1] <= max_gap:
+            merged[-1][1] = stop
+        else:
+            merged.append([start, stop])
+
+    return [tuple(r) for r in merged]
+
+def _var_key(var):
+    """Identifier of any given remote variable, used by the block cache"""
+    for attr in ['baseurl', 'url']:
+        url = getattr(var, attr, None)
+        if url is not None:
+            return (url, getattr(var, 'id', ''))
+    return (id(var), getattr(var, 'id', ''))
+
+def _lead_key(lead):
+    """Hashable form of the leading slices"""
+    return tuple((s.start, s.stop, s.step) for s in lead)
+
+class BlockCache:
+    """
+    Least recently used cache of hyperslabs read from OpenDap servers
+
+    Options:
+      - max_size = size cap in bytes, integer
+    """
+    def __init__(self, max_size=2**28):
+        self.max_size = max_size
+        self.size = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, var, lead, start, stop):
+        """Cached block holding columns start to stop, None otherwise"""
+        vkey = (_var_key(var), _lead_key(lead))
+        with self._lock:
+            for key in self._blocks:
+                if key[0] == vkey and key[1] <= start and stop <= key[2]:
+                    block = self._blocks.pop(key)
+                    self._blocks[key] = block
+                    return block[..., (start - key[1]):(stop - key[1])]
+        return None
+
+    def put(self, var, lead, start, stop, block):
+        """Stores one block, evicting the least recently used ones"""
+        if block.nbytes > self.max_size:
+            return
+        key = ((_var_key(var), _lead_key(lead)), start, stop)
+        with self._lock:
+            if key in self._blocks:
+                self.size -= self._blocks.pop(key).nbytes
+            self._blocks[key] = block
+            self.size += block.nbytes
+            while self.size > self.max_size:
+                old = self._blocks.popitem(last=False)[1]
+                self.size -= old.nbytes
+
+    def clear(self):
+        """Empties the cache"""
+        with self._lock:
+            self._blocks.clear()
+            self.size = 0
+
+class DapAccess:
+    """
+    **Access layer to OpenDap variables**
+
+    Reads any given set of columns with few, concurrent and retried
+    hyperslab requests.
+
+    Options:
+      - workers = largest number of concurrent requests, integer
+      - retries = number of retries of failed requests, integer
+      - backoff = waiting time before the first retry in s, doubled
+                  at each retry, float
+      - max_gap = largest number of unwanted columns read to merge two
+                  runs into a single request, integer
+      - max_request = largest request size in bytes, larger runs
+                      being split, integer
+      - cache_size = size of the block cache in bytes, integer. Default: 0,
+                     i.e. no cache. Worth it for small repeated reads only
+
+    *Notes*
+      - works with any object supporting hyperslab indexing, ex: numpy
+        arrays or StandInProxy, i.e. testable without server
+    """
+    def __init__(self, workers=4, retries=3, backoff=0.5, max_gap=32,
+                 max_request=2**25, cache_size=0, debug=False):
+        self._debug = debug
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_gap = max_gap
+        self.max_request = max_request
+        self.cache = BlockCache(cache_size)
+        self._errors = None
+
+    def _request(self, var, lead, start, stop):
+        """One hyperslab request, retried on transient errors"""
+        block = self.cache.get(var, lead, start, stop)
+        if block is not None:
+            record('cache_hits', backend='opendap')
+            return block
+        if self._errors is None:
+            self._errors = _transient_errors()
+        wait = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                block = np.asarray(var[lead + (slice(start, stop),)])
+                break
+            except self._errors as e:
+                if attempt == self.retries:
+                    raise
+                if self._debug:
+                    print "Retrying " + str(start) + "-" + str(stop) +\
+                          " after: " + str(e)
+                time.sleep(wait)
+                wait *= 2
+        record('bytes_read', block.nbytes, backend='opendap')
+        self.cache.put(var, lead, start, stop, block)
+
+        return block
+
+    def _split(self, var, lead, runs):
+        """Splits runs larger than max_request"""
+        try:
+            itemsize = np.dtype(var.dtype).itemsize
+        except (AttributeError, TypeError):
+            itemsize = 8
+        column = itemsize
+        for s, n in zip(lead, var.shape):
+            column *= len(range(*s.indices(n)))
+        step = max(1, int(self.max_request // max(column, 1)))
+        out = []
+        for start, stop in runs:
+            for s in range(start, stop, step):
+                out.append((s, min(s + step, stop)))
+
+        return out
+
+    def read_columns(self, var, cols, lead=()):
+        """
+        Reads the given columns, i.e. indices along the last dimension
+
+        Inputs:
+          - var = remote variable, dim=(..., ncol)
+          - cols = column indices, 1D array of integers
+
+        Options:
+          - lead = slices of the leading dimensions, tuple of slices,
+                   ex: (slice(t0, t1), slice(None)) for 3D variables
+
+        Outputs:
+          - sub = var[lead + (cols,)], numpy array
+        """
+        cols = np.asarray(cols, dtype=int).ravel()
+        ndim = len(var.shape)
+        lead = tuple(lead) + (slice(None),) * (ndim - 1 - len(lead))
+        uniq, inverse = np.unique(cols, return_inverse=True)
+        runs = self._split(var, lead, coalesce_runs(uniq, self.max_gap))
+        if self._debug:
+            print str(len(runs)) + " requests for " + str(uniq.shape[0]) + " columns"
+        if len(runs) == 0:
+            return np.asarray(var[lead + (slice(0, 0),)])
+        request = lambda run: self._request(var, lead, run[0], run[1])
+        if len(runs) == 1 or self.workers < 2:
+            blocks = [request(run) for run in runs]
+        else:
+            pool = ThreadPool(min(self.workers, len(runs)))
+            try:
+                blocks = pool.map(request, runs)
+            finally:
+                pool.close()
+                pool.join()
+        #Keep the wanted columns only, in the requested order
+        starts = np.array([run[0] for run in runs])
+        offsets = np.cumsum([0] + [run[1] - run[0] for run in runs])
+        which = np.searchsorted(starts, uniq, side='right') - 1
+        pos = offsets[which] + uniq - starts[which]
+        sub = np.concatenate(blocks, axis=-1)
+
+        return sub[..., pos[inverse]]
+
+#Shared access layer, see DapAccess for its attributes.
+#No block cache by default, i.e. one-shot loads are not pinned in memory:
+#set dap.cache.max_size to cache repeated reads
+dap = DapAccess()
+
+def read_columns(var, cols, lead=(), access=None):
+    """
+    Reads the given columns of any OpenDap variable with the shared
+    access layer, see DapAccess.read_columns
+
+    Options:
+      - access = access layer, DapAccess. Default: shared one
+    """
+    if access is None:
+        access = dap
+
+    return access.read_columns(var, cols, lead=lead)
+
+class StandInProxy:
+    """
+    Local stand-in for OpenDap variables, i.e. numpy array served with
+    latency and transient errors. For testing and benchmarking.
+
+    Inputs:
+      - array = served data, numpy array
+
+    Options:
+      - latency = delay per request in s, float
+      - failures = number of requests failing before the first success,
+                   integer
+      - error = error raised by failing requests, exception class
+
+    *Notes*
+      - requests lists the hyperslabs requested so far
+    """
+    def __init__(self, array, latency=0.0, failures=0, error=IOError):
+        self._array = array
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.latency = latency
+        self.failures = failures
+        self.error = error
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            self.requests.append(key)
+            failing = self.failures > 0
+            if failing:
+                self.failures -= 1
+        time.sleep(self.latency)
+        if failing:
+            raise self.error("Stand-in server error")
+        if not type(key) == tuple:
+            key = (key,)
+        for k in key:
+            if not type(k) == slice:
+                raise PyseidonError("---OpenDap only accepts hyperslabs---")
+        return np.array(self._array[key])
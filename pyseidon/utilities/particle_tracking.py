@@ -0,0 +1,323 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+from __future__ import division
+import numpy as np
+from multiprocessing import Pool
+
+#Local import
+from pyseidon.utilities.interpolation_utils import element_stencils
+from pyseidon.utilities.miscellaneous import TPI
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+DAY = 86400.0
+
+#Inherited by the forked worker processes, see track_particles
+_SHARED = {}
+
+class _TrackingMesh:
+    """
+    Grid quantities needed to advect particles, kept as numpy arrays
+
+    Inputs:
+      - grid = FVCOM.Grid
+      - mtime = model times in matlab time, 1D array (ntime)
+      - u, v = horizontal velocities, 2D array (ntime, nele)
+               or 3D array (ntime, nlevel, nele)
+
+    Options:
+      - ww = vertical velocity, 3D array (ntime, nlevel, nele)
+      - el = elevation, 2D array (ntime, nnode). Needed with ww
+    """
+    def __init__(self, grid, mtime, u, v, ww=None, el=None):
+        self.lon = np.asarray(grid.lon[:], dtype=float)
+        self.lat = np.asarray(grid.lat[:], dtype=float)
+        self.trinodes = np.asarray(grid.trinodes[:], dtype=int)
+        self.triele = np.asarray(grid.triele[:], dtype=int)
+        self.nele = self.trinodes.shape[0]
+        # Ghost elements flagged as -1
+        self.triele[(self.triele < 0) | (self.triele >= self.nele)] = -1
+        self.a1u = np.asarray(grid.a1u[:], dtype=float)
+        self.a2u = np.asarray(grid.a2u[:], dtype=float)
+        self.finder = grid.triangleLL.get_trifinder()
+        #Centres as defined in Mitchell's method
+        self.lonc = self.lon[self.trinodes].mean(axis=1)
+        self.latc = self.lat[self.trinodes].mean(axis=1)
+
+        self.mtime = np.asarray(mtime, dtype=float)
+        self.u = u
+        self.v = v
+        self.ww = ww
+        self.threeD = (u.ndim == 3)
+        if self.threeD:
+            #Sigma layers and bathymetry at element centres
+            self.siglay = np.asarray(grid.siglay[:], dtype=float)[:, self.trinodes].mean(axis=2)
+            self.h = np.asarray(grid.h[:], dtype=float)[self.trinodes].mean(axis=1)
+            self.el = el
+
+def _barycentric(mesh, lon, lat, index):
+    """
+    Barycentric coordinates of the points in their elements, 2D array (npts, 3)
+    """
+    tri = mesh.trinodes[index]
+    scale = np.cos(np.deg2rad(lat))
+    x = mesh.lon[tri] * scale[:, None]
+    y = mesh.lat[tri]
+    px = lon * scale
+    py = lat
+    det = (y[:, 1] - y[:, 2]) * (x[:, 0] - x[:, 2]) + (x[:, 2] - x[:, 1]) * (y[:, 0] - y[:, 2])
+    det[det == 0.0] = np.finfo(float).eps
+    l0 = ((y[:, 1] - y[:, 2]) * (px - x[:, 2]) + (x[:, 2] - x[:, 1]) * (py - y[:, 2])) / det
+    l1 = ((y[:, 2] - y[:, 0]) * (px - x[:, 2]) + (x[:, 0] - x[:, 2]) * (py - y[:, 2])) / det
+
+    return np.vstack((l0, l1, 1.0 - l0 - l1)).T
+
+def locate(mesh, lon, lat, index, max_walk=20, debug=False):
+    """
+    Finds the elements containing the particles by walking from their
+    previous elements through the neighbours (triele)
+
+    Inputs:
+      - mesh = _TrackingMesh
+      - lon, lat = particle positions, 1D arrays
+      - index = previous elements, 1D array of integers, -1 if unknown
+
+    Outputs:
+      - index = elements, 1D array of integers, -1 if outside the domain
+
+    *Notes*
+      - particles still not found after max_walk steps, or reaching the
+        boundary, fall back on the global trifinder
+    """
+    index = np.array(index, dtype=int)
+    active = np.where(index >= 0)[0]
+    lost = [np.where(index < 0)[0]]
+    for step in range(max_walk):
+        if active.shape[0] == 0: break
+        bary = _barycentric(mesh, lon[active], lat[active], index[active])
+        inside = (bary >= -1.0e-10).all(axis=1)
+        active = active[~inside]
+        bary = bary[~inside]
+        # Neighbour across the edge opposite the most negative coordinate
+        nxt = mesh.triele[index[active], bary.argmin(axis=1)]
+        boundary = (nxt < 0)
+        lost.append(active[boundary])
+        active = active[~boundary]
+        index[active] = nxt[~boundary]
+    lost.append(active)
+    lost = np.hstack(lost).astype(int)
+    if lost.shape[0] > 0:
+        if debug: print "Global search for ", lost.shape[0], " particles"
+        index[lost] = mesh.finder(lon[lost], lat[lost])
+
+    return index
+
+def _at_time(field, mtime, t, cols):
+    """
+    Linear interpolation in time of any given field at the horizontal
+    columns cols only, t in matlab time
+    """
+    nt = mtime.shape[0]
+    t1 = int(np.clip(np.searchsorted(mtime, t, side='right'), 1, nt - 1))
+    t0 = t1 - 1
+    w1 = np.clip((t - mtime[t0]) / (mtime[t1] - mtime[t0]), 0.0, 1.0)
+
+    return (1.0 - w1) * field[t0][..., cols] + w1 * field[t1][..., cols]
+
+def _vertical(profile, siglay, sigma):
+    """
+    Linear interpolation of profiles (nlevel, npts) at sigma (npts)
+    """
+    nlevel = siglay.shape[0]
+    #siglay decreasing from surface to bottom
+    k = np.clip((siglay > sigma[None, :]).sum(axis=0), 1, nlevel - 1)
+    pts = np.arange(sigma.shape[0])
+    s0 = siglay[k - 1, pts]
+    s1 = siglay[k, pts]
+    ds = s1 - s0
+    ds[ds == 0.0] = -1.0
+    w1 = np.clip((sigma - s0) / ds, 0.0, 1.0)
+
+    return (1.0 - w1) * profile[k - 1, pts] + w1 * profile[k, pts]
+
+def velocity(mesh, t, lon, lat, index, sigma=None):
+    """
+    Velocities of the particles at time t
+
+    Inputs:
+      - mesh = _TrackingMesh
+      - t = time in matlab time, float
+      - lon, lat = particle positions, 1D arrays
+      - index = particle elements, 1D array of integers
+
+    Options:
+      - sigma = particle sigma coordinates, 1D array. Only for 3D
+
+    Outputs:
+      - u, v = horizontal velocities (m/s), 1D arrays
+      - w = rate of change of sigma (1/s), 1D array or None
+
+    *Notes*
+      - element interpolation with a1u and a2u, see interpE_at_pt
+      - particles outside the domain have null velocities
+    """
+    ok = (index >= 0)
+    ind = np.where(ok, index, 0)
+    latweight = mesh.latc[ind]
+    dx_sph = lon - mesh.lonc[ind]
+    dx_sph[dx_sph > 180.0] -= 360.0
+    dx_sph[dx_sph < -180.0] += 360.0
+    pt_x = TPI * np.cos(np.deg2rad(lat + latweight)*0.5) * dx_sph
+    pt_y = TPI * (lat - latweight)
+    cols, weights = element_stencils(pt_x, pt_y, ind, mesh.triele,
+                                     mesh.a1u, mesh.a2u)
+    weights[~ok, :] = 0.0
+
+    #Stencil columns only, i.e. cost independent of the mesh size
+    u = (_at_time(mesh.u, mesh.mtime, t, cols) * weights).sum(axis=-1)
+    v = (_at_time(mesh.v, mesh.mtime, t, cols) * weights).sum(axis=-1)
+    W = None
+    if mesh.threeD:
+        sig = mesh.siglay[:, ind]
+        u = _vertical(u, sig, sigma)
+        v = _vertical(v, sig, sigma)
+        if not mesh.ww is None:
+            w = (_at_time(mesh.ww, mesh.mtime, t, cols) * weights).sum(axis=-1)
+            w = _vertical(w, sig, sigma)
+            el = _at_time(mesh.el, mesh.mtime, t, mesh.trinodes[ind]).mean(axis=1)
+            depth = mesh.h[ind] + el
+            depth[depth <= 0.0] = np.inf
+            W = np.where(ok, w / depth, 0.0)
+
+    return u, v, W
+
+def _advect(mesh, t0, lon0, lat0, sigma0, dt, nstep, every, debug=False):
+    """
+    4th order Runge-Kutta advection of a group of particles
+    """
+    npts = lon0.shape[0]
+    nout = nstep // every + 1
+    lonT = np.zeros((nout, npts))
+    latT = np.zeros((nout, npts))
+    sigT = None
+    if mesh.threeD: sigT = np.zeros((nout, npts))
+    lon = lon0.copy()
+    lat = lat0.copy()
+    sig = None
+    if mesh.threeD: sig = sigma0.copy()
+    index = locate(mesh, lon, lat, -np.ones(npts, dtype=int), debug=debug)
+    stuck = (index < 0)
+    lonT[0] = lon
+    latT[0] = lat
+    if mesh.threeD: sigT[0] = sig
+    hdt = 0.5 * dt / DAY
+
+    def move(lon, lat, sig, u, v, w, f):
+        nlat = lat + f * v / TPI
+        nlon = lon + f * u / (TPI * np.cos(np.deg2rad(lat)))
+        nsig = sig
+        if not w is None:
+            nsig = np.clip(sig + f * w, -1.0, 0.0)
+        return nlon, nlat, nsig
+
+    for n in range(nstep):
+        t = t0 + n * dt / DAY
+        u1, v1, w1 = velocity(mesh, t, lon, lat, index, sig)
+        x, y, s = move(lon, lat, sig, u1, v1, w1, 0.5 * dt)
+        i2 = locate(mesh, x, y, index)
+        u2, v2, w2 = velocity(mesh, t + hdt, x, y, i2, s)
+        x, y, s = move(lon, lat, sig, u2, v2, w2, 0.5 * dt)
+        i3 = locate(mesh, x, y, i2)
+        u3, v3, w3 = velocity(mesh, t + hdt, x, y, i3, s)
+        x, y, s = move(lon, lat, sig, u3, v3, w3, dt)
+        i4 = locate(mesh, x, y, i3)
+        u4, v4, w4 = velocity(mesh, t + 2.0 * hdt, x, y, i4, s)
+        u = (u1 + 2.0 * u2 + 2.0 * u3 + u4) / 6.0
+        v = (v1 + 2.0 * v2 + 2.0 * v3 + v4) / 6.0
+        w = None
+        if not w1 is None:
+            w = (w1 + 2.0 * w2 + 2.0 * w3 + w4) / 6.0
+        x, y, s = move(lon, lat, sig, u, v, w, dt)
+        inew = locate(mesh, x, y, index)
+        #Particles leaving the domain stay at their last position
+        stuck = stuck | (inew < 0)
+        keep = ~stuck
+        lon[keep] = x[keep]
+        lat[keep] = y[keep]
+        index[keep] = inew[keep]
+        if mesh.threeD: sig[keep] = s[keep]
+        if (n + 1) % every == 0:
+            k = (n + 1) // every
+            lonT[k] = lon
+            latT[k] = lat
+            if mesh.threeD: sigT[k] = sig
+
+    return lonT, latT, sigT, stuck
+
+def _advect_group(args):
+    """
+    Pool wrapper around _advect, the mesh being inherited from the parent
+    """
+    return _advect(_SHARED['mesh'], *args)
+
+def track_particles(mesh, lon0, lat0, t0, t1, dt=60.0, sigma0=None,
+                    every=1, workers=1, debug=False):
+    """
+    Advects particles through the model velocity fields
+
+    Inputs:
+      - mesh = _TrackingMesh
+      - lon0, lat0 = initial positions in decimal degrees, 1D arrays
+      - t0, t1 = release and end times in matlab time, floats
+
+    Options:
+      - dt = time step in seconds, float
+      - sigma0 = initial sigma coordinates (0 surface, -1 bottom), 1D array.
+                 Only for 3D
+      - every = positions stored every 'every' time steps, integer
+      - workers = number of processes, particles being split in groups
+
+    Outputs:
+      - time = output times in matlab time, 1D array (nout)
+      - lon, lat = trajectories, 2D arrays (nout, npts)
+      - sigma = sigma trajectories, 2D array (nout, npts) or None
+      - stuck = particles having left the domain, 1D boolean array
+    """
+    lon0 = np.asarray(lon0, dtype=float).ravel()
+    lat0 = np.asarray(lat0, dtype=float).ravel()
+    if t0 < mesh.mtime[0] or t1 > mesh.mtime[-1] or t1 <= t0:
+        raise PyseidonError("---Tracking period outside of the simulated period---")
+    if mesh.threeD:
+        if sigma0 is None:
+            sigma0 = np.zeros(lon0.shape)
+        sigma0 = np.clip(np.asarray(sigma0, dtype=float).ravel() * np.ones(lon0.shape),
+                         -1.0, 0.0)
+    nstep = int(np.ceil((t1 - t0) * DAY / dt))
+    every = max(int(every), 1)
+
+    if workers > 1 and lon0.shape[0] > workers:
+        groups = np.array_split(np.arange(lon0.shape[0]), workers)
+        args = []
+        for g in groups:
+            sig = None
+            if mesh.threeD: sig = sigma0[g]
+            args.append((t0, lon0[g], lat0[g], sig, dt, nstep, every))
+        _SHARED['mesh'] = mesh
+        pool = Pool(processes=workers)
+        try:
+            results = pool.map(_advect_group, args)
+        finally:
+            pool.close()
+            pool.join()
+            _SHARED.clear()
+        lon = np.hstack([r[0] for r in results])
+        lat = np.hstack([r[1] for r in results])
+        sigma = None
+        if mesh.threeD: sigma = np.hstack([r[2] for r in results])
+        stuck = np.hstack([r[3] for r in results])
+    else:
+        lon, lat, sigma, stuck = _advect(mesh, t0, lon0, lat0, sigma0,
+                                         dt, nstep, every, debug=debug)
+    times = t0 + np.arange(lon.shape[0]) * every * dt / DAY
+
+    return times, lon, lat, sigma, stuck
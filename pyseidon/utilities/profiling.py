@@ -0,0 +1,271 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import threading
+import time
+from functools import wraps
+
+#Utility import
+from pyseidon.utilities.lazy_import import LazyModule
+
+#Heavy dependencies imported on first use
+pd = LazyModule('pandas')
+
+#Spans currently open, all profilers together
+_ACTIVE = []
+_LOCK = threading.Lock()
+
+def record(counter, value=1, backend=None):
+    """
+    Adds to a counter of the spans currently open, i.e. the spans of
+    the calls in progress
+
+    Inputs:
+      - counter = counter name, string, ex: 'bytes_read', 'cache_hits'
+
+    Options:
+      - value = amount added, number
+      - backend = backend name, string, ex: 'opendap', appended to the
+                  counter name
+
+    *Notes*
+      - does nothing when no span is open, i.e. profiling off
+    """
+    if not _ACTIVE:
+        return
+    if backend is not None:
+        counter = counter + '_' + backend
+    with _LOCK:
+        for span in _ACTIVE:
+            span.counters[counter] = span.counters.get(counter, 0) + value
+
+def _nbytes(value):
+    """Bytes held in memory by any given result"""
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if type(value) in [tuple, list]:
+        return sum([_nbytes(v) for v in value])
+    return 0
+
+class Span:
+    """
+    One profiled call
+
+    Inputs:
+      - name = span name, string
+      - kind = span category, string, ex: 'loader', 'interpolator' or 'derived'
+    """
+    def __init__(self, profiler, name, kind=''):
+        self._profiler = profiler
+        self.name = name
+        self.kind = kind
+        self.counters = {}
+        self.start = None
+        self.wall = None
+        self.depth = None
+        self.parent = None
+
+    def __enter__(self):
+        self.start = time.time()
+        with _LOCK:
+            self.depth = len(_ACTIVE)
+            if _ACTIVE:
+                self.parent = _ACTIVE[-1].name
+            _ACTIVE.append(self)
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.wall = time.time() - self.start
+        with _LOCK:
+            if self in _ACTIVE:
+                _ACTIVE.remove(self)
+        if value is not None:
+            self.counters['errors'] = 1
+        self._profiler._add(self)
+        return False
+
+class _NullSpan:
+    """Span of profilers turned off, i.e. does nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Profiler:
+    """
+    **Records of the profiled calls of any given object**
+
+    Each span records its wall time, the bytes read per backend, the
+    arrays allocated and the cache hits, ex: ::
+
+        fvcom = FVCOM(filename, profile=True)
+        fvcom.Util2D.depth()
+        fvcom.profiler.summary()
+
+    Options:
+      - enabled = records spans if True, boolean
+
+    *Notes*
+      - bytes read and cache hits are inclusive, i.e. a span also counts
+        what its nested spans counted, allocations are not
+      - spans of a turned off profiler do nothing, i.e. near-zero overhead
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []
+
+    def enable(self):
+        """Turns profiling on"""
+        self.enabled = True
+
+    def disable(self):
+        """Turns profiling off"""
+        self.enabled = False
+
+    def clear(self):
+        """Discards the spans recorded so far"""
+        self.spans = []
+
+    def span(self, name, kind=''):
+        """
+        Context manager profiling the enclosed block, ex: ::
+
+            with fvcom.profiler.span('my_block'):
+                ...
+
+        Inputs:
+          - name = span name, string
+
+        Options:
+          - kind = span category, string
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, kind)
+
+    def _add(self, span):
+        self.spans.append(span)
+
+    def report(self, name=None, kind=None):
+        """
+        Recorded spans
+
+        Options:
+          - name = only spans of this name, string
+          - kind = only spans of this category, string
+
+        Outputs:
+          - rows = one dictionary per span, list, counters missing from a
+                   span being 0
+        """
+        spans = [s for s in self.spans if (name is None or s.name == name)
+                 and (kind is None or s.kind == kind)]
+        counters = sorted(set([c for s in spans for c in s.counters]))
+        rows = []
+        for s in spans:
+            row = {'name': s.name, 'kind': s.kind, 'start': s.start,
+                   'wall': s.wall, 'depth': s.depth, 'parent': s.parent}
+            for c in counters:
+                row[c] = s.counters.get(c, 0)
+            rows.append(row)
+
+        return rows
+
+    def to_dataframe(self, name=None, kind=None):
+        """
+        Recorded spans as pandas DataFrame, see report
+        """
+        rows = self.report(name=name, kind=kind)
+        columns = ['name', 'kind', 'start', 'wall', 'depth', 'parent']
+        if rows:
+            columns += sorted([c for c in rows[0] if not c in columns])
+
+        return pd.DataFrame(rows, columns=columns)
+
+    def summary(self, kind=None):
+        """
+        Recorded spans aggregated per name
+
+        Options:
+          - kind = only spans of this category, string
+
+        Outputs:
+          - df = number of calls, total/mean/max wall time (s) and total
+                 counters per span name, pandas DataFrame
+        """
+        df = self.to_dataframe(kind=kind)
+        if df.shape[0] == 0:
+            return df
+        counters = [c for c in df.columns if not c in
+                    ['name', 'kind', 'start', 'wall', 'depth', 'parent']]
+        groups = df.groupby(['kind', 'name'])
+        out = groups['wall'].agg(['count', 'sum', 'mean', 'max'])
+        out.columns = ['calls', 'wall', 'wall_mean', 'wall_max']
+        if counters:
+            out = out.join(groups[counters].sum())
+
+        return out.sort_values('wall', ascending=False)
+
+def _snapshot(objs):
+    """Identities of the attributes of the given objects"""
+    return [dict([(k, id(v)) for k, v in obj.__dict__.items()]) for obj in objs]
+
+def _allocated(objs, before):
+    """Bytes of the arrays set as attributes since the snapshot"""
+    total = 0
+    for obj, ids in zip(objs, before):
+        for k, v in obj.__dict__.items():
+            if not ids.get(k) == id(v):
+                total += _nbytes(v)
+    return total
+
+def profiled(kind=''):
+    """
+    Decorator profiling the calls of any given method, ex: ::
+
+        @profiled('derived')
+        def depth(self, debug=False):
+
+    Options:
+      - kind = span category, string
+
+    *Notes*
+      - spans go to the profiler of the instance, i.e. its _profiler
+        attribute, the arrays set as attributes of its _var and _grid
+        being counted as allocated
+      - prints the computation time in debug mode
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, '_profiler', None)
+            enabled = profiler is not None and profiler.enabled
+            debug = kwargs.get('debug', False) or getattr(self, '_debug', False)
+            if not (enabled or debug):
+                return func(self, *args, **kwargs)
+            if not enabled:
+                start = time.time()
+                out = func(self, *args, **kwargs)
+                print "Computation time in (s): ", (time.time() - start)
+                return out
+            objs = [o for o in [getattr(self, '_var', None),
+                                getattr(self, '_grid', None)]
+                    if hasattr(o, '__dict__')]
+            before = _snapshot(objs)
+            name = self.__class__.__name__ + '.' + func.__name__
+            with profiler.span(name, kind) as span:
+                out = func(self, *args, **kwargs)
+                span.counters['allocated'] = span.counters.get('allocated', 0) +\
+                                             _allocated(objs, before) + _nbytes(out)
+            if debug: print "Computation time in (s): ", span.wall
+            return out
+        return wrapper
+    return decorator
@@ -0,0 +1,299 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import cPickle as pkl
+import json
+import zlib
+import os
+from os.path import join, isdir, isfile
+
+#Utility import
+from pyseidon.utilities.miscellaneous import block_slices
+from pyseidon.utilities.profiling import record
+
+# Custom error
+from pyseidon_error import PyseidonError
+
+#Version of the cache layout, see manifest.json
+CACHE_VERSION = 1
+#Unpickleable objects, rebuilt on demand (see index_finder)
+_SKIP = ['triangle', 'triangleLL']
+
+def _json_default(value):
+    """Turns numpy scalars and arrays into json compatible types"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(repr(value) + " is not JSON serializable")
+
+def _is_array(value):
+    """True for numpy arrays and netcdf/opendap variables"""
+    if type(value) in [list, tuple, dict, str, unicode]:
+        return False
+    try:
+        return len(value.shape) > 0
+    except (AttributeError, TypeError):
+        return False
+
+class _CachedArray:
+    """
+    Lazy, read-only view of a compressed cached array
+
+    Inputs:
+      - dirname = path to the cache directory, string
+      - entry = manifest entry of the array, dictionary
+
+    *Notes*
+      - only the compressed blocks holding the requested rows are
+        read and decompressed, ex: var[t0:t1, index]
+    """
+    def __init__(self, dirname, entry):
+        self._dir = dirname
+        self._chunks = entry['chunks']
+        self.shape = tuple(entry['shape'])
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(str(entry['dtype']))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        out = self[:]
+        if dtype is not None:
+            out = out.astype(dtype)
+        return out
+
+    def _block(self, name, start, stop):
+        """Reads and decompresses one block"""
+        f = open(join(self._dir, name), "rb")
+        try:
+            raw = zlib.decompress(f.read())
+        finally:
+            f.close()
+        record('bytes_read', len(raw), backend='cache')
+        return np.frombuffer(raw, dtype=self.dtype).reshape(
+               (stop - start,) + self.shape[1:])
+
+    def __getitem__(self, key):
+        if not type(key) == tuple:
+            key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis:
+            first = slice(None)
+            rest = key
+        else:
+            first = key[0]
+            rest = (slice(None),) + key[1:]
+        ind = np.arange(self.shape[0])[first]
+        scalar = (np.ndim(ind) == 0)
+        ind = np.atleast_1d(ind)
+        out = np.empty((ind.shape[0],) + self.shape[1:], dtype=self.dtype)
+        for start, stop, name in self._chunks:
+            mask = (ind >= start) & (ind < stop)
+            if not mask.any():
+                continue
+            out[mask] = self._block(name, start, stop)[ind[mask] - start]
+        out = out[rest]
+        if scalar:
+            out = out[0]
+
+        return out
+
+def _write_array(value, dirname, key, compress, debug=False):
+    """Writes one array block by block, returns its manifest entry"""
+    shape = tuple(int(s) for s in value.shape)
+    try:
+        itemsize = np.dtype(value.dtype).itemsize
+    except (AttributeError, TypeError):
+        itemsize = 8
+    blocks = block_slices(shape, itemsize)
+    if blocks == []:
+        blocks = [slice(0, 0)]
+    entry = {'kind': 'array', 'shape': list(shape)}
+    out = None
+    chunks = []
+    for s in blocks:
+        data = np.asarray(np.ma.filled(value[s]))
+        if data.dtype == object:
+            raise TypeError(key + " is an object array")
+        if out is None and not compress:
+            entry['file'] = key + '.npy'
+            out = np.lib.format.open_memmap(join(dirname, entry['file']),
+                                            mode='w+', dtype=data.dtype,
+                                            shape=shape)
+        entry['dtype'] = data.dtype.str
+        if compress:
+            name = key + '.' + str(len(chunks)).zfill(5) + '.z'
+            f = open(join(dirname, name), "wb")
+            f.write(zlib.compress(np.ascontiguousarray(data).tostring(), 6))
+            f.close()
+            chunks.append([s.start, s.stop, name])
+        else:
+            out[s] = data
+    if compress:
+        entry['layout'] = 'zlib'
+        entry['chunks'] = chunks
+    else:
+        entry['layout'] = 'memmap'
+        out.flush()
+        del out
+
+    return entry
+
+def _write_object(obj, dirname, prefix, compress, debug=False):
+    """Writes the attributes of Grid or Variables, returns the manifest entries"""
+    entries = {}
+    for key in obj:
+        if key in _SKIP or key == '_History':
+            continue
+        value = obj[key]
+        name = prefix + '.' + key
+        if _is_array(value):
+            if debug: print "Caching " + key + "..."
+            try:
+                entries[key] = _write_array(value, dirname, name, compress,
+                                            debug=debug)
+                continue
+            except TypeError:
+                pass
+        else:
+            try:
+                entries[key] = {'kind': 'json',
+                                'value': json.loads(json.dumps(value,
+                                         default=_json_default))}
+                continue
+            except (TypeError, ValueError):
+                pass
+        #Anything else is pickled on its own
+        if debug: print "Pickling " + key + "..."
+        f = open(join(dirname, name + '.p'), "wb")
+        pkl.dump(value, f, protocol=pkl.HIGHEST_PROTOCOL)
+        f.close()
+        entries[key] = {'kind': 'pickle', 'file': name + '.p'}
+
+    return entries
+
+def pyseidon_to_cache(fvcom, filename, compress=False, debug=False):
+    """
+    Saves fvcom object in a PySeidon cache, i.e. a directory of
+    per-variable arrays plus a manifest
+
+    inputs:
+      - fvcom = fvcom pyseidon object
+      - filename = directory name, string
+
+    options:
+      - compress = zlib compressed blocks if True, memory mapped arrays otherwise
+
+    *Notes*
+      - variables are written one by one and block by block, netcdf and
+        opendap variables being never fully loaded
+      - masked values are stored with their fill value
+      - reopen with FVCOM('filename.cache')
+    """
+    #Define bounding box
+    if debug:
+        print "Computing bounding box..."
+    if fvcom.Grid._ax == []:
+        lon = fvcom.Grid.lon[:]
+        lat = fvcom.Grid.lat[:]
+        fvcom.Grid._ax = [lon.min(), lon.max(),
+                         lat.min(), lat.max()]
+    dirname = filename + ".cache"
+    if isdir(dirname) and isfile(join(dirname, 'manifest.json')):
+        #Previous cache replaced
+        f = open(join(dirname, 'manifest.json'), "r")
+        old = json.load(f)
+        f.close()
+        for section in ['Grid', 'Variables']:
+            for entry in old[section].values():
+                names = [c[2] for c in entry.get('chunks', [])]
+                if 'file' in entry:
+                    names.append(entry['file'])
+                for name in names:
+                    if isfile(join(dirname, name)):
+                        os.remove(join(dirname, name))
+        os.remove(join(dirname, 'manifest.json'))
+    elif not isdir(dirname):
+        os.makedirs(dirname)
+
+    manifest = {}
+    manifest['format'] = 'pyseidon-cache'
+    manifest['version'] = CACHE_VERSION
+    manifest['Origin'] = fvcom._origin_file
+    manifest['History'] = list(fvcom.History)
+    try:
+        manifest['Grid'] = _write_object(fvcom.Grid.__dict__, dirname, 'Grid',
+                                         compress, debug=debug)
+        manifest['Variables'] = _write_object(fvcom.Variables.__dict__, dirname,
+                                              'Variables', compress, debug=debug)
+    except MemoryError:
+        raise PyseidonError("---Data too large for machine memory---\n"\
+                            "Tip: use ax or tx during class initialisation\n"\
+                            "     to use partial data")
+    #Manifest written last, i.e. incomplete caches cannot be opened
+    if debug:
+        print 'Writing manifest...'
+    f = open(join(dirname, 'manifest.json'), "w")
+    json.dump(manifest, f, default=_json_default, indent=1)
+    f.close()
+
+def _read_object(entries, dirname, History):
+    """Reopens the attributes of Grid or Variables"""
+    obj = {}
+    for key in entries:
+        entry = entries[key]
+        key = str(key)
+        if entry['kind'] == 'json':
+            obj[key] = entry['value']
+        elif entry['kind'] == 'pickle':
+            f = open(join(dirname, entry['file']), "rb")
+            obj[key] = pkl.load(f)
+            f.close()
+        elif entry['layout'] == 'memmap':
+            #Copy-on-write, i.e. in place changes never reach the cache
+            obj[key] = np.load(join(dirname, entry['file']), mmap_mode='c')
+        elif len(entry['chunks']) == 1:
+            #Single block arrays, i.e. grid, loaded straight away
+            obj[key] = _CachedArray(dirname, entry)[:]
+        else:
+            obj[key] = _CachedArray(dirname, entry)
+    obj['_History'] = History
+
+    return obj
+
+def cache_to_pyseidon(filename, debug=False):
+    """
+    Reopens a PySeidon cache
+
+    inputs:
+      - filename = path to the cache directory, string
+
+    outputs:
+      - data = dictionary with 'Origin', 'History', 'Grid' and 'Variables' keys,
+               as stored in pickle files
+
+    *Notes*
+      - arrays are memory mapped or decompressed on demand,
+        nothing is loaded at this stage
+    """
+    dirname = filename.rstrip(os.sep)
+    if not isfile(join(dirname, 'manifest.json')):
+        raise PyseidonError("---Missing or incomplete cache: " + dirname + "---")
+    if debug:
+        print "Reading manifest..."
+    f = open(join(dirname, 'manifest.json'), "r")
+    manifest = json.load(f)
+    f.close()
+    if not manifest.get('format') == 'pyseidon-cache' or\
+       manifest.get('version', 0) > CACHE_VERSION:
+        raise PyseidonError("---Unsupported cache format---")
+    data = {}
+    data['Origin'] = str(manifest['Origin'])
+    data['History'] = [str(h) for h in manifest['History']]
+    data['Grid'] = _read_object(manifest['Grid'], dirname, data['History'])
+    data['Variables'] = _read_object(manifest['Variables'], dirname,
+                                     data['History'])
+
+    return data
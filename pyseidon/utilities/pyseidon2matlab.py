@@ -5,15 +5,62 @@
 from __future__ import division
 import numpy as np
 import sys
+import time
 from scipy.io import savemat
 
-def pyseidon_to_matlab(fvcom, filename, debug):
+#Utility import
+from pyseidon.utilities.miscellaneous import block_slices
+
+# Custom error
+from pyseidon_error import PyseidonError
+
+#Fields computed by Utils2D and Utils3D, see skip_derived
+_DERIVED = ['hori_velo_norm', 'depth_av_flow_dir', 'depth_av_vorticity',
+            'depth_av_power_density', 'depth_av_power_assessment',
+            'velo_norm', 'flow_dir', 'verti_shear', 'vorticity',
+            'power_density', 'power_assessment', 'depth', 'depth2D']
+#Unpickleable objects
+_SKIP = ['triangle', 'triangleLL']
+#Matlab classes of numpy types
+_MATLAB_CLASS = {'f8': 'double', 'f4': 'single', 'b1': 'logical',
+                 'i1': 'int8', 'i2': 'int16', 'i4': 'int32', 'i8': 'int64',
+                 'u1': 'uint8', 'u2': 'uint16', 'u4': 'uint32', 'u8': 'uint64'}
+
+def _fields(fvcom, skip_derived=False, debug=False):
+    """Fields to export, without copying nor converting them"""
+    data = {}
+    data['Origin'] = fvcom._origin_file
+    data['History'] = fvcom.History
+    for obj in [fvcom.Variables.__dict__, fvcom.Grid.__dict__]:
+        for key in obj:
+            if key in _SKIP:
+                continue
+            if skip_derived and key in _DERIVED:
+                if debug: print "Skipping " + key
+                continue
+            data[key] = obj[key]
+
+    return data
+
+def pyseidon_to_matlab(fvcom, filename, debug, version='5', skip_derived=False,
+                       compress=False):
     """
-    Saves fvcom object in a pickle file
+    Saves fvcom object in a matlab file
 
     inputs:
       - fvcom = fvcom pyseidon object
       - filename = file name, string
+
+    options:
+      - version = matlab file version, '5' or '7.3'
+      - skip_derived = derived fields (i.e. velocity norms, vorticity,...)
+                       not exported if True
+      - compress = compressed file if True
+
+    *Notes*
+      - arrays keep their native types, i.e. float32 stays single
+      - version '7.3' (HDF5 based, requires h5py) streams variables by blocks
+        and suits data larger than memory
     """
     #Define bounding box
     if debug:
@@ -25,44 +72,114 @@ def pyseidon_to_matlab(fvcom, filename, debug):
                          lat.min(), lat.max()]
 
     filename = filename + ".mat"
-    #TR comment: based on MitchellO'Flaherty-Sproul's code
-    dtype = float
-    data = {}
-    Grd = {}
-    Var = {}
-    data['Origin'] = fvcom._origin_file
-    data['History'] = fvcom.History
-    Grd = fvcom.Grid.__dict__
-    Var = fvcom.Variables.__dict__
+    data = _fields(fvcom, skip_derived=skip_derived, debug=debug)
+    if version == '7.3':
+        _save_v73(data, filename, compress=compress, debug=debug)
+        return
+
     #TR: Force caching Variables otherwise error during loading
     #    with 'netcdf4.Variable' type (see above)
-    for key in Var:
-        listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
-        if any([type(Var[key]).__name__==x for x in listkeys]):
+    listkeys=['Variable', 'ArrayProxy', 'BaseType', '_CachedArray']
+    for key in data:
+        if any([type(data[key]).__name__==x for x in listkeys]):
             if debug:
                 print "Force caching for " + key
-            Var[key] = Var[key][:]
-        #keyV = key + '-var'
-        try:
-            data[key] = np.float64(Var[key].copy())
-        except AttributeError:
-            data[key] = Var[key]
-    #Unpickleable objects
-    Grd.pop("triangle", None)
-    for key in Grd:
-        listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
-        if any([type(Grd[key]).__name__==x for x in listkeys]):
-            if debug:
-                print "Force caching for " + key
-            Grd[key] = Grd[key][:]
-        #keyG = key + '-grd'
-
-        try:
-            data[key] = np.float64(Grd[key].copy())
-        except AttributeError:
-            data[key] = Grd[key]
+            data[key] = data[key][:]
 
     #Save in mat file file
     if debug:
         print 'Dumping in matlab file...'
-    savemat(filename, data, oned_as='column')
\ No newline at end of file
+    savemat(filename, data, oned_as='column', do_compression=compress)
+
+def _header():
+    """Matlab 7.3 header, stored in the HDF5 user block"""
+    text = 'MATLAB 7.3 MAT-file, Platform: ' + sys.platform +\
+           ', Created on: ' + time.strftime('%a %b %d %H:%M:%S %Y') +\
+           ' HDF5 schema 1.00 .'
+    header = text.ljust(116)[:116] + ' ' * 8 + '\x00\x02' + 'IM'
+
+    return header.ljust(512, '\x00')
+
+def _write_h5(f, key, value, compress=False, debug=False):
+    """Writes one field in a matlab 7.3 file, by blocks for large arrays"""
+    #Strings as char matrices
+    if type(value) == str or (type(value) in [list, tuple] and len(value) > 0 and
+                              all([type(v) == str for v in value])):
+        if type(value) == str:
+            value = [value]
+        width = max([len(v) for v in value] + [1])
+        chars = np.zeros((len(value), width), dtype=np.uint16)
+        for i, v in enumerate(value):
+            chars[i, :len(v)] = [ord(c) for c in v]
+        dset = f.create_dataset(key, data=chars.T)
+        dset.attrs['MATLAB_class'] = np.string_('char')
+        dset.attrs['MATLAB_int_decode'] = np.int32(2)
+        return
+    if not hasattr(value, 'shape'):
+        value = np.asarray(value)
+        if value.dtype == object:
+            if debug: print key + " cannot be exported"
+            return
+    shape = tuple(int(s) for s in value.shape)
+    #Scalars and 1D arrays as column vectors, see oned_as in savemat
+    if len(shape) < 2:
+        shape = (int(np.prod(shape)), 1)
+    if shape[0] * int(np.prod(shape[1:])) == 0:
+        dset = f.create_dataset(key, data=np.array(shape, dtype=np.uint64))
+        dset.attrs['MATLAB_class'] = np.string_('double')
+        dset.attrs['MATLAB_empty'] = np.uint8(1)
+        return
+    try:
+        itemsize = np.dtype(value.dtype).itemsize
+    except (AttributeError, TypeError):
+        itemsize = 8
+    options = {}
+    if compress:
+        options = {'compression': 'gzip', 'compression_opts': 4}
+    dset = None
+    for s in block_slices(shape, itemsize):
+        if np.ndim(value) == 0:
+            block = np.asarray(value)
+        else:
+            block = np.ma.filled(value[s])
+        block = np.asarray(block).reshape((s.stop - s.start,) + shape[1:])
+        code = block.dtype.str[1:]
+        if code == 'b1':
+            #Matlab logicals stored as uint8
+            block = block.astype(np.uint8)
+        if dset is None:
+            if not code in _MATLAB_CLASS:
+                if debug: print key + " cannot be exported"
+                return
+            #Matlab arrays are column major, i.e. dimensions reversed
+            dset = f.create_dataset(key, shape=shape[::-1], dtype=block.dtype,
+                                    chunks=True, **options)
+            dset.attrs['MATLAB_class'] = np.string_(_MATLAB_CLASS[code])
+        dset[..., s] = block.T
+
+def _save_v73(data, filename, compress=False, debug=False):
+    """Streams fields in a matlab 7.3 file"""
+    try:
+        import h5py
+    except ImportError:
+        raise PyseidonError("---h5py is required for matlab 7.3 files---")
+    if debug:
+        print 'Streaming in matlab 7.3 file...'
+    f = h5py.File(filename, 'w', userblock_size=512)
+    try:
+        for key in data:
+            #Matlab variable names cannot start with an underscore
+            if key.startswith('_') or type(data[key]) == dict:
+                continue
+            if debug: print "...writing " + key + "..."
+            try:
+                _write_h5(f, key, data[key], compress=compress, debug=debug)
+            except MemoryError:
+                raise PyseidonError("---Data too large for machine memory---\n"\
+                                    "Tip: use ax or tx during class initialisation\n"\
+                                    "     to use partial data")
+    finally:
+        f.close()
+    f = open(filename, 'r+b')
+    f.write(_header())
+    f.close()
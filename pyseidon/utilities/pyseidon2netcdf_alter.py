@@ -6,16 +6,80 @@ from __future__ import division
 import numpy as np
 import sys
 #TR comment: 2 alternatives
-import netCDF4 as nc
 #from scipy.io import netcdf
 
-def pyseidon_to_netcdf(fvcom, filename, debug):
+#Utility import
+from pyseidon.utilities.miscellaneous import block_slices
+from pyseidon.utilities.lazy_import import LazyModule
+
+#Imported on first use
+nc = LazyModule('netCDF4')
+
+def _norm(*comp):
+    """Norm of any given velocity components"""
+    return np.sqrt(sum([c**2.0 for c in comp]))
+
+def _direction(u, v):
+    """Flow directions in deg., see Utils2D.flow_dir"""
+    return np.rad2deg(np.arctan2(v, u))
+
+def _power(*comp):
+    """Power density in W/m2, see Utils2D.depth_averaged_power_density"""
+    return 0.5*1025.0*(_norm(*comp)**3.0)
+
+#Derived fields computed while writing: inputs, dimensions and function
+_DERIVED = {'hori_velo_norm': (['ua', 'va'], ('time','nele'), _norm),
+            'depth_av_flow_dir': (['ua', 'va'], ('time','nele'), _direction),
+            'depth_av_power_density': (['ua', 'va'], ('time','nele'), _power),
+            'velo_norm': (['u', 'v', 'w'], ('time','siglay','nele'), _norm),
+            'flow_dir': (['u', 'v'], ('time','siglay','nele'), _direction),
+            'power_density': (['u', 'v', 'w'], ('time','siglay','nele'), _power)}
+
+def _create(f, name, dtype, dims, zlib=False, complevel=4, chunk_time=None):
+    """Creates a netcdf variable with the compression and chunking options"""
+    kwargs = {}
+    if zlib:
+        kwargs['zlib'] = True
+        kwargs['complevel'] = complevel
+        kwargs['shuffle'] = True
+    if (not chunk_time is None) and len(dims) > 0 and dims[0] == 'time':
+        kwargs['chunksizes'] = tuple([min(chunk_time, len(f.dimensions['time']))] +
+                                     [len(f.dimensions[d]) for d in dims[1:]])
+    return f.createVariable(name, dtype, dims, **kwargs)
+
+def _stream(var, tmp_var, debug=False):
+    """Copies any variable in a netcdf variable by blocks along its first dimension"""
+    try:
+        itemsize = np.dtype(var.dtype).itemsize
+    except (AttributeError, TypeError):
+        itemsize = 8
+    for s in block_slices(tuple(var.shape), itemsize):
+        tmp_var[s] = var[s]
+
+def pyseidon_to_netcdf(fvcom, filename, debug, compress=False, complevel=4,
+                       chunk_time=None, derived=[]):
     """
-    Saves fvcom object in a pickle file
+    Saves fvcom object in a netcdf file
 
     inputs:
       - fvcom = fvcom pyseidon object
       - filename = file name, string
+
+    options:
+      - compress = zlib compression if True
+      - complevel = compression level, integer between 1 and 9
+      - chunk_time = number of time steps per chunk, integer.
+                     Netcdf library default if None
+      - derived = fields to compute while writing, list of names among
+                  'hori_velo_norm', 'depth_av_flow_dir', 'depth_av_power_density',
+                  'velo_norm', 'flow_dir' and 'power_density', or of tuples
+                  (name, dimensions, function) where function(time slice)
+                  returns the field over the given time steps
+
+    *Notes*
+      - variables are copied by blocks of time steps whatever the backend
+        (netcdf, OpenDap, memory mapped), derived fields are computed block
+        by block, i.e. never fully loaded
     """
     #Define bounding box
     if debug: print "Computing bounding box..."
@@ -26,6 +90,8 @@ def pyseidon_to_netcdf(fvcom, filename, debug):
                          lat.min(), lat.max()]
     filename = filename + ".nc"
     f = nc.Dataset(filename, 'w', format='NETCDF4_CLASSIC')
+    options = {'zlib': compress, 'complevel': complevel,
+               'chunk_time': chunk_time}
     #history attribut
     f.history = fvcom.History[:]
 
@@ -72,22 +138,22 @@ def pyseidon_to_netcdf(fvcom, filename, debug):
                    'hori_velo_norm', 'tauc']:
             try:
                 if hasattr(fvcom.Variables, var):
-                    tmp_var = f.createVariable(var, 'float', ('time','nele'))
-                    tmp_var[:] = getattr(fvcom.Variables, var)[:]
+                    tmp_var = _create(f, var, 'float', ('time','nele'), **options)
+                    _stream(getattr(fvcom.Variables, var), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if var in ['julianTime', 'matlabTime']:
             try:
                 if hasattr(fvcom.Variables, var):
-                    tmp_var = f.createVariable(var, 'float', ('time',))
-                    tmp_var[:] = getattr(fvcom.Variables, var)[:]
+                    tmp_var = _create(f, var, 'float', ('time',), **options)
+                    _stream(getattr(fvcom.Variables, var), tmp_var, debug=debug)
             except AttributeError:
                 pass
         if var == 'el':
             try:
                 if hasattr(fvcom.Variables, var):
-                    tmp_var = f.createVariable('zeta', 'float', ('time','node'))
-                    tmp_var[:] = getattr(fvcom.Variables, var)[:]
+                    tmp_var = _create(f, 'zeta', 'float', ('time','node'), **options)
+                    _stream(getattr(fvcom.Variables, var), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if fvcom.Variables._3D:
@@ -95,24 +161,25 @@ def pyseidon_to_netcdf(fvcom, filename, debug):
                        'vorticity', 'power_density']:
                 try:
                     if hasattr(fvcom.Variables, var):
-                        tmp_var = f.createVariable(var,'float',('time','siglay','nele'))
-                        tmp_var[:] = getattr(fvcom.Variables, var)[:]
+                        tmp_var = _create(f, var,'float',('time','siglay','nele'),
+                                          **options)
+                        _stream(getattr(fvcom.Variables, var), tmp_var, debug=debug)
                 except (AttributeError, IndexError) as e:
                     pass
             if var in ['verti_shear']:
                 try:
                     if hasattr(fvcom.Variables, var):
-                        tmp_var = f.createVariable(var,'float',
-                                                      ('time','vertshear','nele'))
-                        tmp_var[:] = getattr(fvcom.Variables, var)[:]
+                        tmp_var = _create(f, var,'float',
+                                          ('time','vertshear','nele'), **options)
+                        _stream(getattr(fvcom.Variables, var), tmp_var, debug=debug)
                 except (AttributeError, IndexError) as e:
                     pass
             if var in ['w']:
                 try:
                     if hasattr(fvcom.Variables, var):
-                        tmp_var = f.createVariable('ww','float',
-                                                      ('time','siglay','nele'))
-                        tmp_var[:] = getattr(fvcom.Variables, var)[:]
+                        tmp_var = _create(f, 'ww','float',
+                                          ('time','siglay','nele'), **options)
+                        _stream(getattr(fvcom.Variables, var), tmp_var, debug=debug)
                 except (AttributeError, IndexError) as e:
                     pass
 
@@ -122,66 +189,96 @@ def pyseidon_to_netcdf(fvcom, filename, debug):
         if grd in ['xc', 'yc', 'lonc', 'latc', 'hc']:
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd, 'float', ('nele',))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd, 'float', ('nele',), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd == 'depth2D':
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd, 'float', ('time','nele'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd, 'float', ('time','nele'), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd in ['x', 'y', 'lon', 'lat', 'h']:
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd, 'float', ('node',)) 
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd, 'float', ('node',), **options) 
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd in ['triele','trinodes']:
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd, 'i', ('nele','three'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd, 'i', ('nele','three'), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd in ['a1u', 'a2u']:
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd, 'float', ('four','nele'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd, 'float', ('four','nele'), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd in ['aw0', 'awy', 'awx']:
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd, 'float', ('three','nele'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd, 'float', ('three','nele'), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd == 'siglay':
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd,'float', ('siglay','node'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd,'float', ('siglay','node'), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd == 'siglev':
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd,'float', ('siglev','node'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd,'float', ('siglev','node'), **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
         if grd == 'depth':
             try:
                 if hasattr(fvcom.Grid, grd):
-                    tmp_var = f.createVariable(grd,'float', ('time','siglay','nele'))
-                    tmp_var[:] = getattr(fvcom.Grid, grd)[:]
+                    tmp_var = _create(f, grd,'float', ('time','siglay','nele'),
+                                      **options)
+                    _stream(getattr(fvcom.Grid, grd), tmp_var, debug=debug)
             except (AttributeError, IndexError) as e:
                 pass
+
+    #Derived fields, computed block by block
+    for item in derived:
+        if type(item) == str:
+            if not item in _DERIVED:
+                print "---Unknown derived field: " + item + "---"
+                continue
+            keys, dims, func = _DERIVED[item]
+            if 'siglay' in dims and not fvcom.Variables._3D:
+                print "---" + item + " requires a 3D run---"
+                continue
+            inputs = [getattr(fvcom.Variables, k) for k in keys
+                      if hasattr(fvcom.Variables, k)]
+            if len(inputs) < 2:
+                print "---Missing velocity components for " + item + "---"
+                continue
+            name = item
+            block = (lambda s, inputs=inputs, func=func:
+                     func(*[x[s] for x in inputs]))
+        else:
+            name, dims, block = item
+        #Already cached in FVCOM.Variables
+        if name in f.variables:
+            continue
+        if debug: print "...computing "+name+"..."
+        tmp_var = _create(f, name, 'float', dims, **options)
+        for s in block_slices(tuple(tmp_var.shape), 8):
+            tmp_var[s] = block(s)
+
     f.close()
     if debug: print "...done"    
 
@@ -37,7 +37,7 @@ def pyseidon_to_pickle(fvcom, filename, debug):
     #TR: Force caching Variables otherwise error during loading
     #    with 'netcdf4.Variable' type (see above)
     for key in data['Variables']:
-        listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
+        listkeys=['Variable', 'ArrayProxy', 'BaseType', '_CachedArray'] 
         if any([type(data['Variables'][key]).__name__==x for x in listkeys]):
             if debug:
                 print "Force caching for " + key
@@ -47,7 +47,7 @@ def pyseidon_to_pickle(fvcom, filename, debug):
     #TR: Force caching Variables otherwise error during loading
     #    with 'netcdf4.Variable' type (see above)
     for key in data['Grid']:
-        listkeys=['Variable', 'ArrayProxy', 'BaseType'] 
+        listkeys=['Variable', 'ArrayProxy', 'BaseType', '_CachedArray'] 
         if any([type(data['Grid'][key]).__name__==x for x in listkeys]):
             if debug:
                 print "Force caching for " + key
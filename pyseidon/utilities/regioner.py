@@ -1,7 +1,6 @@
 from __future__ import division
 import numpy as np
 from bisect import bisect_left, bisect_right
-import matplotlib.pyplot as plt
 import matplotlib.tri as Tri
 #quick fix
 #import netCDF4 as nc
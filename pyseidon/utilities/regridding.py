@@ -0,0 +1,346 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import hashlib
+import os
+from os.path import join, isfile
+import scipy.sparse as sparse
+
+#Utility import
+from pyseidon.utilities.lazy_import import LazyModule
+from pyseidon.utilities.miscellaneous import block_slices
+from pyseidon.utilities.memory_budget import memory_budget
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Heavy dependencies imported on first use
+Tri = LazyModule('matplotlib.tri')
+
+def raster_key(lon, lat, trinodes, raster_lon, raster_lat):
+    """
+    Key of the operator of any given mesh and raster, string
+    """
+    sha = hashlib.sha1()
+    for a in [lon, lat, raster_lon, raster_lat]:
+        sha.update(np.ascontiguousarray(a, dtype=float))
+    sha.update(np.ascontiguousarray(trinodes, dtype=np.int64))
+
+    return sha.hexdigest()
+
+def barycentric_weights(lon, lat, trinodes, index, pt_lon, pt_lat):
+    """
+    Barycentric coordinates of points in their elements
+
+    Inputs:
+      - lon, lat = node coordinates, 1D arrays (nnode)
+      - trinodes = surrounding nodes of the elements, 2D array (nele, 3)
+      - index = elements containing the points, 1D array of integers (npts)
+      - pt_lon, pt_lat = point coordinates, 1D arrays (npts)
+
+    Outputs:
+      - weights = barycentric coordinates, 2D array (npts, 3), summing to 1
+
+    *Notes*
+      - longitudes scaled by cos(latitude), as in particle_tracking
+    """
+    tri = trinodes[index]
+    scale = np.cos(np.deg2rad(pt_lat))
+    x = lon[tri] * scale[:, None]
+    y = lat[tri]
+    px = pt_lon * scale
+    py = pt_lat
+    det = (y[:, 1] - y[:, 2]) * (x[:, 0] - x[:, 2]) + (x[:, 2] - x[:, 1]) * (y[:, 0] - y[:, 2])
+    det[det == 0.0] = np.finfo(float).eps
+    l0 = ((y[:, 1] - y[:, 2]) * (px - x[:, 2]) + (x[:, 2] - x[:, 1]) * (py - y[:, 2])) / det
+    l1 = ((y[:, 2] - y[:, 0]) * (px - x[:, 2]) + (x[:, 0] - x[:, 2]) * (py - y[:, 2])) / det
+
+    return np.vstack((l0, l1, 1.0 - l0 - l1)).T
+
+def level_interpolation(var, depth, target):
+    """
+    Linear interpolation of profiles at any given depths, all columns at once
+
+    Inputs:
+      - var = variable, 3D array (time, nlevel, npts)
+      - depth = depth of the levels (m), 3D array (time, nlevel, npts),
+                decreasing along the levels
+      - target = target depths (m), 3D array (time, nz, npts)
+
+    Outputs:
+      - varZ = var at the target depths, 3D array (time, nz, npts)
+
+    *Notes*
+      - nearest level above the top level or below the bottom one
+      - one pass per level, i.e. no (time, nlevel, nz, npts) intermediate
+    """
+    nlevel = depth.shape[1]
+    k = np.zeros(target.shape, dtype=int)
+    for l in range(nlevel):
+        k += (depth[:, l:l+1, :] > target)
+    k = np.clip(k - 1, 0, max(nlevel - 2, 0))
+    k1 = np.minimum(k + 1, nlevel - 1)
+    t = np.arange(depth.shape[0])[:, None, None]
+    p = np.arange(depth.shape[2])[None, None, :]
+    d0 = depth[t, k, p]
+    dz = depth[t, k1, p] - d0
+    w = np.where(dz == 0.0, 0.0, (target - d0) / np.where(dz == 0.0, 1.0, dz))
+    w = np.clip(w, 0.0, 1.0)
+    v0 = var[t, k, p]
+
+    return v0 + w * (var[t, k1, p] - v0)
+
+def sigma_to_z(var, depth, total, z, from_bottom=False):
+    """
+    Regrids sigma level profiles on fixed z levels
+
+    Inputs:
+      - var = variable, 3D array (time, nlevel, npts)
+      - depth = depth of the sigma levels (m), 3D array (time, nlevel, npts),
+                negative from the free surface downwards
+      - total = water column heights, i.e. elevation + bathymetry (m),
+                2D array (time, npts)
+      - z = z levels (m), 1D array (nz), negative from the free surface
+            downwards, or positive heights above the seabed if from_bottom
+
+    Options:
+      - from_bottom = True if z levels are heights above the seabed,
+                      ex: ADCP bins
+
+    Outputs:
+      - varZ = var on the z levels, masked array (time, nz, npts), masked
+               outside of the water column
+
+    *Notes*
+      - nearest sigma level between the surface and the top level, and
+        between the bottom level and the seabed
+    """
+    z = np.asarray(z, dtype=float).ravel()
+    if from_bottom:
+        target = z[None, :, None] - total[:, None, :]
+    else:
+        target = np.ones((depth.shape[0], 1, depth.shape[2])) * z[None, :, None]
+    varZ = level_interpolation(var, depth, target)
+    mask = (target > 0.0) | (target < -total[:, None, :]) | np.isnan(varZ)
+
+    return np.ma.masked_array(varZ, mask)
+
+def vertical_integral(var, siglev, total, zmin=None, zmax=None,
+                      from_bottom=False, average=True):
+    """
+    Depth average or integral of profiles, weighted by the sigma layer
+    thicknesses
+
+    Inputs:
+      - var = variable, 3D array (time, nlevel, npts) at sigma layers,
+              (time, nlevel+1, npts) at sigma levels, ex: tke, or
+              (time, nlevel-1, npts) between layers, ex: verti_shear
+      - siglev = sigma levels, 2D array (nlevel+1, npts), from 0 at the
+                 surface to -1 at the seabed
+      - total = water column heights, i.e. elevation + bathymetry (m),
+                2D array (time, npts)
+
+    Options:
+      - zmin, zmax = depth range (m), negative from the free surface
+                     downwards, or heights above the seabed if from_bottom,
+                     ex: rotor swept area. Default: whole water column
+      - from_bottom = True if zmin and zmax are heights above the seabed
+      - average = depth average if True, integral over the range otherwise
+                  (units of var times m)
+
+    Outputs:
+      - varI = depth averaged or integrated variable, 2D array (time, npts),
+               nan where the range is out of the water column
+
+    *Notes*
+      - layers partly in the range weighted by their overlap
+      - values at sigma levels averaged over each layer, i.e. trapezoidal
+      - values between layers weighted by the distance between the
+        adjacent layer centres, the top and bottom ones extended up to
+        the surface and down to the seabed
+      - one contraction over the level axis, see numpy.einsum
+    """
+    siglev = np.asarray(siglev, dtype=float)
+    if var.shape[1] == siglev.shape[0]:
+        var = 0.5 * (var[:, :-1, :] + var[:, 1:, :])
+    elif var.shape[1] == siglev.shape[0] - 2:
+        #Each value spans the adjacent layer centres, i.e. the layer centres
+        #taken as interfaces, the surface and seabed bounding the ends
+        centres = 0.5 * (siglev[:-1, :] + siglev[1:, :])
+        siglev = np.vstack((siglev[:1, :], centres[1:-1, :], siglev[-1:, :]))
+    if not var.shape[1] == siglev.shape[0] - 1:
+        raise PyseidonError("---Variable should be defined at sigma layers, levels or between layers---")
+    if zmin is None and zmax is None:
+        weights = (siglev[:-1, :] - siglev[1:, :])[None, :, :] * total[:, None, :]
+    else:
+        #Layer interfaces and range as depths from the free surface
+        levels = total[:, None, :] * siglev[None, :, :]
+        top = np.zeros(total.shape)
+        bottom = -total
+        if from_bottom:
+            if zmax is not None: top = np.minimum(zmax - total, 0.0)
+            if zmin is not None: bottom = np.maximum(zmin - total, -total)
+        else:
+            if zmax is not None: top = np.minimum(zmax, 0.0) * np.ones(total.shape)
+            if zmin is not None: bottom = np.maximum(zmin, -total)
+        upper = np.minimum(levels[:, :-1, :], top[:, None, :])
+        lower = np.maximum(levels[:, 1:, :], bottom[:, None, :])
+        weights = np.maximum(upper - lower, 0.0)
+    varI = np.einsum('tkn,tkn->tn', weights, var)
+    if average:
+        thickness = weights.sum(axis=1)
+        varI = varI / np.where(thickness > 0.0, thickness, np.nan)
+    else:
+        varI[weights.sum(axis=1) == 0.0] = np.nan
+
+    return varI
+
+class RasterRegridder:
+    """
+    **Unstructured mesh to regular lon/lat raster regridding**
+
+    The containing element and barycentric weights of each raster cell
+    are computed once and stored as a sparse operator, applied to node
+    or element fields of any number of time steps in one sparse product,
+    ex: ::
+
+        regridder = RasterRegridder(lon, lat, trinodes, np.linspace(-66.4, -66.3, 200),
+                                    np.linspace(44.2, 44.3, 150))
+        el = regridder.regrid(fvcom.Variables.el)
+
+    Inputs:
+      - lon, lat = node coordinates, 1D arrays (nnode)
+      - trinodes = surrounding nodes of the elements, 2D array (nele, 3)
+      - raster_lon = raster cell centre longitudes, 1D array (nx)
+      - raster_lat = raster cell centre latitudes, 1D array (ny)
+
+    Options:
+      - finder = trifinder of the mesh, ex: Grid.triangleLL.get_trifinder().
+                 Default: built from the mesh
+      - directory = folder of the cached operators, string. Operators are
+                    reloaded from there when already computed
+
+    *Notes*
+      - cells outside of the mesh, i.e. land, are nan
+      - element fields averaged at the nodes first, i.e. mean of the
+        surrounding elements, then linearly interpolated
+    """
+    def __init__(self, lon, lat, trinodes, raster_lon, raster_lat, finder=None,
+                 directory=None, debug=False):
+        self._debug = debug
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        trinodes = np.asarray(trinodes, dtype=int)
+        self.raster_lon = np.asarray(raster_lon, dtype=float).ravel()
+        self.raster_lat = np.asarray(raster_lat, dtype=float).ravel()
+        self.shape = (self.raster_lat.shape[0], self.raster_lon.shape[0])
+        self.nnode = lon.shape[0]
+        self.nele = trinodes.shape[0]
+        self.key = raster_key(lon, lat, trinodes, self.raster_lon, self.raster_lat)
+        filename = None
+        if directory is not None:
+            filename = join(directory, 'raster_' + self.key + '.npz')
+        if filename is not None and isfile(filename):
+            if debug: print "Raster operator reloaded from " + filename
+            data = np.load(filename)
+            self.nodes = sparse.csr_matrix((data['data'], data['indices'], data['indptr']),
+                                           shape=tuple(data['shape']))
+            self.mask = data['mask']
+        else:
+            self.nodes, self.mask = self._operator(lon, lat, trinodes, finder)
+            if filename is not None:
+                self._save(filename)
+        #Nodal averages of the element fields
+        rows = trinodes.ravel()
+        cols = np.repeat(np.arange(self.nele), 3)
+        count = np.bincount(rows, minlength=self.nnode).astype(float)
+        average = sparse.csr_matrix((1.0 / count[rows], (rows, cols)),
+                                    shape=(self.nnode, self.nele))
+        self.elements = self.nodes.dot(average).tocsr()
+
+    def _operator(self, lon, lat, trinodes, finder):
+        """Sparse operator (ncell, nnode) and land mask (ny, nx)"""
+        if self._debug: print "Computing raster operator..."
+        if finder is None:
+            finder = Tri.Triangulation(lon, lat, triangles=trinodes).get_trifinder()
+        glon, glat = np.meshgrid(self.raster_lon, self.raster_lat)
+        glon = glon.ravel()
+        glat = glat.ravel()
+        index = np.asarray(finder(glon, glat), dtype=int)
+        wet = np.where(index >= 0)[0]
+        weights = barycentric_weights(lon, lat, trinodes, index[wet],
+                                      glon[wet], glat[wet])
+        nodes = sparse.csr_matrix((weights.ravel(),
+                                   (np.repeat(wet, 3), trinodes[index[wet]].ravel())),
+                                  shape=(glon.shape[0], lon.shape[0]))
+
+        return nodes, (index < 0).reshape(self.shape)
+
+    def _save(self, filename):
+        """Caches the operator, i.e. not mandatory"""
+        try:
+            directory = os.path.dirname(filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            np.savez(filename, data=self.nodes.data, indices=self.nodes.indices,
+                     indptr=self.nodes.indptr, shape=np.array(self.nodes.shape),
+                     mask=self.mask)
+        except (IOError, OSError) as e:
+            print "---Raster operator not cached: " + str(e) + "---"
+
+    def regrid(self, var, time_ind=slice(None), memory=None, debug=False):
+        """
+        Regrids any given node or element field
+
+        Inputs:
+          - var = variable, numpy array, netCDF4 variable or OpenDap proxy,
+                  dim=(nnode or nele), (time, nnode or nele) or
+                  (time, nlevel, nnode or nele)
+
+        Options:
+          - time_ind = time indices to work in, slice or 1D array of integers
+          - memory = memory budget, see MemoryBudget. Default: shared one
+
+        Outputs:
+          - raster = regridded field, array of dim=(ny, nx), (time, ny, nx)
+                     or (time, nlevel, ny, nx), nan on land
+
+        *Notes*
+          - read and regridded by time blocks fitting in the memory budget
+        """
+        debug = (debug or self._debug)
+        if memory is None:
+            memory = memory_budget()
+        shape = tuple(var.shape)
+        if shape[-1] == self.nnode:
+            op = self.nodes
+        elif shape[-1] == self.nele:
+            op = self.elements
+        else:
+            raise PyseidonError("---Variable should be defined at nodes or elements---")
+        if len(shape) == 1:
+            raster = op.dot(np.asarray(var[:], dtype=float))
+            raster[self.mask.ravel()] = np.nan
+            return raster.reshape(self.shape)
+        tind = np.arange(shape[0])[time_ind]
+        lead = (tind.shape[0],) + shape[1:-1]
+        raster = memory.allocate(lead + self.shape, name='raster')
+        ncell = self.shape[0] * self.shape[1]
+        #Read block, its transpose and the raster block held at once
+        blocks = block_slices(lead + (shape[-1] + ncell,), 8 * 2, memory.budget)
+        if debug: print str(len(blocks)) + " time blocks"
+        for block in blocks:
+            ind = tind[block]
+            if ind.shape[0] > 0 and ind[-1] - ind[0] + 1 == ind.shape[0]:
+                ind = slice(int(ind[0]), int(ind[-1]) + 1)
+            values = np.asarray(np.ma.filled(var[ind], np.nan), dtype=float)
+            rows = values.reshape(-1, shape[-1])
+            cells = op.dot(rows.T).T
+            cells[:, self.mask.ravel()] = np.nan
+            raster[block] = cells.reshape(values.shape[:-1] + self.shape)
+        if debug: print '...Passed'
+
+        return raster
@@ -1,19 +1,28 @@
 #from __future__ import division
 #import netCDF4 as nc
 import numpy as np
-import scipy.spatial
-import networkx as nx
 import matplotlib.pyplot as plt
 import matplotlib.tri as Tri
 import matplotlib.ticker as ticker
 import seaborn
 
+from pyseidon.utilities.element_graph import ElementGraph, element_neighbours
+from pyseidon.utilities.element_graph import _metric_coordinates
+
 class shortest_element_path:
     """
     Class that mostly computes the shortest path from A to B
     by hopping from an element to the next
+
+    Options:
+      - triele = surrounding element indices, 2D array (nele, 3),
+                 derived from trinodes if not provided
+      - xc, yc = element coordinates (m), 1D arrays, projected
+                 lonc/latc if not provided
+      - graph = prebuilt ElementGraph, see element_graph
     """
-    def __init__(self, lonc, latc, lon, lat, trinodes, h, debug=False):
+    def __init__(self, lonc, latc, lon, lat, trinodes, h, triele=None,
+                 xc=None, yc=None, graph=None, debug=False):
 
         #self.data = nc.Dataset(filename,'r')
 
@@ -26,109 +35,59 @@ class shortest_element_path:
         self.trinodes = trinodes[:]
         self.h = h[:]
 
-        #z = np.vstack((latc,lonc)).T
-        z = np.vstack((lonc,latc)).T
-        #z = np.vstack((xc, yc)).T
-
-        self.points = map(tuple,z)
-
         if debug : print 'File Loaded'
 
-        # make a Delaunay triangulation of the point data
-        self.delTri = scipy.spatial.Delaunay(self.points)
-        if debug : print 'Delaunay Triangulation Done'
-
-        # create a set for edges that are indexes of the points
-        self.edges = []
-        self.weight = []
-        # for each Delaunay triangle
-        for n in xrange(self.delTri.nsimplex):
-            # for each edge of the triangle
-            # sort the vertices
-            # (sorting avoids duplicated edges being added to the set)
-            # and add to the edges set
-
-            self.edge = sorted([self.delTri.vertices[n,0], self.delTri.vertices[n,1]])
-            a = self.points[self.edge[0]]
-            b = self.points[self.edge[1]]
-            self.weight = (np.sqrt((a[0]-b[0])**2+(a[1]-b[1])**2))
-            self.edges.append((self.edge[0], self.edge[1],{'weight':self.weight}))
-
-            self.edge = sorted([self.delTri.vertices[n,0], self.delTri.vertices[n,2]])
-            a = self.points[self.edge[0]]
-            b = self.points[self.edge[1]]
-            self.weight = (np.sqrt((a[0]-b[0])**2+(a[1]-b[1])**2))
-            self.edges.append((self.edge[0], self.edge[1],{'weight':self.weight}))
-
-
-            self.edge = sorted([self.delTri.vertices[n,1], self.delTri.vertices[n,2]])
-            a = self.points[self.edge[0]]
-            b = self.points[self.edge[1]]
-            self.weight = (np.sqrt((a[0]-b[0])**2+(a[1]-b[1])**2))
-            self.edges.append((self.edge[0], self.edge[1],{'weight':self.weight}))
-
-        if debug : print 'Edges and Weighting Done'
-
-        # make a graph based on the Delaunay triangulation edges
-        self.graph = nx.Graph(self.edges)
-        #print(graph.edges())
+        # graph of the elements sharing an edge, weighted by the
+        # distance between element centres
+        if graph is None:
+            if triele is None:
+                triele = element_neighbours(self.trinodes)
+            if xc is None or yc is None:
+                xc, yc = _metric_coordinates(self.lonc, self.latc)
+            graph = ElementGraph(triele, xc, yc, debug=debug)
+        self.graph = graph
 
         if debug : print 'Graph Constructed'
 
-        self.pointIDXY = dict(zip(range(len(self.points)), self.points))
-
     def getTargets(self, source_target, coords=False):
+        """
+        Shortest paths between many source/target pairs
+
+        Inputs:
+          - source_target = [source, target] pairs of element indices,
+                            or of (lon, lat) coordinates if coords=True
 
+        Outputs:
+          - elements = element indices along each path, list of lists
+          - coordinates = (lon, lat) along each path, list of lists
+        """
         self.elements = []
         self.coordinates = []
         self.maxcoordinates = []
         self.mincoordinates = []
+        sources = []
+        targets = []
         for i in source_target:
-            source = i[0]
-            target = i[1]
-
-#            print '\n'
-#            print 'Source'
-#            print source
-            s = source
-#
-#            print 'Target'
-#            print target
-            t = target
-
+            s = i[0]
+            t = i[1]
             if coords:
-                for key, value in self.pointIDXY.items():
-                    if value==source:
-                        print 'Source'
-                        print key
-                        s = key
-
-                    if value==target:
-                        print 'Target'
-                        print key
-                        t = key
-
-            #print s,t
-            shortest = nx.shortest_path(self.graph,source=s,target=t,weight='weight')
-#            dist = nx.shortest_path_length(self.graph,source=s,target=t,weight='weight')
-
-#            print 'Shortest Path (by elements)'
-#            print shortest
-
-            self.elements.append(shortest)
-
-            coords = [self.pointIDXY[i] for i in shortest]
-            self.coordinates.append(coords)
-            self.maxcoordinates.append(np.max(np.array(coords),axis=0))
-            self.mincoordinates.append(np.min(np.array(coords),axis=0))
-
-#            print 'Shortest Distance (by coordinates)'
-#            print dist
+                s = np.argmin((self.lonc - s[0])**2 + (self.latc - s[1])**2)
+                t = np.argmin((self.lonc - t[0])**2 + (self.latc - t[1])**2)
+            sources.append(s)
+            targets.append(t)
+
+        paths, dist = self.graph.paths(sources, targets)
+        for shortest in paths:
+            self.elements.append(shortest.tolist())
+            coords = np.vstack((self.lonc[shortest], self.latc[shortest])).T
+            self.coordinates.append(map(tuple, coords))
+            if shortest.shape[0] > 0:
+                self.maxcoordinates.append(np.max(coords, axis=0))
+                self.mincoordinates.append(np.min(coords, axis=0))
 
         return self.elements, self.coordinates
 
     def graphGrid(self,narrowGrid=False, plot=False):
-        #nx.draw(self.graph, self.pointIDXY)
         #plt.show()
 
         #lat = self.data.variables['lat'][:]
@@ -171,8 +130,8 @@ class shortest_element_path:
 
         zz = len(self.elements)
         for i,v in enumerate(self.elements):
-            source = self.pointIDXY[v[0]]
-            target = self.pointIDXY[v[-1]]
+            source = (self.lonc[v[0]], self.latc[v[0]])
+            target = (self.lonc[v[-1]], self.latc[v[-1]])
             lab = '({:.6},{:.6})-({:.6},{:.6})'.format(source[0], source[1],
                                                        target[0], target[1])
 
@@ -0,0 +1,330 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+import threading
+from multiprocessing.pool import ThreadPool
+
+#Utility import
+from pyseidon.utilities.miscellaneous import block_slices
+from pyseidon.utilities.interpolation_utils import gather_columns
+from pyseidon.utilities.memory_budget import memory_budget
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#netCDF4 and OpenDap reads are not thread safe, only the reductions are parallel
+_READ_LOCK = threading.Lock()
+
+class StreamingStats:
+    """
+    **Statistics over time updated chunk by chunk, i.e. in one pass**
+
+    Mean and variance (Welford/Chan), extrema, histogram-based quantiles,
+    threshold exceedance and means of derived quantities, per column.
+
+    Inputs:
+      - shape = shape of one time step, tuple of integers, ex: (nele,)
+                or (nlevel, nele)
+
+    Options:
+      - edges = histogram bin edges, 1D array, used for the quantiles.
+                Default: nbins bins growing with the range of the values
+      - nbins = number of bins of the growing histogram, even integer
+      - thresholds = exceedance thresholds, list of floats
+      - means = derived quantities whose time means are wanted,
+                dictionary of name: function of the values
+
+    *Notes*
+      - quantiles exact to one bin width. Given edges, values outside of
+        them are counted in the first/last bin. Otherwise the bins start
+        on the range of the first chunk and double in width whenever a
+        chunk falls outside of them, i.e. the bin width stays within
+        twice the range of all the values over nbins
+      - nan ignored, i.e. counted per column
+      - mergeable, see merge, so chunks or columns can be reduced apart
+    """
+    def __init__(self, shape, edges=None, nbins=1000, thresholds=[], means={}):
+        self.shape = tuple(shape)
+        self._grow = edges is None
+        if self._grow:
+            if nbins % 2:
+                raise PyseidonError("---nbins must be even---")
+            self.edges = None
+        else:
+            self.edges = np.asarray(edges, dtype=float)
+            nbins = self.edges.shape[0] - 1
+        self.thresholds = np.asarray(thresholds, dtype=float).ravel()
+        self.means = means
+        self.n = np.zeros(self.shape, dtype=np.int64)
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+        self.min = np.ones(self.shape) * np.inf
+        self.max = -np.ones(self.shape) * np.inf
+        self.hist = np.zeros((nbins,) + self.shape, dtype=np.int64)
+        self.above = np.zeros((self.thresholds.shape[0],) + self.shape, dtype=np.int64)
+        self.sums = dict([(k, np.zeros(self.shape)) for k in means])
+
+    def _cover(self, lo, hi):
+        """Grows the bins until they cover lo to hi"""
+        nbins = self.hist.shape[0]
+        if self.edges is None:
+            if hi <= lo:
+                hi = lo + max(abs(lo), 1.0) * 1.0e-3
+            self.edges = np.linspace(lo, hi, nbins + 1)
+            return
+        half = nbins // 2
+        while lo < self.edges[0] or hi > self.edges[-1]:
+            #Pairs of bins merged, range doubled towards the new values
+            merged = self.hist[0::2] + self.hist[1::2]
+            self.hist = np.zeros_like(self.hist)
+            width = self.edges[-1] - self.edges[0]
+            if hi > self.edges[-1]:
+                self.hist[:half] = merged
+                self.edges = np.linspace(self.edges[0], self.edges[0] + 2.0 * width,
+                                         nbins + 1)
+            else:
+                self.hist[half:] = merged
+                self.edges = np.linspace(self.edges[-1] - 2.0 * width, self.edges[-1],
+                                         nbins + 1)
+
+    def update(self, chunk):
+        """
+        Adds a time chunk
+
+        Inputs:
+          - chunk = values, array (time,) + shape
+        """
+        chunk = np.asarray(np.ma.filled(chunk, np.nan), dtype=float)
+        chunk = chunk.reshape((-1,) + self.shape)
+        valid = ~np.isnan(chunk)
+        nb = valid.sum(axis=0)
+        zero = np.where(valid, chunk, 0.0)
+        #Chunk moments, then Chan's parallel update
+        mean_b = zero.sum(axis=0) / np.maximum(nb, 1)
+        m2_b = (np.where(valid, chunk - mean_b, 0.0)**2).sum(axis=0)
+        total = self.n + nb
+        delta = mean_b - self.mean
+        frac = nb / np.maximum(total, 1)
+        self.mean += delta * frac
+        self.m2 += m2_b + delta**2 * self.n * frac
+        self.n = total
+        self.min = np.fmin(self.min, np.where(valid, chunk, np.inf).min(axis=0))
+        self.max = np.fmax(self.max, np.where(valid, chunk, -np.inf).max(axis=0))
+        if self._grow:
+            finite = chunk[np.isfinite(chunk)]
+            if finite.shape[0] > 0:
+                self._cover(finite.min(), finite.max())
+        #Histogram, one bincount for all the columns
+        nbins = self.hist.shape[0]
+        ncol = int(np.prod(self.shape))
+        if self.edges is None:
+            #Nothing but nan so far
+            return
+        bins = np.clip(np.searchsorted(self.edges, zero, side='right') - 1, 0, nbins - 1)
+        flat = bins.reshape(bins.shape[0], -1) * ncol + np.arange(ncol)[None, :]
+        flat = flat[valid.reshape(valid.shape[0], -1)]
+        self.hist += np.bincount(flat, minlength=nbins * ncol).reshape(self.hist.shape)
+        for i, t in enumerate(self.thresholds):
+            self.above[i] += (valid & (zero > t)).sum(axis=0)
+        for k in self.means:
+            self.sums[k] += np.where(valid, self.means[k](zero), 0.0).sum(axis=0)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another StreamingStats of the same columns
+
+        *Notes*
+          - with different edges, the other histogram is re-binned at its
+            bin centres, i.e. quantiles exact to the sum of both bin widths
+        """
+        total = self.n + other.n
+        delta = other.mean - self.mean
+        frac = other.n / np.maximum(total, 1)
+        self.mean += delta * frac
+        self.m2 += other.m2 + delta**2 * self.n * frac
+        self.n = total
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        if other.edges is None:
+            pass
+        elif self.edges is not None and self.edges.shape == other.edges.shape\
+             and np.all(self.edges == other.edges):
+            self.hist += other.hist
+        else:
+            if self._grow:
+                self._cover(other.edges[0], other.edges[-1])
+            centres = 0.5 * (other.edges[1:] + other.edges[:-1])
+            nbins = self.hist.shape[0]
+            bins = np.clip(np.searchsorted(self.edges, centres, side='right') - 1,
+                           0, nbins - 1)
+            np.add.at(self.hist, bins, other.hist)
+        self.above += other.above
+        for k in self.sums:
+            self.sums[k] += other.sums[k]
+
+    def _ranked(self, rank, cum, hist):
+        """Values of the samples of given rank (0 based), from the histogram"""
+        nbins = hist.shape[0]
+        cols = np.arange(hist.shape[1])
+        k = np.minimum((cum <= rank[None, :]).sum(axis=0), nbins - 1)
+        before = np.where(k > 0, cum[np.maximum(k - 1, 0), cols], 0)
+        #Samples spread evenly within their bin
+        frac = np.clip((rank - before + 0.5) / np.maximum(hist[k, cols], 1), 0.0, 1.0)
+
+        return self.edges[k] + frac * (self.edges[k + 1] - self.edges[k])
+
+    def quantile(self, q):
+        """
+        Quantile from the histogram
+
+        Inputs:
+          - q = percentage, float between 0 and 100
+
+        Outputs:
+          - value = quantile, array of shape
+
+        *Notes*
+          - same definition as numpy.percentile, i.e. linear interpolation
+            between ranks
+        """
+        if self.edges is None:
+            return np.ones(self.shape) * np.nan
+        nbins = self.hist.shape[0]
+        hist = self.hist.reshape(nbins, -1)
+        cum = np.cumsum(hist, axis=0)
+        rank = (q / 100.0) * np.maximum(self.n.ravel() - 1, 0)
+        low = np.floor(rank)
+        high = np.minimum(low + 1, np.maximum(self.n.ravel() - 1, 0))
+        v_low = self._ranked(low, cum, hist)
+        v_high = self._ranked(high, cum, hist)
+        value = (v_low + (rank - low) * (v_high - v_low)).reshape(self.shape)
+        value = np.clip(value, self.min, self.max)
+        value[self.n == 0] = np.nan
+
+        return value
+
+    def result(self, quantiles=[]):
+        """
+        Statistic maps
+
+        Options:
+          - quantiles = percentages, list of floats
+
+        Outputs:
+          - stats = dictionary of arrays of shape: 'mean', 'std', 'min',
+                    'max', 'count', 'P<q>' per quantile, 'exceedance'
+                    (fraction of time above each threshold, array
+                    (nthreshold,) + shape) and 'mean_<name>' per derived
+                    quantity
+        """
+        empty = (self.n == 0)
+        n = np.maximum(self.n, 1)
+        stats = {'count': self.n,
+                 'mean': np.where(empty, np.nan, self.mean),
+                 'std': np.where(empty, np.nan, np.sqrt(self.m2 / n)),
+                 'min': np.where(empty, np.nan, self.min),
+                 'max': np.where(empty, np.nan, self.max),
+                 'exceedance': np.where(empty[None], np.nan, self.above / n)}
+        for q in quantiles:
+            stats['P' + ('%g' % q)] = self.quantile(q)
+        for k in self.sums:
+            stats['mean_' + k] = np.where(empty, np.nan, self.sums[k] / n)
+
+        return stats
+
+def _read(var, cols, tind):
+    """Reads columns cols at times tind, slice when contiguous"""
+    if tind[-1] - tind[0] + 1 == tind.shape[0]:
+        tind = slice(int(tind[0]), int(tind[-1]) + 1)
+    with _READ_LOCK:
+        return gather_columns(var, cols, time_ind=tind)
+
+def time_statistics(variables, func=None, quantiles=[50, 90, 99], thresholds=[],
+                    means={}, edges=None, time_ind=slice(None), memory=None,
+                    workers=1, debug=False):
+    """
+    Statistic maps over time of any given field, computed in one pass
+    over time chunks and element blocks
+
+    Inputs:
+      - variables = variables the field is computed from, list of arrays,
+                    netCDF4 variables or OpenDap proxies, all of dim=(time, ele)
+                    or (time, level, ele)
+
+    Options:
+      - func = field as function of the variables' chunks,
+               ex: lambda u, v: np.sqrt(u**2 + v**2). Default: first variable
+      - quantiles = percentages, list of floats
+      - thresholds = exceedance thresholds, list of floats
+      - means = derived quantities whose time means are wanted, dictionary
+                of name: function of the field
+      - edges = histogram bin edges used for the quantiles, 1D array.
+                Default: 1000 bins per element block, growing with the
+                range of the values, see StreamingStats
+      - time_ind = time indices to work in, slice or 1D array of integers
+      - memory = memory budget, see MemoryBudget. Default: shared one
+      - workers = number of element blocks reduced in parallel, integer
+
+    Outputs:
+      - stats = dictionary of maps of dim=(ele) or (level, ele), see
+                StreamingStats.result
+
+    *Notes*
+      - the full (time, ele) field is never held in memory
+    """
+    if not type(variables) in [list, tuple]:
+        variables = [variables]
+    if func is None:
+        func = lambda *chunks: chunks[0]
+    if memory is None:
+        memory = memory_budget()
+    shape = tuple(variables[0].shape)
+    for var in variables[1:]:
+        if not tuple(var.shape) == shape:
+            raise PyseidonError("---Variables must have the same dimensions---")
+    tind = np.arange(shape[0])[time_ind]
+    if tind.shape[0] == 0:
+        raise PyseidonError("---Empty time window---")
+    lead = shape[1:-1]
+    ncol = shape[-1]
+    if edges is None:
+        nbins = 1000
+    else:
+        edges = np.asarray(edges, dtype=float)
+        nbins = edges.shape[0] - 1
+    #Accumulators within a quarter of the budget, chunks within another quarter
+    column = int(np.prod(lead)) * 8 * (nbins + len(thresholds) + len(means) + 8)
+    step = max(1, min(ncol, int(memory.budget // 4 // max(column, 1))))
+    blocks = [slice(i, min(i + step, ncol)) for i in range(0, ncol, step)]
+    nvar = len(variables)
+    if debug: print str(len(blocks)) + " element blocks"
+
+    def reduce_block(block):
+        cols = np.arange(block.start, block.stop)
+        stats = StreamingStats(lead + (cols.shape[0],), edges,
+                               thresholds=thresholds, means=means)
+        chunks = block_slices((tind.shape[0],) + lead + (cols.shape[0],),
+                              8 * (nvar + 6), memory.budget // 4 // max(workers, 1))
+        for chunk in chunks:
+            stats.update(func(*[_read(v, cols, tind[chunk]) for v in variables]))
+        return stats.result(quantiles)
+
+    if workers > 1 and len(blocks) > 1:
+        pool = ThreadPool(min(workers, len(blocks)))
+        try:
+            results = pool.map(reduce_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [reduce_block(b) for b in blocks]
+
+    stats = {}
+    for key in results[0]:
+        stats[key] = np.concatenate([r[key] for r in results], axis=-1)
+    if debug: print '...Passed'
+
+    return stats
@@ -0,0 +1,349 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+from datetime import datetime
+from scipy.io import netcdf, savemat
+
+#Utility import
+from pyseidon.utilities.miscellaneous import datetime_to_mattime, TPI
+from pyseidon.utilities.element_graph import element_neighbours
+
+#Default domain, around Grand Passage (see ax='GP')
+DOMAIN = [-66.40, -66.26, 44.20, 44.34]
+#Tidal constituents: name, period (h), elevation amplitude (m),
+#velocity amplitude (m/s), phase (deg.)
+CONSTITUENTS = [('M2', 12.4206012, 2.50, 1.80, 0.0),
+                ('S2', 12.0, 0.40, 0.30, 30.0),
+                ('N2', 12.65834751, 0.50, 0.35, 330.0),
+                ('K1', 23.93447213, 0.15, 0.05, 100.0)]
+
+def _mattime(start):
+    """Matlab time of any given 'yyyy-mm-dd hh:mm:ss' string"""
+    return datetime_to_mattime(datetime.strptime(start, '%Y-%m-%d %H:%M:%S'))
+
+def _relative(lon, lat, lon0, lat0):
+    """Coordinates relative to (lon0, lat0) in m, as in FVCOM"""
+    x = TPI * np.cos(np.deg2rad(lat + lat0) * 0.5) * (lon - lon0)
+    y = TPI * (lat - lat0)
+
+    return x, y
+
+def tidal_fields(lon, lat, mtime, domain=DOMAIN):
+    """
+    Analytical tidal fields shared by all the synthetic data,
+    i.e. observations and simulations agree
+
+    Inputs:
+      - lon, lat = coordinates in decimal degrees, 1D arrays (npts)
+      - mtime = matlab times, 1D array (ntime)
+
+    Options:
+      - domain = [lon min, lon max, lat min, lat max]
+
+    Outputs:
+      - h = bathymetry (m), 1D array (npts)
+      - el = elevation (m), 2D array (ntime, npts)
+      - ua, va = depth averaged velocities (m/s), 2D arrays (ntime, npts)
+    """
+    xn = (np.asarray(lon) - domain[0]) / (domain[1] - domain[0])
+    yn = (np.asarray(lat) - domain[2]) / (domain[3] - domain[2])
+    #Deep channel along the middle of the domain
+    h = 10.0 + 50.0 * np.exp(-((xn - 0.5) / 0.2)**2) * (0.7 + 0.3 * yn)
+    hours = (np.asarray(mtime) - np.asarray(mtime)[0]) * 24.0
+    el = np.zeros((hours.shape[0], xn.shape[0]))
+    ua = np.zeros(el.shape)
+    va = np.zeros(el.shape)
+    for name, period, amp, uamp, phase in CONSTITUENTS:
+        arg = 2.0 * np.pi * hours[:, None] / period - np.deg2rad(phase) -\
+              0.3 * np.pi * yn[None, :]
+        el += amp * (1.0 + 0.2 * xn[None, :]) * np.cos(arg)
+        #Flow concentrated in the channel, along the y axis
+        speed = uamp * (20.0 / h)[None, :]**0.5 * np.sin(arg)
+        va += speed
+        ua += 0.2 * speed * (xn - 0.5)[None, :]
+
+    return h, el, ua, va
+
+def _profile(siglay):
+    """1/7 power law velocity profile, depth averaged to 1"""
+    return (8.0 / 7.0) * (1.0 + siglay)**(1.0 / 7.0)
+
+def synthetic_mesh(nele=5000, shape=None, domain=DOMAIN, seed=0):
+    """
+    Deterministic triangular mesh with FVCOM grid parameters
+
+    Options:
+      - nele = approximate number of elements, integer
+      - shape = number of nodes along longitude and latitude, (nx, ny).
+                Overrides nele
+      - domain = [lon min, lon max, lat min, lat max]
+      - seed = seed of the node jittering, integer
+
+    Outputs:
+      - grid = dictionary with lon, lat, lonc, latc, x, y, xc, yc,
+               trinodes (nele, 3), triele (nele, 3), a1u, a2u, aw0,
+               awx, awy, zero based indices
+    """
+    if shape is None:
+        n = int(np.ceil(np.sqrt(nele / 2.0))) + 1
+        shape = (n, n)
+    nx, ny = shape
+    rand = np.random.RandomState(seed)
+    lon, lat = np.meshgrid(np.linspace(domain[0], domain[1], nx),
+                           np.linspace(domain[2], domain[3], ny))
+    #Interior nodes jittered by up to 20% of the spacing
+    dlon = (domain[1] - domain[0]) / (nx - 1)
+    dlat = (domain[3] - domain[2]) / (ny - 1)
+    lon[1:-1, 1:-1] += 0.2 * dlon * (rand.rand(ny - 2, nx - 2) - 0.5)
+    lat[1:-1, 1:-1] += 0.2 * dlat * (rand.rand(ny - 2, nx - 2) - 0.5)
+    lon = lon.ravel()
+    lat = lat.ravel()
+    #Two triangles per cell, counterclockwise
+    i, j = np.meshgrid(np.arange(nx - 1), np.arange(ny - 1))
+    n0 = (j * nx + i).ravel()
+    n1 = n0 + 1
+    n2 = n0 + nx + 1
+    n3 = n0 + nx
+    trinodes = np.vstack((np.vstack((n0, n1, n2)).T,
+                          np.vstack((n0, n2, n3)).T))
+    triele = element_neighbours(trinodes)
+    grid = {'lon': lon, 'lat': lat, 'trinodes': trinodes, 'triele': triele}
+    grid['lonc'] = lon[trinodes].mean(axis=1)
+    grid['latc'] = lat[trinodes].mean(axis=1)
+    lon0 = 0.5 * (domain[0] + domain[1])
+    lat0 = 0.5 * (domain[2] + domain[3])
+    grid['x'], grid['y'] = _relative(lon, lat, lon0, lat0)
+    grid['xc'], grid['yc'] = _relative(grid['lonc'], grid['latc'], lon0, lat0)
+
+    #Node interpolation, i.e. linear shape functions of the elements
+    nele = trinodes.shape[0]
+    dx, dy = _relative(lon[trinodes], lat[trinodes],
+                       grid['lonc'][:, None], grid['latc'][:, None])
+    M = np.dstack((np.ones(dx.shape), dx, dy))
+    coef = np.linalg.inv(M)
+    grid['aw0'] = coef[:, 0, :].T
+    grid['awx'] = coef[:, 1, :].T
+    grid['awy'] = coef[:, 2, :].T
+
+    #Element interpolation, i.e. least square gradients from the neighbours
+    ghost = (triele < 0)
+    nb = np.where(ghost, np.arange(nele)[:, None], triele)
+    dx, dy = _relative(grid['lonc'][nb], grid['latc'][nb],
+                       grid['lonc'][:, None], grid['latc'][:, None])
+    dx[ghost] = 0.0
+    dy[ghost] = 0.0
+    W = np.linalg.pinv(np.dstack((dx, dy)))
+    grid['a1u'] = np.vstack((-W[:, 0, :].sum(axis=1), W[:, 0, :].T))
+    grid['a2u'] = np.vstack((-W[:, 1, :].sum(axis=1), W[:, 1, :].T))
+
+    return grid
+
+def _sigma(nlevel, npts):
+    """Uniform sigma layers and levels, dim=(nlevel, npts) and (nlevel+1, npts)"""
+    siglev = -np.linspace(0.0, 1.0, nlevel + 1)
+    siglay = 0.5 * (siglev[1:] + siglev[:-1])
+
+    return (np.repeat(siglay[:, None], npts, axis=1),
+            np.repeat(siglev[:, None], npts, axis=1))
+
+def synthetic_fvcom(filename, nele=5000, nlevel=10, ntime=144, dt=600.0,
+                    start='2013-08-01 00:00:00', shape=None, domain=DOMAIN,
+                    seed=0, debug=False):
+    """
+    Writes a synthetic FVCOM output file
+
+    Inputs:
+      - filename = path to the *.nc file, string
+
+    Options:
+      - nele = approximate number of elements, integer
+      - nlevel = number of sigma layers, integer
+      - ntime = number of time steps, integer
+      - dt = time step (s), float
+      - start = start time, 'yyyy-mm-dd hh:mm:ss' string
+      - shape = number of nodes along longitude and latitude, (nx, ny).
+                Overrides nele
+      - domain = [lon min, lon max, lat min, lat max]
+      - seed = seed of the mesh, integer
+
+    Outputs:
+      - grid = mesh, see synthetic_mesh
+
+    *Notes*
+      - netcdf 3 file (scipy) with FVCOM names and dimensions, i.e. valid
+        nv, nbe, a1u, a2u, aw0, awx, awy, tidal ua, va, zeta and 3D u, v, ww
+      - same output for same options
+    """
+    grid = synthetic_mesh(nele=nele, shape=shape, domain=domain, seed=seed)
+    nele = grid['trinodes'].shape[0]
+    nnode = grid['lon'].shape[0]
+    if debug: print "Writing " + str(nele) + " elements, " + str(nnode) + " nodes..."
+    mtime = _mattime(start) + np.arange(ntime) * dt / 86400.0
+    h, zeta, dum, dum = tidal_fields(grid['lon'], grid['lat'], mtime, domain)
+    hc, dum, ua, va = tidal_fields(grid['lonc'], grid['latc'], mtime, domain)
+    siglay, siglev = _sigma(nlevel, nnode)
+
+    f = netcdf.netcdf_file(filename, 'w', version=2)
+    f.source = 'PySeidon synthetic FVCOM output'
+    f.createDimension('nele', nele)
+    f.createDimension('node', nnode)
+    f.createDimension('siglay', nlevel)
+    f.createDimension('siglev', nlevel + 1)
+    f.createDimension('three', 3)
+    f.createDimension('four', 4)
+    f.createDimension('time', ntime)
+    for key, dims in [('lon', ('node',)), ('lat', ('node',)),
+                      ('x', ('node',)), ('y', ('node',)),
+                      ('lonc', ('nele',)), ('latc', ('nele',)),
+                      ('xc', ('nele',)), ('yc', ('nele',)),
+                      ('a1u', ('four', 'nele')), ('a2u', ('four', 'nele')),
+                      ('aw0', ('three', 'nele')), ('awx', ('three', 'nele')),
+                      ('awy', ('three', 'nele'))]:
+        f.createVariable(key, 'f', dims)[:] = grid[key]
+    #One based indices, 0 for boundaries
+    f.createVariable('nv', 'i', ('three', 'nele'))[:] = grid['trinodes'].T + 1
+    f.createVariable('nbe', 'i', ('three', 'nele'))[:] = grid['triele'].T + 1
+    f.createVariable('h', 'f', ('node',))[:] = h
+    f.createVariable('siglay', 'f', ('siglay', 'node'))[:] = siglay
+    f.createVariable('siglev', 'f', ('siglev', 'node'))[:] = siglev
+    f.createVariable('time', 'd', ('time',))[:] = mtime - 678942.0
+    f.createVariable('zeta', 'f', ('time', 'node'))[:] = zeta
+    f.createVariable('ua', 'f', ('time', 'nele'))[:] = ua
+    f.createVariable('va', 'f', ('time', 'nele'))[:] = va
+    profile = _profile(siglay[:, :1])[None, :, :]
+    u = f.createVariable('u', 'f', ('time', 'siglay', 'nele'))
+    v = f.createVariable('v', 'f', ('time', 'siglay', 'nele'))
+    ww = f.createVariable('ww', 'f', ('time', 'siglay', 'nele'))
+    dua = np.zeros(ua.shape)
+    if ntime > 1:
+        dua = np.gradient(ua, axis=0)
+    #Written by time blocks, i.e. 3D fields never fully built
+    step = max(1, int(2**24 // (nlevel * nele)))
+    for t in range(0, ntime, step):
+        s = slice(t, min(t + step, ntime))
+        u[s] = ua[s][:, None, :] * profile
+        v[s] = va[s][:, None, :] * profile
+        ww[s] = 1.0e-3 * dua[s][:, None, :] *\
+                np.sin(np.pi * siglay[:, :1])[None, :, :]
+    f.close()
+
+    return grid
+
+def synthetic_station(filename, lon, lat, nlevel=10, ntime=144, dt=600.0,
+                      start='2013-08-01 00:00:00', domain=DOMAIN, debug=False):
+    """
+    Writes a synthetic FVCOM station file
+
+    Inputs:
+      - filename = path to the *.nc file, string
+      - lon, lat = station coordinates, 1D arrays
+
+    Options:
+      - see synthetic_fvcom
+    """
+    lon = np.asarray(lon, dtype=float).ravel()
+    lat = np.asarray(lat, dtype=float).ravel()
+    nsta = lon.shape[0]
+    mtime = _mattime(start) + np.arange(ntime) * dt / 86400.0
+    h, zeta, ua, va = tidal_fields(lon, lat, mtime, domain)
+    siglay, siglev = _sigma(nlevel, nsta)
+    x, y = _relative(lon, lat, 0.5 * (domain[0] + domain[1]),
+                     0.5 * (domain[2] + domain[3]))
+    names = np.array([list(('station_' + str(i)).ljust(20)) for i in range(nsta)])
+    if debug: print "Writing " + str(nsta) + " stations..."
+
+    f = netcdf.netcdf_file(filename, 'w', version=2)
+    f.source = 'PySeidon synthetic FVCOM station output'
+    f.createDimension('station', nsta)
+    f.createDimension('siglay', nlevel)
+    f.createDimension('siglev', nlevel + 1)
+    f.createDimension('namelen', 20)
+    f.createDimension('time', ntime)
+    for key, value in [('lon', lon), ('lat', lat), ('x', x), ('y', y), ('h', h)]:
+        f.createVariable(key, 'f', ('station',))[:] = value
+    f.createVariable('siglay', 'f', ('siglay', 'station'))[:] = siglay
+    f.createVariable('siglev', 'f', ('siglev', 'station'))[:] = siglev
+    f.createVariable('name_station', 'c', ('station', 'namelen'))[:] = names
+    days = np.floor(mtime - 678942.0)
+    f.createVariable('time_JD', 'i', ('time',))[:] = days
+    f.createVariable('time_second', 'f', ('time',))[:] =\
+        np.round((mtime - 678942.0 - days) * 86400.0)
+    f.createVariable('zeta', 'f', ('time', 'station'))[:] = zeta
+    f.createVariable('ua', 'f', ('time', 'station'))[:] = ua
+    f.createVariable('va', 'f', ('time', 'station'))[:] = va
+    profile = _profile(siglay[:, :1])[None, :, :]
+    f.createVariable('u', 'f', ('time', 'siglay', 'station'))[:] =\
+        ua[:, None, :] * profile
+    f.createVariable('v', 'f', ('time', 'siglay', 'station'))[:] =\
+        va[:, None, :] * profile
+    f.createVariable('ww', 'f', ('time', 'siglay', 'station'))[:] =\
+        np.zeros((ntime, nlevel, nsta))
+    f.close()
+
+def synthetic_adcp(filename, lon, lat, nbins=40, ntime=144, dt=600.0,
+                   start='2013-08-01 00:00:00', noise=0.05, domain=DOMAIN,
+                   seed=1, debug=False):
+    """
+    Writes a synthetic ADCP file, with the layout of the processed
+    ADCP files of the tutorials
+
+    Inputs:
+      - filename = path to the *.mat file, string
+      - lon, lat = ADCP coordinates, floats
+
+    Options:
+      - nbins = number of bins, integer
+      - noise = standard deviation of the measurement noise (m/s), float
+      - see synthetic_fvcom for the others
+    """
+    rand = np.random.RandomState(seed)
+    mtime = _mattime(start) + np.arange(ntime) * dt / 86400.0
+    h, el, ua, va = tidal_fields([lon], [lat], mtime, domain)
+    surf = h[0] + el[:, 0]
+    bins = np.linspace(0.5, 1.2 * surf.max(), nbins)
+    #Sigma coordinate of the bins, nan above the surface
+    sig = bins[None, :] / surf[:, None] - 1.0
+    profile = _profile(np.clip(sig, -1.0, 0.0))
+    east = ua[:, :1] * profile + noise * rand.randn(ntime, nbins)
+    north = va[:, :1] * profile + noise * rand.randn(ntime, nbins)
+    east[sig > 0.0] = np.nan
+    north[sig > 0.0] = np.nan
+    vert = noise * 0.1 * rand.randn(ntime, nbins)
+    vert[sig > 0.0] = np.nan
+    mag = np.sqrt(east**2 + north**2) * np.sign(north)
+    direction = np.rad2deg(np.arctan2(north, east))
+    if debug: print "Writing ADCP with " + str(nbins) + " bins..."
+    data = {'east_vel': east, 'north_vel': north, 'vert_vel': vert,
+            'mag_signed_vel': mag, 'dir_vel': direction, 'bins': bins[:, None]}
+    savemat(filename, {'lon': float(lon), 'lat': float(lat),
+                       'data': data, 'pres': {'surf': surf[None, :]},
+                       'time': {'mtime': mtime[None, :]},
+                       'Comments': ['PySeidon synthetic ADCP']},
+            oned_as='column')
+
+def synthetic_tidegauge(filename, lon, lat, ntime=288, dt=300.0,
+                        start='2013-08-01 00:00:00', noise=0.02, domain=DOMAIN,
+                        seed=2, debug=False):
+    """
+    Writes a synthetic tide gauge file, with the layout of the RBR files
+    of the tutorials
+
+    Inputs:
+      - filename = path to the *.mat file, string
+      - lon, lat = tide gauge coordinates, floats
+
+    Options:
+      - noise = standard deviation of the measurement noise (m), float
+      - see synthetic_fvcom for the others
+    """
+    rand = np.random.RandomState(seed)
+    mtime = _mattime(start) + np.arange(ntime) * dt / 86400.0
+    h, el, dum, dum = tidal_fields([lon], [lat], mtime, domain)
+    data = h[0] + el[:, 0] + noise * rand.randn(ntime)
+    if debug: print "Writing tide gauge..."
+    RBR = {'name': 'synthetic', 'sampleperiod': dt, 'data': data[:, None],
+           'date_num_Z': mtime[:, None], 'lat': float(lat), 'lon': float(lon)}
+    savemat(filename, {'RBR': RBR}, oned_as='column')
@@ -0,0 +1,150 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+from scipy.ndimage import correlate1d
+
+#Utility import
+from pyseidon.utilities.interpolation_utils import gather_columns
+from pyseidon.utilities.memory_budget import memory_budget
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Filter families and their default cut-off or window (h)
+FILTERS = {'godin': None, 'lanczos': 40.0, 'moving_average': 24.84}
+
+def _boxcar(n):
+    """Normalised moving average of n points"""
+    n = max(int(n), 1)
+    return np.ones(n) / n
+
+def filter_weights(kind='godin', dt=3600.0, cutoff=None):
+    """
+    Weights of a tidal low-pass filter
+
+    Inputs:
+      - kind = filter family, 'godin', 'lanczos' or 'moving_average'
+      - dt = time step in s, float
+
+    Options:
+      - cutoff = cut-off period (lanczos) or window length (moving_average)
+                 in hours, float. Default: 40h and 24.84h
+
+    Outputs:
+      - weights = symmetric weights summing to 1, 1D array of odd length
+
+    *Notes*
+      - godin = 24h, 24h and 25h moving averages in a row (Godin, 1972)
+      - lanczos = Lanczos-cosine filter, 1.5 cut-off periods on each side
+    """
+    if not kind in FILTERS:
+        raise PyseidonError("---Filter should be one of " + str(sorted(FILTERS.keys())) + "---")
+    if cutoff is None:
+        cutoff = FILTERS[kind]
+    hour = 3600.0 / dt
+    if kind == 'godin':
+        weights = np.convolve(np.convolve(_boxcar(round(24 * hour)),
+                                          _boxcar(round(24 * hour))),
+                              _boxcar(round(25 * hour)))
+    elif kind == 'moving_average':
+        weights = _boxcar(round(cutoff * hour))
+    else:
+        m = int(round(1.5 * cutoff * hour))
+        fc = 1.0 / (cutoff * hour)
+        k = np.arange(-m, m + 1, dtype=float)
+        sinc = 2.0 * fc * np.ones(k.shape)
+        sinc[k != 0] = np.sin(2.0 * np.pi * fc * k[k != 0]) / (np.pi * k[k != 0])
+        sigma = np.ones(k.shape)
+        sigma[k != 0] = np.sin(np.pi * k[k != 0] / (m + 1)) / (np.pi * k[k != 0] / (m + 1))
+        weights = sinc * sigma
+    #Even windows made symmetric around a central time step
+    if weights.shape[0] % 2 == 0:
+        weights = np.convolve(weights, [0.5, 0.5])
+
+    return weights / weights.sum()
+
+def low_pass(var, weights, time_ind=slice(None), step=1, filename=None,
+             memory=None, debug=False):
+    """
+    Low-pass filters any given variable along time, streaming over time
+    chunks
+
+    Inputs:
+      - var = variable, numpy array, netCDF4 variable or OpenDap proxy,
+              dim=(time, ...), ex: (time, nele) or (time, nlevel, nele)
+      - weights = filter weights, 1D array of odd length, see filter_weights
+
+    Options:
+      - time_ind = contiguous time window, slice
+      - step = subsampling of the filtered series, integer, ex: 24 for
+               daily residuals of hourly outputs
+      - filename = path to a .npy file the filtered field is written to,
+                   string. Default: in memory or memory mapped, see MemoryBudget
+      - memory = memory budget, see MemoryBudget. Default: shared one
+
+    Outputs:
+      - filtered = filtered variable, dim=(nout, ...), array or memmap
+      - index = time indices of the filtered time steps, 1D array (nout)
+
+    *Notes*
+      - only the time steps with a full window are kept, i.e. half the
+        filter length is lost at both ends
+      - chunks read with the half window on both sides, so each time
+        step is read about once, by element blocks if a time step does
+        not fit in the budget
+    """
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape[0] % 2 == 0:
+        raise PyseidonError("---Filter length must be odd---")
+    if memory is None:
+        memory = memory_budget()
+    half = weights.shape[0] // 2
+    shape = tuple(var.shape)
+    tind = np.arange(shape[0])[time_ind]
+    if tind.shape[0] > 1 and not np.all(np.diff(tind) == 1):
+        raise PyseidonError("---Filtering needs a contiguous time window---")
+    index = tind[half:tind.shape[0] - half][::step]
+    if index.shape[0] == 0:
+        raise PyseidonError("---Time window shorter than the filter---")
+    outshape = (index.shape[0],) + shape[1:]
+    if filename is None:
+        filtered = memory.allocate(outshape, name='low_pass')
+    else:
+        filtered = np.lib.format.open_memmap(filename, mode='w+', dtype=float,
+                                             shape=outshape)
+    #Input, filtered chunk and a copy held at once
+    lead = int(np.prod(shape[1:-1]))
+    ncol = shape[-1]
+    column = lead * 8 * 3
+    ncb = ncol
+    if (weights.shape[0] + step) * column * ncol > memory.budget:
+        ncb = max(1, int(memory.budget // ((weights.shape[0] + step) * column)))
+    length = int(memory.budget // (column * ncb)) - 2 * half
+    #Filtered time steps per chunk
+    nout = max(length // step, 1)
+    if debug:
+        print str(-(-index.shape[0] // nout)) + " time chunks of " +\
+              str(-(-ncol // ncb)) + " element blocks"
+    for c0 in range(0, ncol, ncb):
+        cols = slice(c0, min(c0 + ncb, ncol))
+        for o0 in range(0, index.shape[0], nout):
+            o1 = min(o0 + nout, index.shape[0])
+            #Read window with halos, in file time indices
+            first = index[o0] - half
+            last = index[o1 - 1] + half + 1
+            if ncb == ncol:
+                chunk = np.asarray(var[first:last])
+            else:
+                chunk = gather_columns(var, np.arange(cols.start, cols.stop),
+                                       time_ind=slice(first, last))
+            chunk = np.asarray(np.ma.filled(chunk, np.nan), dtype=float)
+            smooth = correlate1d(chunk, weights, axis=0, mode='constant')
+            filtered[o0:o1, ..., cols] = smooth[half:smooth.shape[0] - half:step]
+    if filename is not None:
+        filtered.flush()
+    if debug: print '...Passed'
+
+    return filtered, index
@@ -0,0 +1,152 @@
+#!/usr/bin/python2.7
+# encoding: utf-8
+
+#Libs import
+from __future__ import division
+import numpy as np
+
+#Utility import
+from pyseidon.utilities.regridding import level_interpolation
+
+# Custom error
+from pyseidon.utilities.pyseidon_error import PyseidonError
+
+#Hours per year, for annual energies
+YEAR = 365.25 * 24.0
+
+def power_curves_array(power_curves, nturb, curve_index=None):
+    """
+    Checks power curves and the curve of each turbine
+
+    Inputs:
+      - power_curves = power curve (speed (m/s), power (W)), 2D array (2, n),
+                       or list of them
+      - nturb = number of turbines, integer
+
+    Options:
+      - curve_index = power curve of each turbine, 1D array of integers (nturb).
+                      Default: first curve for all
+
+    Outputs:
+      - curves = list of 2D arrays (2, n), sorted by speed
+      - curve_index = 1D array of integers (nturb)
+    """
+    if type(power_curves) == np.ndarray and power_curves.ndim == 2:
+        power_curves = [power_curves]
+    curves = []
+    for curve in power_curves:
+        curve = np.asarray(curve, dtype=float)
+        if not (curve.ndim == 2 and curve.shape[0] == 2):
+            raise PyseidonError("---Power curves must be (speed, power) arrays of dim (2, n)---")
+        curves.append(curve[:, np.argsort(curve[0])])
+    if curve_index is None:
+        curve_index = np.zeros(nturb, dtype=int)
+    curve_index = np.asarray(curve_index, dtype=int).ravel()
+    if curve_index.shape[0] == 1:
+        curve_index = np.repeat(curve_index, nturb)
+    if not curve_index.shape[0] == nturb:
+        raise PyseidonError("---One curve index per turbine needed---")
+    if curve_index.min() < 0 or curve_index.max() >= len(curves):
+        raise PyseidonError("---Curve index out of range---")
+
+    return curves, curve_index
+
+def curve_power(speed, curves, curve_index):
+    """
+    Instantaneous power of turbines from their power curves
+
+    Inputs:
+      - speed = flow speed (m/s), array (..., nturb)
+      - curves = power curves, list of 2D arrays (2, n), see power_curves_array
+      - curve_index = power curve of each turbine, 1D array of integers (nturb)
+
+    Outputs:
+      - power = power (W), array (..., nturb)
+
+    *Notes*
+      - no power below the first speed (cut-in) or above the last speed
+        (cut-out) of the curve, nan where speed is nan
+      - one np.interp call per curve, whatever the number of turbines
+    """
+    speed = np.asarray(speed, dtype=float)
+    power = np.zeros(speed.shape)
+    for c, curve in enumerate(curves):
+        sel = np.where(curve_index == c)[0]
+        if sel.shape[0] == 0:
+            continue
+        power[..., sel] = np.interp(speed[..., sel], curve[0], curve[1],
+                                    left=0.0, right=0.0)
+    power[np.isnan(speed)] = np.nan
+
+    return power
+
+def hub_interpolation(var, depth, hub):
+    """
+    Linear interpolation of sigma level profiles at hub depths
+
+    Inputs:
+      - var = variable, 3D array (time, nlevel, npts)
+      - depth = depth of the sigma levels (m), 3D array (time, nlevel, npts),
+                decreasing along the levels
+      - hub = hub depths (m), 2D array (time, npts) or 1D array (npts)
+
+    Outputs:
+      - varH = var at hub depth, 2D array (time, npts)
+
+    *Notes*
+      - nearest level above the top level or below the bottom one, see
+        regridding.level_interpolation
+    """
+    hub = np.broadcast_to(hub, (depth.shape[0], depth.shape[2]))
+
+    return level_interpolation(var, depth, hub[:, None, :])[:, 0, :]
+
+def farm_summary(power, curves, curve_index):
+    """
+    Turbine and farm yields from power time series
+
+    Inputs:
+      - power = power (W), 2D array (time, nturb)
+      - curves = power curves, list of 2D arrays (2, n)
+      - curve_index = power curve of each turbine, 1D array of integers (nturb)
+
+    Outputs:
+      - summary = dictionary: 'mean_power' (W), 'capacity_factor',
+                  'annual_energy' (MWh/year) per turbine, 1D arrays (nturb),
+                  and 'farm_mean_power' (W), 'farm_annual_energy' (MWh/year)
+
+    *Notes*
+      - capacity factor relative to the largest power of the curve
+      - assumes evenly spaced time steps
+    """
+    rated = np.array([curve[1].max() for curve in curves])[curve_index]
+    mean = np.nanmean(power, axis=0)
+    summary = {'mean_power': mean,
+               'capacity_factor': mean / np.where(rated > 0.0, rated, np.nan),
+               'annual_energy': mean * YEAR / 1.0e6,
+               'farm_mean_power': np.nansum(mean),
+               'farm_annual_energy': np.nansum(mean) * YEAR / 1.0e6}
+
+    return summary
+
+def farm_assessment(speed, curves, curve_index):
+    """
+    Power time series and yields of a farm from the speed at its turbines
+
+    Inputs:
+      - speed = flow speed at the turbines (m/s), 2D array (time, nturb)
+      - curves = power curves, list of 2D arrays (2, n), see power_curves_array
+      - curve_index = power curve of each turbine, 1D array of integers (nturb)
+
+    Outputs:
+      - farm = dictionary: 'hub_speed' (m/s) and 'power' (W), 2D arrays
+               (time, nturb), 'farm_power' (W), 1D array (time), and the
+               yields of farm_summary
+    """
+    power = curve_power(speed, curves, curve_index)
+    farm = farm_summary(power, curves, curve_index)
+    farm['hub_speed'] = speed
+    farm['power'] = power
+    farm['farm_power'] = np.nansum(power, axis=1)
+
+    return farm
@@ -2,6 +2,7 @@
 # encoding: utf-8
 import numpy as np
 from scipy.interpolate import interp1d
+from pyseidon.utilities.regridding import sigma_to_z
 
 '''
 ASSUMPTIONS:
@@ -48,25 +49,21 @@ def sigmaToDepth(mod_data, mod_depth, siglay, bins, debug=False, debug_plot=Fals
     same format as ADCP output (i.e. constant depths, NaNs above surface)
 
     Outputs a 2D numpy array representing the FVCOM matrix in ADCP format.
+    All the columns are interpolated at once, see regridding.sigma_to_z.
     '''
     if debug: print "sigmaToDepth..."
-    bin_mod = np.zeros(mod_data.shape[0], bins.size)
-    bin_width = bins[1] - bins[0]
-
-    if debug: print "...loop through columns/steps and interpol..."
-    # loop through columns/steps
-    for i, column in enumerate(mod_data):
-        # create interpolation function
-        f_mod = interp1d(column, siglay)
-        depth = mod_depth[i]
-        # loop through bins
-        for j in np.arange(bins.size):
-            # check if location is above ADCP_TOP_SURF
-            loc = float(bins_width * j + bins[0]) / float(depth)
-            if (loc <= ADCP_TOP_SURF):
-                bin_mod[i][j] = f_mod(loc)
-            else:
-                bin_mod[i][j] = np.nan
+    mod_data = np.asarray(mod_data, dtype=float)
+    mod_depth = np.asarray(mod_depth, dtype=float).ravel()
+    bins = np.asarray(bins, dtype=float).ravel()
+
+    if debug: print "...interpol at the bin heights..."
+    # heights above the seabed as depths from the surface, top to bottom
+    depth = (np.abs(siglay)[None, ::-1] - 1.0) * mod_depth[:, None]
+    bin_mod = sigma_to_z(mod_data[:, ::-1, None], depth[:, :, None],
+                         mod_depth[:, None], bins, from_bottom=True)
+    bin_mod = bin_mod.filled(np.nan)[:, :, 0]
+    # bins above ADCP_TOP_SURF
+    bin_mod[bins[None, :] > ADCP_TOP_SURF * mod_depth[:, None]] = np.nan
 
     if debug: print "...sigmaToDepth done."
 
@@ -6,15 +6,16 @@ from __future__ import division
 import numpy as np
 import pandas as pd
 import cPickle as pkl
+from multiprocessing import Pool
 
 #Quick fix
 from scipy.io import savemat
-from utide import solve
+from pyseidon.utilities.lazy_import import lazy_function
 
 #Local import
 from compareData import *
 from valTable import valTable
-from variablesValidation import _load_validation
+from variablesValidation import _load_validation, _batch_extraction
 from pyseidon.utilities.interpolation_utils import *
 
 # Local import
@@ -22,6 +23,102 @@ from plotsValidation import taylorDiagram, benchmarksMap
 # Custom error
 from pyseidon.utilities.pyseidon_error import PyseidonError
 
+#Imported on first use
+solve = lazy_function('utide', 'solve')
+
+
+def _site_benchmarks(struct, threeD, depth, filename, plot=False, save_csv=False,
+                     debug=False, debug_plot=False):
+    """
+    Computes the validation benchmarks of a single measurement site
+
+    Inputs:
+      - struct = validation structure of the site, see _load_validation
+      - threeD = boolean, True for 3D comparison
+      - depth = depth at which the validation will be performed, float
+      - filename = file name of the .csv file to be saved, string
+
+    Outputs:
+      - struct = validation structure updated with the benchmark suites
+      - Benchmarks = benchmark table, pandas DataFrame
+
+    *Notes*
+      - module level function so it can be dispatched to worker processes
+    """
+    vars = []
+    if struct['type'] == 'ADCP':
+        (elev_suite, speed_suite, dir_suite, u_suite, v_suite,
+         vel_suite, csp_suite) = compareUV(struct, threeD,
+                                plot=plot, depth=depth, save_csv=save_csv,
+                                debug=debug, debug_plot=debug_plot)
+        struct['elev_val'] = elev_suite
+        struct['speed_val'] = speed_suite
+        struct['dir_val'] = dir_suite
+        struct['u_val'] = u_suite
+        struct['v_val'] = v_suite
+        struct['vel_val'] = vel_suite
+        # custom benchmark
+        struct['cubic_speed_val'] = csp_suite
+        # Variable to processed
+        vars.append('elev')
+        vars.append('speed')
+        vars.append('dir')
+        vars.append('u')
+        vars.append('v')
+        vars.append('vel')
+        # custom var
+        vars.append('cubic_speed')
+
+    elif struct['type'] == 'TideGauge':
+        elev_suite_dg = compareTG(struct,
+                                  plot=plot, save_csv=save_csv,
+                                  debug=debug, debug_plot=debug_plot)
+        struct['tg_val'] = elev_suite_dg
+        #Variable to processed
+        vars.append('tg')
+
+    elif struct['type'] == 'Drifter':
+        (elev_suite, speed_suite, dir_suite, u_suite, v_suite,
+         vel_suite, csp_suite) = compareUV(struct, threeD,
+                                depth=depth, plot=plot, save_csv=save_csv,
+                                debug=debug, debug_plot=debug_plot)
+
+        struct['speed_val'] = speed_suite
+        struct['dir_val'] = dir_suite
+        struct['u_val'] = u_suite
+        struct['v_val'] = v_suite
+        # custom benchmark
+        struct['vel_val'] = vel_suite
+        struct['cubic_speed_val'] = csp_suite
+
+        # Variable to processed
+        vars.append('speed')
+        vars.append('dir')
+        vars.append('u')
+        vars.append('v')
+        vars.append('vel')
+        # custom var
+        vars.append('vel')
+        vars.append('cubic_speed')
+
+    else:
+        raise PyseidonError("-This kind of measurements is not supported yet-")
+
+    # Make csv file
+    Benchmarks = valTable(struct, filename,  vars,
+                          debug=debug, debug_plot=debug_plot)
+
+    return struct, Benchmarks
+
+def _site_benchmarks_worker(args):
+    """
+    Pool wrapper around _site_benchmarks, returns None if the site fails
+    """
+    try:
+        return _site_benchmarks(*args)
+    except PyseidonError:
+        return None
+
 
 class Validation:
     """
@@ -95,82 +192,18 @@ class Validation:
         debug = debug or self._debug
         debug_plot = debug_plot or self._debug_plot
         #User input
-        if filename==[]:
-            filename = raw_input('Enter filename for csv file: ')
-            filename = str(filename)
-        if type(self._flow) == float:
-            depth = self._flow
-        if (depth==[] and self.Variables._3D):
-            depth = input('Depth from surface at which the validation will be performed: ')
-            depth = float(depth)
-            if depth < 0.0: depth = -1.0 * depth
-        if depth==[]: depth=5.0
+        filename, depth = self._user_inputs(filename, depth, self.Variables._3D)
 
         #initialisation
-        vars = []
         threeD = self.Variables.sim._3D
         if self._flow == 'daf': threeD = False
-
-        if self.Variables.struct['type'] == 'ADCP':
-            (elev_suite, speed_suite, dir_suite, u_suite, v_suite,
-             vel_suite, csp_suite) = compareUV(self.Variables.struct, threeD,
-                                    plot=plot, depth=depth, save_csv=save_csv,
-                                    debug=debug, debug_plot=debug_plot)
-            self.Variables.struct['elev_val'] = elev_suite
-            self.Variables.struct['speed_val'] = speed_suite
-            self.Variables.struct['dir_val'] = dir_suite
-            self.Variables.struct['u_val'] = u_suite
-            self.Variables.struct['v_val'] = v_suite
-            self.Variables.struct['vel_val'] = vel_suite
-            # custom benchmark
-            self.Variables.struct['cubic_speed_val'] = csp_suite
-            # Variable to processed
-            vars.append('elev')
-            vars.append('speed')
-            vars.append('dir')
-            vars.append('u')
-            vars.append('v')
-            vars.append('vel')
-            # custom var
-            vars.append('cubic_speed')
-
-        elif self.Variables.struct['type'] == 'TideGauge':
-            elev_suite_dg = compareTG(self.Variables.struct,
-                                      plot=plot, save_csv=save_csv,
-                                      debug=debug, debug_plot=debug_plot)
-            self.Variables.struct['tg_val'] = elev_suite_dg
-            #Variable to processed
-            vars.append('tg')
-
-        elif self.Variables.struct['type'] == 'Drifter':
-            (elev_suite, speed_suite, dir_suite, u_suite, v_suite,
-             vel_suite, csp_suite) = compareUV(self.Variables.struct, self.Variables._3D,
-                                    depth=depth, plot=plot, save_csv=save_csv,
-                                    debug=debug, debug_plot=debug_plot)
-
-            self.Variables.struct['speed_val'] = speed_suite
-            self.Variables.struct['dir_val'] = dir_suite
-            self.Variables.struct['u_val'] = u_suite
-            self.Variables.struct['v_val'] = v_suite
-            # custom benchmark
-            self.Variables.struct['vel_val'] = vel_suite
-            self.Variables.struct['cubic_speed_val'] = csp_suite
-
-            # Variable to processed
-            vars.append('speed')
-            vars.append('dir')
-            vars.append('u')
-            vars.append('v')
-            vars.append('vel')
-            # custom var
-            vars.append('vel')
-            vars.append('cubic_speed')
-
-        else:
-            raise PyseidonError("-This kind of measurements is not supported yet-")
+        if self.Variables.struct['type'] == 'Drifter':
+            threeD = self.Variables._3D
 
         # Make csv file
-        self._Benchmarks = valTable(self.Variables.struct, filename,  vars,
+        self.Variables.struct, self._Benchmarks = _site_benchmarks(
+                                    self.Variables.struct, threeD, depth, filename,
+                                    plot=plot, save_csv=save_csv,
                                     debug=debug, debug_plot=debug_plot)
 
         # Display csv
@@ -179,6 +212,23 @@ class Validation:
         print(self._Benchmarks)
         pd.reset_option('display.max_rows')
 
+    def _user_inputs(self, filename, depth, threeD):
+        """
+        Asks for the csv file name and the validation depth if not provided
+        """
+        if filename==[]:
+            filename = raw_input('Enter filename for csv file: ')
+            filename = str(filename)
+        if type(self._flow) == float:
+            depth = self._flow
+        if (depth==[] and threeD):
+            depth = input('Depth from surface at which the validation will be performed: ')
+            depth = float(depth)
+            if depth < 0.0: depth = -1.0 * depth
+        if depth==[]: depth=5.0
+
+        return filename, depth
+
     def _validate_harmonics(self, filename='', save_csv=False, debug=False, debug_plot=False):
         """
         This method computes and store in a csv file the error in %
@@ -373,7 +423,8 @@ class Validation:
         else:
             print "-No matching harmonic coefficients for velocity-"
 
-    def validate_data(self, filename=[], depth=[], plot=False, save_csv=False, debug=False, debug_plot=False):
+    def validate_data(self, filename=[], depth=[], plot=False, save_csv=False,
+                      workers=1, debug=False, debug_plot=False):
         """
         This method computes series of standard validation benchmarks.
 
@@ -384,6 +435,8 @@ class Validation:
           - plot = plot series of validation graphs, boolean.
           - save_csv = will save benchmark values into *.csv file
                        as well as associated plots in specific folderssta
+          - workers = number of processes used to compute the benchmarks
+                      of multiple measurement sites, integer.
 
         *References*
           - NOAA. NOS standards for evaluating operational nowcast and
@@ -404,18 +457,56 @@ class Validation:
             self._validate_data(filename, depth, plot, save_csv, debug, debug_plot)
             self.Benchmarks = self._Benchmarks
         else:
-            I=0
-            for meas in self._observed:
+            debug = debug or self._debug
+            debug_plot = debug_plot or self._debug_plot
+            threeD = self._simulated.Variables._3D
+            if self._flow == 'daf': threeD = False
+            #Model time series extracted once for all the sites
+            series = _batch_extraction(self._observed, self._simulated,
+                                       flow=self._flow, debug=debug)
+            loaded = []
+            for meas, sim_series in zip(self._observed, series):
                 try:
-                    self.Variables = _load_validation(meas, self._simulated, flow=self._flow, debug=self._debug)
-                    self._validate_data(filename, depth, plot, save_csv, debug, debug_plot)
-                    if I == 0:
-                        self.Benchmarks = self._Benchmarks
-                        I += 1
-                    else:
-                        self.Benchmarks = pd.concat([self.Benchmarks, self._Benchmarks])
+                    loaded.append(_load_validation(meas, self._simulated,
+                                                   flow=self._flow,
+                                                   sim_series=sim_series,
+                                                   debug=self._debug))
                 except PyseidonError:
-                    pass
+                    continue
+            #User input, asked once for all the sites. No depth for
+            #drifters, see _load_validation
+            askD = threeD and any([not V.struct['type'] == 'Drifter'
+                                   for V in loaded])
+            filename, depth = self._user_inputs(filename, depth, askD)
+            sites = []
+            for Variables in loaded:
+                siteD = threeD
+                if Variables.struct['type'] == 'Drifter':
+                    siteD = Variables._3D
+                sites.append((Variables, (Variables.struct, siteD, depth,
+                                          filename, plot, save_csv,
+                                          debug, debug_plot)))
+            if workers > 1 and len(sites) > 1:
+                if debug: print "Computing benchmarks on " + str(workers) + " processes..."
+                pool = Pool(processes=workers)
+                try:
+                    results = pool.map(_site_benchmarks_worker,
+                                       [args for Variables, args in sites])
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [_site_benchmarks_worker(args) for Variables, args in sites]
+
+            tables = []
+            for (Variables, args), result in zip(sites, results):
+                if result is None: continue
+                Variables.struct, Benchmarks = result
+                self.Variables = Variables
+                self._Benchmarks = Benchmarks
+                tables.append(Benchmarks)
+            if not tables == []:
+                self.Benchmarks = pd.concat(tables)
         if save_csv:
             try:
                 out_file = '{}_val.csv'.format(filename)
@@ -505,7 +596,7 @@ class Validation:
             #TR: Force caching Variables otherwise error during loading
             #    with 'netcdf4.Variable' type (see above)
             for key in data['Variables']:
-                listkeys=['Variable', 'ArrayProxy', 'BaseType']
+                listkeys=['Variable', 'ArrayProxy', 'BaseType', '_CachedArray']
                 if any([type(data['Variables'][key]).__name__==x for x in listkeys]):
                     if debug:
                         print "Force caching for " + key
@@ -537,7 +628,7 @@ class Validation:
             #TR: Force caching Variables otherwise error during loading
             #    with 'netcdf4.Variable' type (see above)
             for key in Var:
-                listkeys=['Variable', 'ArrayProxy', 'BaseType']
+                listkeys=['Variable', 'ArrayProxy', 'BaseType', '_CachedArray']
                 if any([type(Var[key]).__name__==x for x in listkeys]):
                     if debug:
                         print "Force caching for " + key
@@ -7,10 +7,64 @@ from datetime import datetime, timedelta
 
 #Local import
 from pyseidon.utilities.interpolation_utils import *
+from pyseidon.utilities.miscellaneous import time_overlap, overlap_indices
 
 # Custom error
 from pyseidon.utilities.pyseidon_error import PyseidonError
 
+def _batch_extraction(observed, simulated, flow='sf', debug=False):
+    """
+    Interpolates the simulated time series at all the measurement sites at once
+
+    Inputs:
+      - observed = list of measurement objects (ADCP, TideGauge, Drifter)
+      - simulated = FVCOM object
+
+    Outputs:
+      - series = list of dictionaries of simulated time series, one per
+                 measurement object, with keys 'el', 'ua', 'va'
+                 (and 'u', 'v', 'siglay' if 3D). None for drifters
+
+    Options:
+      - flow = flow comparison, 'daf', 'sf' or a float number
+
+    *Notes*
+      - every model variable is read once for all the sites, only the
+        columns surrounding the sites are loaded
+    """
+    series = [None] * len(observed)
+    if not simulated.__module__=='pyseidon.fvcomClass.fvcomClass':
+        return series
+    sites = [i for i, meas in enumerate(observed)
+             if not meas.__module__=='pyseidon.drifterClass.drifterClass']
+    if sites == []:
+        return series
+    if debug: print "...Interpolation at all measurement locations..."
+    lons = np.array([float(observed[i].Variables.lon) for i in sites])
+    lats = np.array([float(observed[i].Variables.lat) for i in sites])
+    index = simulated.Util2D.index_finder(lons, lats)
+    sim = simulated.Variables
+    batch = {}
+    batch['el'] = simulated.Util2D.interpolation_at_points(sim.el, lons, lats,
+                                                           index=index)
+    batch['ua'] = simulated.Util2D.interpolation_at_points(sim.ua, lons, lats,
+                                                           index=index)
+    batch['va'] = simulated.Util2D.interpolation_at_points(sim.va, lons, lats,
+                                                           index=index)
+    if (not flow == 'daf') and sim._3D:
+        batch['u'] = simulated.Util2D.interpolation_at_points(sim.u, lons, lats,
+                                                              index=index)
+        batch['v'] = simulated.Util2D.interpolation_at_points(sim.v, lons, lats,
+                                                              index=index)
+        batch['siglay'] = simulated.Util2D.interpolation_at_points(
+                                    simulated.Grid.siglay, lons, lats, index=index)
+    for k, i in enumerate(sites):
+        series[i] = {}
+        for key in batch.keys():
+            series[i][key] = batch[key][..., k]
+
+    return series
+
 class _load_validation:
     """
     **'Variables' subset in Validation class**
@@ -22,7 +76,8 @@ class _load_validation:
                             |_struct. = dictionnary structure for validation purposes
 
     """
-    def __init__(self, observed, simulated, flow='sf', debug=False, debug_plot=False):
+    def __init__(self, observed, simulated, flow='sf', sim_series=None,
+                 debug=False, debug_plot=False):
         if debug: print "..variables.."
         self.obs = observed.Variables
         self.sim = simulated.Variables
@@ -44,23 +99,13 @@ class _load_validation:
         simMin = self.sim.matlabTime.min()
         absMin = max(obsMin, simMin)
         absMax = min(obsMax, simMax)
-        A = set(np.where(self.sim.matlabTime[:] >= absMin)[0].tolist())
-        B = set(np.where(self.sim.matlabTime[:] <= absMax)[0].tolist())
-        C = list(A.intersection(B))
-        #-Correction by J.Culina 2014-
-        C = sorted(C)
-        #-end-
-        self._C = np.asarray(C)
-
-        a = set(np.where(self.obs.matlabTime[:] >= absMin)[0].tolist())
-        b = set(np.where(self.obs.matlabTime[:] <= absMax)[0].tolist())
-        c = list(a.intersection(b))
-        #-Correction by J.Culina 2014-
-        c = sorted(c)
-        #-end-
-        self._c = np.asarray(c)
+        self._C = time_overlap(self.sim.matlabTime, absMin, absMax)
+        self._c = time_overlap(self.obs.matlabTime, absMin, absMax)
+        C = self._C
+        c = self._c
+        self._nC = overlap_indices(C, self.sim.matlabTime.shape[0]).shape[0]
 
-        if len(C) == 0:
+        if self._nC == 0:
             raise PyseidonError("---Time between simulation and measurement does not match up---")
 
         #Check what kind of simulated data it is
@@ -88,7 +133,17 @@ class _load_validation:
         elif simulated.__module__=='pyseidon.fvcomClass.fvcomClass':
             self._simtype = 'fvcom'
             #Different treatment measurements come from drifter
-            if not observed.__module__=='pyseidon.drifterClass.drifterClass':
+            if (not observed.__module__=='pyseidon.drifterClass.drifterClass'
+                and sim_series is not None):
+                #Time series already extracted for all sites, see _batch_extraction
+                el = sim_series['el']
+                ua = sim_series['ua']
+                va = sim_series['va']
+                if self._3D:
+                    u = sim_series['u']
+                    v = sim_series['v']
+                    sig = sim_series['siglay']
+            elif not observed.__module__=='pyseidon.drifterClass.drifterClass':
                 if debug: print "...Interpolation at measurement location..."
                 el = simulated.Util2D.interpolation_at_point(self.sim.el,
                                                              self.obs.lon, self.obs.lat)
@@ -105,6 +160,7 @@ class _load_validation:
                                                                   self.obs.lon, self.obs.lat)
             else: #Interpolation for drifter
                 if debug: print "...Interpolation at measurement locations & times..."
+                level = None
                 if self._3D:
                     lock=True
                     userInp = flow
@@ -112,32 +168,17 @@ class _load_validation:
                         if userInp == 'daf':
                             if debug:
                                 print 'flow comparison is depth-averaged'
-                            # TR: temporary fix for proxy access
-                            if self.sim._opendap:
-                                uSim = np.zeros((self._C.shape[0], self.sim.ua.shape[1]))
-                                vSim = np.zeros((self._C.shape[0], self.sim.va.shape[1]))
-                                for i, j in enumerate(self._C):
-                                    uSim[i,:] = self.sim.ua[j,:]
-                                    vSim[i,:] = self.sim.va[j,:]
-                            else:
-                                uSim = np.squeeze(self.sim.ua[self._C,:])
-                                vSim = np.squeeze(self.sim.va[self._C,:])
+                            uSim = self.sim.ua
+                            vSim = self.sim.va
                             self._3D = False
                             lock=False
                         elif userInp == 'sf':
                             #Import only the surface velocities
                             #TR_comment: is surface vertical indice -1 or 0?
                             #KC : 0 is definitely the surface...
-                            # TR: temporary fix for proxy access
-                            if self.sim._opendap:
-                                uSim = np.zeros((self._C.shape[0], self.sim.u.shape[2]))
-                                vSim = np.zeros((self._C.shape[0], self.sim.v.shape[2]))
-                                for i, j in enumerate(self._C):
-                                    uSim[i,:] = self.sim.u[j,0,:]
-                                    vSim[i,:] = self.sim.v[j,0,:]
-                            else:
-                                uSim = np.squeeze(self.sim.u[self._C,0,:])
-                                vSim = np.squeeze(self.sim.v[self._C,0,:])
+                            uSim = self.sim.u
+                            vSim = self.sim.v
+                            level = 0
                             self._3D = False
                             lock=False
                             if debug:
@@ -146,38 +187,20 @@ class _load_validation:
                             if debug:
                                 print 'flow comparison at depth level ', float
                             if userInp > 0.0: userInp = userInp*-1.0
-                            uInterp = simulated.Util3D.interp_at_depth(self.sim.u[:], userInp, debug=debug)
-                            vInterp = simulated.Util3D.interp_at_depth(self.sim.v[:], userInp, debug=debug)
-                            # TR: temporary fix for proxy access
-                            if self.sim._opendap:
-                                uSim = np.zeros((self._C.shape[0], uInterp.shape[1]))
-                                vSim = np.zeros((self._C.shape[0], vInterp.shape[1]))
-                                for i, j in enumerate(self._C):
-                                    uSim[i,:] = uInterp[j,:]
-                                    vSim[i,:] = vInterp[j,:]
-                            else:
-                                uSim = np.squeeze(uInterp[self._C,:])
-                                vSim = np.squeeze(vInterp[self._C,:])
+                            uSim = simulated.Util3D.interp_at_depth(self.sim.u[:], userInp, debug=debug)
+                            vSim = simulated.Util3D.interp_at_depth(self.sim.v[:], userInp, debug=debug)
                             self._3D = False
                             lock=False
                         else:
                             userInp = input("compare flow by 'daf', 'sf' or a float number only!!!")
                 else:
-                    # TR: temporary fix for proxy access
-                    if self.sim._opendap:
-                        uSim = np.zeros((self._C.shape[0], self.sim.ua.shape[1]))
-                        vSim = np.zeros((self._C.shape[0], self.sim.va.shape[1]))
-                        for i, j in enumerate(self._C):
-                            uSim[i,:] = self.sim.ua[j,:]
-                            vSim[i,:] = self.sim.va[j,:]
-                    else:
-                        uSim = np.squeeze(self.sim.ua[self._C,:])
-                        vSim = np.squeeze(self.sim.va[self._C,:])
+                    uSim = self.sim.ua
+                    vSim = self.sim.va
 
                 # Finding the closest Drifter time to simulated data assuming measurement
                 # time step way faster than model one
                 indClosest = []
-                for i in self._C:
+                for i in overlap_indices(self._C, self.sim.matlabTime.shape[0]):
                     ind = np.abs(self.obs.matlabTime[:]-self.sim.matlabTime[i]).argmin()
                     indClosest.append(ind)
                 # Keep only unique values to avoid sampling in measurement gaps
@@ -191,23 +214,18 @@ class _load_validation:
 
                 uObs = self.obs.u[uniqCloInd]
                 vObs = self.obs.v[uniqCloInd]
-                uSim = np.squeeze(uSim[uniqInd[:],:])
-                vSim = np.squeeze(vSim[uniqInd[:],:])
-
-                # print 'uObs: \n', uObs, '\nvObs: \n', vObs
-                # print 'uSim: \n', vSim.shape, '\nuSim: \n', vSim.shape
 
-                #Interpolation of timeseries at drifter's trajectory points
-                uSimInterp = np.zeros(len(uniqCloInd))
-                vSimInterp = np.zeros(len(uniqCloInd))
-                for i in range(len(uniqCloInd)):
-                    uSimInterp[i]=simulated.Util2D.interpolation_at_point(uSim[i,:],
-                                                self.obs.lon[uniqCloInd[i]],
-                                                self.obs.lat[uniqCloInd[i]])
-                    vSimInterp[i]=simulated.Util2D.interpolation_at_point(vSim[i,:],
-                                                self.obs.lon[uniqCloInd[i]],
-                                                self.obs.lat[uniqCloInd[i]])
-                #print 'vSimInterp: \n', vSimInterp, '\nuSimInterp: \n', uSimInterp
+                #Interpolation in space and time along drifter's trajectory
+                trackTime = self.obs.matlabTime[uniqCloInd]
+                trackLon = self.obs.lon[uniqCloInd]
+                trackLat = self.obs.lat[uniqCloInd]
+                index = simulated.Util2D.index_finder(trackLon, trackLat)
+                uSimInterp = simulated.Util2D.interpolation_along_track(uSim,
+                                    trackTime, trackLon, trackLat,
+                                    level=level, index=index, debug=debug)
+                vSimInterp = simulated.Util2D.interpolation_along_track(vSim,
+                                    trackTime, trackLon, trackLat,
+                                    level=level, index=index, debug=debug)
 
         else:
             raise PyseidonError("-This type of simulations is not supported yet-")
@@ -38,7 +38,7 @@ else:
       packages=find_packages(),
       package_dir={'PySeidon' :'pyseidon'},
       install_requires=['setuptools', 'utide', 'numpy', 'pandas', 'pydap', 'pydap',
-                        'networkx', 'seaborn', 'scipy','matplotlib', 'h5py', 'numexpr',
+                        'seaborn', 'scipy','matplotlib', 'h5py', 'numexpr',
                         'datetime', 'netCDF4'],
       zip_safe=False)
 